@@ -1,5 +1,5 @@
 # backend/app/__init__.py
-# Version 1.2
+# Version 1.7
 import os
 from flask import Flask, Blueprint, jsonify
 from flask_cors import CORS
@@ -63,11 +63,25 @@ def create_app(config_name: str | None = None):
     db.init_app(app)
     migrate.init_app(app, db)
 
+    # Caches Mermaid : analyse, fragments générés, artefacts d'export
+    from app.services.mermaid_parse_cache import parse_cache
+    from app.services.mermaid_fragment_cache import fragment_cache
+    from app.services.mermaid_artifact_cache import artifact_cache
+    parse_cache.init_app(app)
+    fragment_cache.init_app(app)
+    artifact_cache.init_app(app)
+
+    # Layout automatique des SubProjects, calculé en arrière-plan
+    from app.services.mermaid_layout import layout_worker
+    layout_worker.init_app(app)
+
     # Enregistrement des gestionnaires d'erreurs
     app.register_error_handler(400, handle_api_error) # Bad Request
     app.register_error_handler(404, handle_api_error) # Not Found
     app.register_error_handler(405, handle_api_error) # Method Not Allowed
+    app.register_error_handler(413, handle_api_error) # Payload Too Large (budgets d'analyse Mermaid)
     app.register_error_handler(500, handle_api_error) # Internal Server Error
+    app.register_error_handler(501, handle_api_error) # Not Implemented (format d'export indisponible)
 
     # Importation des modèles pour que Flask puisse les voir (nécessaire pour Alembic/SQLAlchemy)
     from app import models  # noqa: F401
@@ -91,4 +105,8 @@ def create_app(config_name: str | None = None):
     app.register_blueprint(classdefs_bp, url_prefix='/api/classdefs')
     app.register_blueprint(subgraphs_bp, url_prefix='/api/subgraphs') # NOUVEAU
 
+    # Commandes CLI (flask mermaid ...)
+    from app.cli import mermaid_cli
+    app.cli.add_command(mermaid_cli)
+
     return app
\ No newline at end of file
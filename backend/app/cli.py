@@ -0,0 +1,51 @@
+# backend/app/cli.py
+# Version 1.0
+"""
+Commandes `flask` de l'application.
+
+    flask mermaid import-dir <répertoire> --project-title "Ma Saga" [--workers N]
+    flask mermaid import-dir saga.tar.gz --project-title "Ma Saga"
+"""
+
+import json
+import os
+
+import click
+from flask.cli import AppGroup
+from werkzeug.exceptions import HTTPException
+
+from app.services.mermaid_bulk_import import bulk_import_mermaid, iter_directory_sources, iter_tar_sources
+
+mermaid_cli = AppGroup('mermaid', help="Commandes d'import/export Mermaid.")
+
+
+@mermaid_cli.command('import-dir')
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--project-title', required=True, help="Projet cible (créé s'il n'existe pas).")
+@click.option('--workers', type=int, default=None, help="Processus d'analyse (défaut : MERMAID_BULK_IMPORT_WORKERS).")
+@click.option('--json', 'as_json', is_flag=True, help="Affiche le rapport complet en JSON.")
+def import_dir(path: str, project_title: str, workers, as_json: bool) -> None:
+    """Importe les fichiers .mmd d'un répertoire ou d'une archive tar dans un projet."""
+    try:
+        if os.path.isdir(path):
+            report = bulk_import_mermaid(iter_directory_sources(path), project_title, workers)
+        else:
+            with open(path, 'rb') as archive:
+                report = bulk_import_mermaid(iter_tar_sources(archive), project_title, workers)
+    except HTTPException as e:
+        raise click.ClickException(e.description)
+
+    if as_json:
+        click.echo(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        for file_report in report['files']:
+            if file_report['status'] == 'failed':
+                click.echo(f"ÉCHEC  {file_report['name']} : {file_report['error']}", err=True)
+            else:
+                click.echo(f"{file_report['status']:<7} {file_report['name']} "
+                           f"(analyse {file_report['parse_seconds']:.3f}s, écriture {file_report['write_seconds']:.3f}s)")
+        click.echo(f"{report['imported']} importé(s), {report['failed']} échec(s) en {report['total_seconds']:.2f}s "
+                   f"avec {report['workers']} processus.")
+
+    if report['failed']:
+        raise SystemExit(1)
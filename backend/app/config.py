@@ -1,5 +1,5 @@
 # backend/app/config.py
-# Version 1.0
+# Version 1.8
 
 import os
 from dotenv import load_dotenv
@@ -28,6 +28,49 @@ class BaseConfig:
         'max_overflow': 20,     # Connexions supplémentaires au-delà du pool_size
     }
 
+    # Import Mermaid en flux : nombre d'entités envoyées à la base par lot
+    MERMAID_IMPORT_BATCH_SIZE = int(os.environ.get('MERMAID_IMPORT_BATCH_SIZE', 1000))
+
+    # Import par tranches : nombre de lignes écrites et validées (commit) par transaction
+    MERMAID_IMPORT_CHUNK_SIZE = int(os.environ.get('MERMAID_IMPORT_CHUNK_SIZE', 50000))
+    # Budgets d'analyse propres à l'import par tranches (0 = illimité), à la place de MERMAID_MAX_LINES
+    # et MERMAID_MAX_ENTITIES : ce mode est destiné aux diagrammes qui dépassent l'import ordinaire
+    MERMAID_CHUNKED_MAX_LINES = int(os.environ.get('MERMAID_CHUNKED_MAX_LINES', 2000000))
+    MERMAID_CHUNKED_MAX_ENTITIES = int(os.environ.get('MERMAID_CHUNKED_MAX_ENTITIES', 5000000))
+
+    # Chargement COPY (PostgreSQL) d'un nouveau SubProject à partir de ce nombre de nœuds + relations (-1 pour le désactiver)
+    MERMAID_COPY_MIN_ROWS = int(os.environ.get('MERMAID_COPY_MIN_ROWS', 2000))
+
+    # Import en masse : nombre de processus d'analyse (0 = nombre de CPU, 1 = analyse dans le processus courant)
+    MERMAID_BULK_IMPORT_WORKERS = int(os.environ.get('MERMAID_BULK_IMPORT_WORKERS', 0))
+
+    # Cache LRU des analyses Mermaid (0 pour le désactiver)
+    MERMAID_PARSE_CACHE_MAX_ENTRIES = int(os.environ.get('MERMAID_PARSE_CACHE_MAX_ENTRIES', 64))
+    MERMAID_PARSE_CACHE_MAX_BYTES = int(os.environ.get('MERMAID_PARSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+    # Cache des fragments du code Mermaid généré, en nombre de SubProjects (0 pour le désactiver)
+    MERMAID_FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('MERMAID_FRAGMENT_CACHE_MAX_ENTRIES', 16))
+
+    # Cache disque des exports (désactivé sans répertoire), borné en octets ; avec un préfixe,
+    # les artefacts sont délégués au serveur frontal par X-Accel-Redirect (location interne nginx)
+    MERMAID_EXPORT_CACHE_DIR = os.environ.get('MERMAID_EXPORT_CACHE_DIR')
+    MERMAID_EXPORT_CACHE_MAX_BYTES = int(os.environ.get('MERMAID_EXPORT_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+    MERMAID_EXPORT_ACCEL_REDIRECT_PREFIX = os.environ.get('MERMAID_EXPORT_ACCEL_REDIRECT_PREFIX')
+
+    # Layout automatique en couches : nombre de processus de calcul en arrière-plan (0 = calcul dans la requête)
+    MERMAID_LAYOUT_WORKERS = int(os.environ.get('MERMAID_LAYOUT_WORKERS', 1))
+
+    # Export d'une fenêtre : profondeur maximale (les demandes plus profondes sont ramenées à ce maximum)
+    # et nombre maximal de nœuds (0 = illimité) ; au-delà, la fenêtre est tronquée à la dernière couche complète
+    MERMAID_WINDOW_MAX_DEPTH = int(os.environ.get('MERMAID_WINDOW_MAX_DEPTH', 5))
+    MERMAID_WINDOW_MAX_NODES = int(os.environ.get('MERMAID_WINDOW_MAX_NODES', 5000))
+
+    # Budgets d'analyse Mermaid (0 = illimité) : au-delà, la requête est rejetée en 413
+    MERMAID_MAX_LINE_LENGTH = int(os.environ.get('MERMAID_MAX_LINE_LENGTH', 10000))
+    MERMAID_MAX_LINES = int(os.environ.get('MERMAID_MAX_LINES', 200000))
+    MERMAID_MAX_ENTITIES = int(os.environ.get('MERMAID_MAX_ENTITIES', 500000))
+    MERMAID_PARSE_TIMEOUT = float(os.environ.get('MERMAID_PARSE_TIMEOUT', 0))  # secondes
+
     # URL du frontend pour la configuration CORS
     FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:5000') # Par défaut, le frontend tourne sur le port 5000
 
@@ -53,6 +96,7 @@ class TestingConfig(BaseConfig):
     # Utilise une base de données en mémoire pour les tests afin d'isoler les exécutions
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     SQLALCHEMY_TRACK_MODIFICATIONS = False # Pas nécessaire en mémoire
+    MERMAID_LAYOUT_WORKERS = 0 # Layout calculé dans la requête (base en mémoire propre au processus)
 
 class ProductionConfig(BaseConfig):
     """Configuration pour l'environnement de production."""
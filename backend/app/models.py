@@ -1,13 +1,13 @@
 # backend/app/models.py
-# Version 1.2
+# Version 1.8
 """
 Modèles de données pour l'éditeur visuel de structure narrative Mermaid.
 Utilise SQLAlchemy 2.0 avec typage moderne pour la compatibilité avec Flask-Migrate.
 """
 import enum
 from typing import Optional, List
-from sqlalchemy import String, Text, ForeignKey, Enum as SQLEnum, JSON, UniqueConstraint
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import Integer, String, Text, ForeignKey, Enum as SQLEnum, JSON, UniqueConstraint, event, inspect
+from sqlalchemy.orm import Mapped, mapped_column, object_session, relationship
 from . import db
 
 
@@ -47,6 +47,16 @@ class SubProject(db.Model):
     graph_direction: Mapped[str] = mapped_column(String(10), nullable=False, server_default="TD", default="TD")
     mermaid_definition: Mapped[str] = mapped_column(Text, nullable=False)
     visual_layout: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    # Layout automatique en couches (mermaid_layout) ; écrit par une mise à jour ciblée, sans changer la version
+    auto_layout: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True, deferred=True)
+    # Empreinte canonique de la structure parsée de mermaid_definition (None = à recalculer, voir get_structure_hash)
+    structure_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    # Carte des sources de mermaid_definition : entité -> intervalle de lignes (None = à recalculer)
+    source_map: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    # Point de reprise d'un import par tranches en cours {'phase', 'position'} (None = SubProject publié)
+    import_checkpoint: Mapped[Optional[dict]] = mapped_column(JSON(none_as_null=True), nullable=True)
+    # Version croissante, incrémentée par toute écriture de structure ou de métadonnées (ETag des routes)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default="1", default=1)
 
     # Relations
     project: Mapped["Project"] = relationship(back_populates="subprojects")
@@ -56,6 +66,31 @@ class SubProject(db.Model):
     subgraphs: Mapped[List["Subgraph"]] = relationship(back_populates="subproject", cascade="all, delete-orphan")
 
 
+@event.listens_for(SubProject.mermaid_definition, 'set')
+def _invalidate_definition_metadata(target: SubProject, value, oldvalue, initiator) -> None:
+    """
+    Toute réécriture de la définition rend l'empreinte structurelle et la carte des sources caduques.
+    Les chemins qui synchronisent ou régénèrent la structure les recalculent après avoir assigné le texte.
+    """
+    target.structure_hash = None
+    target.source_map = None
+
+
+def bump_subproject_version(subproject: SubProject) -> None:
+    """Incrémente la version en base (version = version + 1, sûr en concurrence) ; relue après le flush."""
+    subproject.version = SubProject.version + 1
+
+
+@event.listens_for(SubProject, 'before_update')
+def _bump_version_on_write(mapper, connection, target: SubProject) -> None:
+    """Toute écriture de la ligne subproject (titre, layout, définition...) change sa version."""
+    if inspect(target).attrs.version.history.has_changes():
+        return
+    session = object_session(target)
+    if session is not None and session.is_modified(target, include_collections=False):
+        bump_subproject_version(target)
+
+
 # --- NOUVEAU : Modèle Subgraph (Conteneur de Nœuds) ---
 class Subgraph(db.Model):
     """
@@ -1,22 +1,94 @@
 # backend/app/routes/mermaid.py
-# Version 1.0
+# Version 2.4
 
-from flask import Blueprint, request, jsonify
-from werkzeug.exceptions import BadRequest, NotFound
+import gzip
+import io
+import os
+from typing import Iterator, Optional
 
-from app.services.mermaid_parser import parse_and_save_mermaid
-from app.services.mermaid_generator import generate_mermaid_from_subproject
+from flask import Blueprint, Response, current_app, request, jsonify, send_file, stream_with_context
+from werkzeug.exceptions import BadRequest, Conflict, NotFound, RequestEntityTooLarge
+
+from app import db
+from app.services.mermaid_parser import parse_and_save_mermaid, import_mermaid_stream, parse_limits, get_source_map
+from app.services.mermaid_exporters import DEFAULT_FORMAT, GraphExporter, get_exporter, iter_export
+from app.services.mermaid_artifact_cache import artifact_cache
+from app.services.mermaid_layout import get_auto_layout
+from app.services.mermaid_window import DEFAULT_WINDOW_MAX_DEPTH, MermaidWindow, generate_mermaid_window
+from app.services.subprojects import get_subproject_version, subproject_etag
+from app.services.mermaid_parse_cache import parse_cache
+from app.services.mermaid_validation import validate_mermaid
+from app.services.mermaid_bulk_import import bulk_import_mermaid, iter_upload_sources, iter_tar_sources
+from app.services.mermaid_chunked_import import (
+    ChunkedImportInterrupted, discard_chunked_import, get_chunked_import_status, import_mermaid_chunked,
+    resume_chunked_import,
+)
 from app.models import Project, SubProject # Import models for type hinting and potential serialization
 
 # Création du Blueprint pour les routes liées à Mermaid
 mermaid_bp = Blueprint('mermaid_bp', __name__)
 
+# Envois d'un artefact d'export tentés avant de repasser à l'export en flux (artefact évincé entre-temps)
+ARTIFACT_SEND_ATTEMPTS = 2
+
+
+def _serialize_imported_project(project: Project) -> dict:
+    """
+    Sérialisation de l'objet Project pour la réponse API.
+    On utilise une approche simple ici, une sérialisation Pydantic serait plus robuste.
+    """
+    project_data = {
+        "id": project.id,
+        "title": project.title,
+        "subprojects": []
+    }
+    for sp in project.subprojects:
+        project_data["subprojects"].append({
+            "id": sp.id,
+            "title": sp.title,
+            "mermaid_definition": sp.mermaid_definition # Peut être utile pour confirmation
+        })
+    return project_data
+
+
+def _iter_request_lines(max_line_length: int = 0) -> Iterator[str]:
+    """
+    Lit le corps brut de la requête ligne par ligne, sans le charger en mémoire.
+    Le corps peut être compressé en gzip (en-tête Content-Encoding: gzip).
+    Avec `max_line_length`, une ligne sans fin est lue par tronçons bornés : le premier tronçon
+    trop long suffit à l'analyseur pour rejeter le flux (413).
+    """
+    stream = request.stream
+    if request.content_encoding == 'gzip':
+        binary = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif isinstance(stream, io.RawIOBase):
+        binary = io.BufferedReader(stream)
+    else:
+        binary = stream
+    text = io.TextIOWrapper(binary, encoding=request.mimetype_params.get('charset', 'utf-8'))
+    if not max_line_length:
+        return iter(text)
+    return iter(lambda: text.readline(max_line_length + 2), '')
+
+
 @mermaid_bp.route('/import', methods=['POST'])
 def import_mermaid():
     """
     Endpoint pour importer un code Mermaid et le sauvegarder dans la base de données.
     Expects a JSON payload with 'code' (Mermaid string) and optionally 'project_title'.
+
+    Mode flux : avec un corps 'text/plain' (éventuellement 'Content-Encoding: gzip'), le code est lu
+    et analysé ligne par ligne ; le titre du projet est alors passé en paramètre 'project_title'.
+
+    Mode par tranches : avec 'chunked': true, les entités sont validées par tranches et l'import
+    peut être repris après un échec (503 avec 'subproject_id' et 'checkpoint').
     """
+    if request.mimetype == 'text/plain':
+        project_title = request.args.get('project_title', "Graphe Importé")
+        lines = _iter_request_lines(current_app.config.get('MERMAID_MAX_LINE_LENGTH', 0))
+        project = import_mermaid_stream(lines, project_title)
+        return jsonify(_serialize_imported_project(project)), 201
+
     data = request.get_json()
 
     if not data or 'code' not in data:
@@ -27,47 +99,244 @@ def import_mermaid():
 
     try:
         # Appel au service de parsing
-        project = parse_and_save_mermaid(mermaid_code, project_title)
-
-        # Sérialisation de l'objet Project pour la réponse API
-        # On utilise une approche simple ici, une sérialisation Pydantic serait plus robuste
-        project_data = {
-            "id": project.id,
-            "title": project.title,
-            "subprojects": []
-        }
-        for sp in project.subprojects:
-            project_data["subprojects"].append({
-                "id": sp.id,
-                "title": sp.title,
-                "mermaid_definition": sp.mermaid_definition # Peut être utile pour confirmation
-            })
-
-        return jsonify(project_data), 201 # 201 CREATED est approprié pour une importation réussie
-
-    except BadRequest as e:
-        # Les erreurs spécifiques (parsing, validation) sont déjà des BadRequest
+        if data.get('chunked'):
+            project = import_mermaid_chunked(mermaid_code, project_title)
+        else:
+            project = parse_and_save_mermaid(mermaid_code, project_title)
+
+        return jsonify(_serialize_imported_project(project)), 201 # 201 CREATED est approprié pour une importation réussie
+
+    except (BadRequest, Conflict, RequestEntityTooLarge, ChunkedImportInterrupted) as e:
+        # Les erreurs spécifiques (parsing, validation, budgets d'analyse) sont déjà des erreurs HTTP
         raise e
     except Exception as e:
         # Gestion des erreurs serveur imprévues
         raise BadRequest(description=f"Erreur lors de l'importation du code Mermaid : {str(e)}")
 
 
+@mermaid_bp.errorhandler(ChunkedImportInterrupted)
+def handle_chunked_import_interrupted(e: ChunkedImportInterrupted):
+    """Réponse d'un import par tranches interrompu : de quoi le reprendre ou l'abandonner."""
+    return jsonify({
+        'error': e.description,
+        'status_code': e.code,
+        'subproject_id': e.subproject_id,
+        'checkpoint': e.checkpoint,
+    }), e.code
+
+
+@mermaid_bp.route('/import/<int:subproject_id>', methods=['GET'])
+def get_import_status(subproject_id: int):
+    """
+    Endpoint d'état d'un import par tranches : 'staging' et son point de reprise, ou 'published'.
+    """
+    return jsonify(get_chunked_import_status(subproject_id)), 200
+
+
+@mermaid_bp.route('/import/<int:subproject_id>/resume', methods=['POST'])
+def resume_import(subproject_id: int):
+    """
+    Endpoint de reprise d'un import par tranches interrompu, depuis son dernier point de reprise.
+    """
+    project = resume_chunked_import(subproject_id)
+    return jsonify(_serialize_imported_project(project)), 200
+
+
+@mermaid_bp.route('/import/<int:subproject_id>', methods=['DELETE'])
+def discard_import(subproject_id: int):
+    """
+    Endpoint d'abandon d'un import par tranches non publié (suppression du SubProject en préparation).
+    """
+    discard_chunked_import(subproject_id)
+    return '', 204
+
+
+@mermaid_bp.route('/validate', methods=['POST'])
+def validate():
+    """
+    Endpoint de validation à blanc : analyse le code sans toucher à la base de données.
+    Accepte un JSON {'code': ...} ou un corps 'text/plain'. Répond 200 avec 'valid',
+    les diagnostics (ligne/colonne), le nombre d'entités et le temps d'analyse ;
+    413 si le code dépasse les budgets d'analyse.
+    """
+    if request.mimetype == 'text/plain':
+        mermaid_code = request.get_data(as_text=True)
+    else:
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('code'), str):
+            raise BadRequest("Requête invalide : le corps JSON doit contenir une clé 'code' avec le code Mermaid.")
+        mermaid_code = data['code']
+
+    return jsonify(validate_mermaid(mermaid_code, parse_limits())), 200
+
+
+@mermaid_bp.route('/bulk-import', methods=['POST'])
+def bulk_import():
+    """
+    Endpoint d'import en masse de fichiers Mermaid (.mmd) dans un même projet ('project_title' en paramètre).
+    Accepte un envoi multipart (champ 'files' : fichiers .mmd et/ou archives tar) ou un corps
+    'application/x-tar' (éventuellement 'application/gzip'). Retourne un rapport par fichier.
+    """
+    project_title = request.args.get('project_title', "Import en masse")
+
+    if request.mimetype in ('application/x-tar', 'application/gzip', 'application/x-gzip'):
+        sources = iter_tar_sources(request.stream)
+    elif request.files:
+        sources = iter_upload_sources(request.files.getlist('files'))
+    else:
+        raise BadRequest("Requête invalide : envoyer des fichiers .mmd (multipart, champ 'files') ou une archive tar.")
+
+    report = bulk_import_mermaid(sources, project_title)
+    return jsonify(report), 200
+
+
+def _window_from_args(format_name: str) -> Optional[MermaidWindow]:
+    """
+    Fenêtre demandée par les paramètres 'focus' (ids de nœuds séparés par des virgules), 'subgraph',
+    'class' et 'depth' (1 par défaut, ramené à MERMAID_WINDOW_MAX_DEPTH), ou None pour l'export complet.
+    """
+    focus = tuple(mermaid_id for mermaid_id in request.args.get('focus', '').split(',') if mermaid_id)
+    subgraph = request.args.get('subgraph') or None
+    style_class = request.args.get('class') or None
+    if not (focus or subgraph or style_class):
+        return None
+    if format_name != DEFAULT_FORMAT:
+        raise BadRequest("Requête invalide : une fenêtre (focus, subgraph, class) ne s'exporte qu'au format Mermaid.")
+    try:
+        depth = int(request.args.get('depth', 1))
+    except ValueError:
+        depth = -1
+    if depth < 0:
+        raise BadRequest("Requête invalide : 'depth' doit être un entier positif ou nul.")
+    depth = min(depth, current_app.config.get('MERMAID_WINDOW_MAX_DEPTH', DEFAULT_WINDOW_MAX_DEPTH))
+    return MermaidWindow(focus, depth, subgraph, style_class)
+
+
+def _send_artifact(path: str, mimetype: str, etag: str) -> Response:
+    """
+    Sert un artefact d'export sans que Python en lise les octets : X-Accel-Redirect vers le serveur
+    frontal si un préfixe est configuré, sinon send_file (sendfile, ou X-Sendfile avec USE_X_SENDFILE).
+    """
+    if artifact_cache.accel_redirect_prefix:
+        response = Response(status=200, mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{artifact_cache.accel_redirect_prefix.rstrip('/')}/{os.path.basename(path)}"
+        response.set_etag(etag)
+        return response
+    return send_file(path, mimetype=mimetype, etag=etag, max_age=0)
+
+
+def _export_artifact(subproject_id: int, version: int, exporter: GraphExporter, etag: str) -> Optional[Response]:
+    """
+    Réponse servie depuis l'artefact de la version (écrit au besoin). Un artefact évincé par un autre
+    processus entre sa recherche et son envoi est reconstruit (ARTIFACT_SEND_ATTEMPTS essais). None si
+    la version a changé pendant l'écriture (artefact non enregistré) ou si l'artefact reste introuvable.
+    """
+    for _ in range(ARTIFACT_SEND_ATTEMPTS):
+        path = artifact_cache.get_or_build(
+            subproject_id, version, exporter.extension, lambda: iter_export(subproject_id, exporter.name),
+            lambda: get_subproject_version(subproject_id),
+        )
+        if path is None:
+            return None
+        try:
+            return _send_artifact(path, exporter.mimetype, etag)
+        except FileNotFoundError:
+            current_app.logger.debug("Artefact %s évincé avant l'envoi : reconstruction", path)
+    return None
+
+
 @mermaid_bp.route('/export/<int:subproject_id>', methods=['GET'])
 def export_mermaid(subproject_id: int):
     """
-    Endpoint pour exporter un SubProject sous forme de code Mermaid.
+    Endpoint pour exporter un SubProject, par défaut sous forme de code Mermaid. Le paramètre 'format'
+    choisit un autre format : 'json' (JSON Graph Format), 'graphml', 'dot' (Graphviz) ou 'msgpack'
+    (instantané compact, si le paquet msgpack est installé).
+    Fenêtre : avec 'focus=A,B', 'subgraph=G1' et/ou 'class=hot', seul le voisinage de ces nœuds à
+    'depth' liens près (1 par défaut) est exporté en Mermaid, les liens vers l'extérieur aboutissant
+    à des nœuds d'amorce.
+    La réponse est envoyée en flux, par morceaux, au fil de la lecture des lignes en base.
+    Si l'ETag (version du SubProject et format) correspond à If-None-Match, 304 Not Modified est renvoyé
+    après la lecture de la seule ligne du SubProject. Avec un cache d'artefacts configuré, l'export
+    de chaque version est écrit une fois sur disque puis servi depuis le fichier.
     """
+    # Format inconnu (400) ou indisponible (501), fenêtre invalide (400) : erreurs HTTP levées avant toute lecture
+    exporter = get_exporter(request.args.get('format', DEFAULT_FORMAT))
+    window = _window_from_args(exporter.name)
+
     try:
-        # Appel au service de génération
-        mermaid_code = generate_mermaid_from_subproject(subproject_id)
+        version = get_subproject_version(subproject_id)
+        if window is not None:
+            variant = f"window-{window.digest}"
+        else:
+            variant = None if exporter.name == DEFAULT_FORMAT else exporter.extension
+        etag = subproject_etag(subproject_id, version, variant)
+        if request.if_none_match.contains_weak(etag):
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag)
+            return not_modified
+
+        if window is not None:
+            response = Response(generate_mermaid_window(subproject_id, window), status=200, content_type=exporter.mimetype)
+            response.set_etag(etag)
+            return response
+
+        if artifact_cache.enabled:
+            response = _export_artifact(subproject_id, version, exporter, etag)
+            if response is not None:
+                return response
+            # Version changée pendant l'écriture de l'artefact (ou artefact introuvable) : export en flux
+            etag = subproject_etag(subproject_id, get_subproject_version(subproject_id), variant)
 
-        # Retourne le code Mermaid en texte brut
-        return mermaid_code, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+        # Appel au service d'export (l'existence du SubProject est vérifiée avant le premier morceau)
+        chunks = iter_export(subproject_id, exporter.name)
+
+        # Le contexte reste actif pendant l'envoi (session DB)
+        response = Response(stream_with_context(chunks), status=200, content_type=exporter.mimetype)
+        response.set_etag(etag)
+        return response
 
     except NotFound as e:
         # L'erreur NotFound est déjà gérée par le gestionnaire global de l'app
         raise e
     except Exception as e:
         # Gestion des erreurs serveur imprévues
-        raise BadRequest(description=f"Erreur lors de l'exportation du code Mermaid pour le SubProject {subproject_id} : {str(e)}")
\ No newline at end of file
+        raise BadRequest(description=f"Erreur lors de l'exportation du SubProject {subproject_id} : {str(e)}")
+
+
+@mermaid_bp.route('/source-map/<int:subproject_id>', methods=['GET'])
+def get_subproject_source_map(subproject_id: int):
+    """
+    Endpoint retournant la carte des sources de la définition Mermaid d'un SubProject : pour chaque
+    nœud, lien (clé 'source cible'), classDef et subgraph, l'intervalle de lignes [début, fin].
+    Une carte absente (définition antérieure à la fonctionnalité) est calculée puis enregistrée.
+    """
+    subproject = db.session.get(SubProject, subproject_id)
+    if subproject is None:
+        raise NotFound(f"SubProject ID {subproject_id} non trouvé.")
+
+    stored = subproject.source_map is not None
+    source_map = get_source_map(subproject)
+    if not stored:
+        db.session.commit()
+    return jsonify({'subproject_id': subproject_id, 'source_map': source_map}), 200
+
+
+@mermaid_bp.route('/layout/<int:subproject_id>', methods=['GET'])
+def get_subproject_layout(subproject_id: int):
+    """
+    Endpoint retournant le layout automatique en couches d'un SubProject : centre de chaque nœud, boîte
+    de chaque subgraph et points intermédiaires des liens, pour la structure courante. S'il n'est pas
+    encore calculé, le calcul est lancé en arrière-plan et 202 est renvoyé (à redemander plus tard).
+    """
+    layout = get_auto_layout(subproject_id)
+    if layout is None:
+        return jsonify({'subproject_id': subproject_id, 'status': 'pending'}), 202
+    return jsonify({'subproject_id': subproject_id, 'status': 'ready', 'layout': layout}), 200
+
+
+@mermaid_bp.route('/parse-cache', methods=['GET'])
+def get_parse_cache_stats():
+    """
+    Endpoint exposant les compteurs du cache d'analyse Mermaid (entrées, octets estimés, hits/misses).
+    """
+    return jsonify(parse_cache.stats()), 200
@@ -1,13 +1,16 @@
 # backend/app/routes/subprojects.py
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 from http import HTTPStatus
 
 from app.services.subprojects import (
     get_all_subprojects,
     get_subproject_by_id,
+    get_subproject_etag,
     create_subproject,
     update_subproject_structure,
+    update_subproject_text,
     update_subproject_metadata,
+    is_structure_unchanged,
     delete_subproject
 )
 
@@ -42,11 +45,23 @@ def add_subproject():
 
 @subprojects_bp.route('/<int:subproject_id>', methods=['GET'])
 def get_subproject(subproject_id: int):
-    """Endpoint pour récupérer un sous-projet spécifique par ID."""
+    """
+    Endpoint pour récupérer un sous-projet spécifique par ID.
+    Réponse conditionnelle : si l'ETag (version du sous-projet) correspond à If-None-Match,
+    304 Not Modified est renvoyé sans charger les nœuds ni les relations.
+    """
+    etag = get_subproject_etag(subproject_id)
+    if request.if_none_match.contains_weak(etag):
+        not_modified = Response(status=HTTPStatus.NOT_MODIFIED)
+        not_modified.set_etag(etag)
+        return not_modified
+
     subproject = get_subproject_by_id(subproject_id)
     subproject_read_schema = SubProjectRead.model_validate(subproject).model_dump()
 
-    return jsonify(subproject_read_schema), HTTPStatus.OK
+    response = jsonify(subproject_read_schema)
+    response.set_etag(etag)
+    return response, HTTPStatus.OK
 
 @subprojects_bp.route('/<int:subproject_id>', methods=['PUT'])
 def update_subproject_route(subproject_id: int):
@@ -63,13 +78,16 @@ def update_subproject_route(subproject_id: int):
     # Charger l'existant pour comparer les définitions Mermaid
     existing = get_subproject_by_id(subproject_id)
     
-    # Si la définition Mermaid a changé, reconstruire la structure
-    if existing.mermaid_definition.strip() != schema.mermaid_definition.strip():
-        updated = update_subproject_structure(subproject_id, schema)
-    else:
-        # Sinon, mettre à jour uniquement les métadonnées
+    if existing.mermaid_definition.strip() == schema.mermaid_definition.strip():
+        # Texte identique : mettre à jour uniquement les métadonnées
         meta = SubProjectMetadataUpdate(title=schema.title, visual_layout=schema.visual_layout)
         updated = update_subproject_metadata(subproject_id, meta)
+    elif is_structure_unchanged(existing, schema.mermaid_definition):
+        # Changement cosmétique (espaces, commentaires, ordre des lignes) : pas de resynchronisation
+        updated = update_subproject_text(subproject_id, schema)
+    else:
+        # La structure Mermaid a changé : la reconstruire
+        updated = update_subproject_structure(subproject_id, schema)
 
     return jsonify(SubProjectRead.model_validate(updated).model_dump()), HTTPStatus.OK
 
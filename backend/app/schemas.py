@@ -1,5 +1,5 @@
 # backend/app/schemas.py
-# Version 1.3
+# Version 1.4
 
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel, ConfigDict, Field
@@ -113,6 +113,7 @@ class SubProjectCreate(SubProjectBase):
 class SubProjectRead(SubProjectBase):
     """Schéma de lecture d'un SubProject, incluant les relations imbriquées."""
     id: int
+    version: int = 1
 
     # Relations imbriquées (Liste des schémas Read déjà définis)
     nodes: List[NodeRead] = []
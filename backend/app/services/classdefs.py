@@ -1,9 +1,9 @@
 # backend/app/services/classdefs.py
-# Version 1.0
+# Version 1.3
 """
 Service layer for ClassDef business logic.
-Handles CRUD operations and ensures data consistency, such as updating
-the parent SubProject's Mermaid definition upon changes.
+Handles CRUD operations and ensures data consistency; the parent SubProject's
+Mermaid definition is regenerated once at commit time (see mermaid_generator).
 """
 
 from typing import List, Optional
@@ -14,7 +14,7 @@ from sqlalchemy import update as sqlalchemy_update
 from app import db
 from app.models import ClassDef, SubProject, Node
 from app.schemas import ClassDefCreate
-from app.services.mermaid_generator import generate_mermaid_from_subproject
+from app.services.mermaid_fragment_cache import mark_stale
 
 
 def get_classdef_by_id(classdef_id: int) -> ClassDef:
@@ -54,7 +54,7 @@ def get_all_classdefs(subproject_id: Optional[int] = None) -> List[ClassDef]:
 
 def create_classdef(data: ClassDefCreate) -> ClassDef:
     """
-    Creates a new ClassDef and regenerates the SubProject's Mermaid definition.
+    Creates a new ClassDef; the SubProject's Mermaid definition is regenerated on commit.
 
     Args:
         data: The Pydantic schema containing the data for the new ClassDef.
@@ -80,8 +80,7 @@ def create_classdef(data: ClassDefCreate) -> ClassDef:
     new_classdef = ClassDef(**data.model_dump())
     db.session.add(new_classdef)
 
-    # Regenerate Mermaid definition (AC 2.7) and commit atomically
-    subproject.mermaid_definition = generate_mermaid_from_subproject(subproject.id)
+    # The Mermaid definition is regenerated (AC 2.7) within the same commit
     db.session.commit()
 
     return new_classdef
@@ -89,7 +88,7 @@ def create_classdef(data: ClassDefCreate) -> ClassDef:
 
 def update_classdef(classdef_id: int, data: ClassDefCreate) -> ClassDef:
     """
-    Updates an existing ClassDef and regenerates the SubProject's Mermaid definition.
+    Updates an existing ClassDef; the SubProject's Mermaid definition is regenerated on commit.
 
     Args:
         classdef_id: The ID of the ClassDef to update.
@@ -121,8 +120,7 @@ def update_classdef(classdef_id: int, data: ClassDefCreate) -> ClassDef:
     if not subproject:
          raise NotFound(f"SubProject with ID {classdef.subproject_id} not found.")
 
-    # Regenerate Mermaid definition (AC 2.7) and commit atomically
-    subproject.mermaid_definition = generate_mermaid_from_subproject(subproject.id)
+    # The Mermaid definition is regenerated (AC 2.7) within the same commit
     db.session.commit()
 
     return classdef
@@ -130,8 +128,8 @@ def update_classdef(classdef_id: int, data: ClassDefCreate) -> ClassDef:
 
 def delete_classdef(classdef_id: int) -> None:
     """
-    Deletes a ClassDef, clears its references from Nodes, and regenerates
-    the SubProject's Mermaid definition.
+    Deletes a ClassDef and clears its references from Nodes; the SubProject's
+    Mermaid definition is regenerated on commit.
 
     Args:
         classdef_id: The ID of the ClassDef to delete.
@@ -149,16 +147,16 @@ def delete_classdef(classdef_id: int) -> None:
 
     # AC 2.4: Set style_class_ref to NULL for all nodes using this class
     # Use a bulk update for efficiency
-    db.session.execute(
+    cleared_node_ids = db.session.scalars(
         sqlalchemy_update(Node)
         .where(Node.subproject_id == subproject_id, Node.style_class_ref == classdef_name)
         .values(style_class_ref=None)
-    )
+        .returning(Node.id)
+    ).all()
+    mark_stale(subproject_id, nodes=cleared_node_ids)
 
     # Now, delete the ClassDef object
     db.session.delete(classdef)
 
-    # AC 2.7: Regenerate the mermaid definition to reflect the changes
-    subproject.mermaid_definition = generate_mermaid_from_subproject(subproject_id)
-
+    # AC 2.7: the mermaid definition is regenerated within the same commit
     db.session.commit()
\ No newline at end of file
@@ -0,0 +1,159 @@
+# backend/app/services/mermaid_artifact_cache.py
+# Version 1.1
+"""
+Cache disque des exports, adressé par (SubProject, version, format).
+
+Un export est écrit une fois dans le répertoire configuré (MERMAID_EXPORT_CACHE_DIR), par morceaux,
+dans un fichier temporaire renommé atomiquement : plusieurs processus peuvent partager le
+répertoire. Les requêtes suivantes pour la même version sont servies depuis le fichier par
+send_file (sendfile, X-Sendfile) ou déléguées au serveur frontal (X-Accel-Redirect) : Python ne
+relit ni ne copie plus les octets. La taille totale est bornée ; les fichiers les moins récemment
+servis (date de modification, rafraîchie à chaque accès) sont supprimés en premier.
+
+Les artefacts sont lisibles par tous (ARTIFACT_MODE) : le serveur frontal qui les sert en
+X-Accel-Redirect tourne sous un autre utilisateur. Un artefact n'est enregistré que si la version
+du SubProject n'a pas changé pendant son écriture : son nom désigne toujours le contenu de sa version.
+"""
+
+import os
+import re
+import tempfile
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy import event
+
+from app.models import SubProject
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# Droits des artefacts (mkstemp crée en 0600, conservé par le renommage)
+ARTIFACT_MODE = 0o644
+
+_ARTIFACT_NAME = re.compile(r'^sp(\d+)-v(\d+)\.(\w+)$')
+
+
+class MermaidArtifactCache:
+    """Répertoire d'artefacts d'export borné en octets (LRU) ; désactivé sans répertoire."""
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.accel_redirect_prefix: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """Applique le répertoire, la limite et le préfixe X-Accel-Redirect de la configuration."""
+        self.directory = app.config.get('MERMAID_EXPORT_CACHE_DIR') or None
+        self.max_bytes = app.config.get('MERMAID_EXPORT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        self.accel_redirect_prefix = app.config.get('MERMAID_EXPORT_ACCEL_REDIRECT_PREFIX') or None
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.max_bytes > 0
+
+    @staticmethod
+    def artifact_name(subproject_id: int, version: int, extension: str) -> str:
+        return f"sp{subproject_id}-v{version}.{extension}"
+
+    def get_or_build(self, subproject_id: int, version: int, extension: str,
+                     build: Callable[[], Iterable[Union[str, bytes]]],
+                     current_version: Callable[[], int]) -> Optional[str]:
+        """
+        Chemin de l'artefact de cette version, écrit à partir des morceaux de `build()` s'il n'existe pas.
+        Si `current_version()`, relue après l'écriture, n'est plus `version`, le contenu peut relever
+        d'une version plus récente : il n'est pas enregistré et None est retourné.
+        Les versions précédentes du même export sont supprimées à l'écriture.
+        """
+        path = os.path.join(self.directory, self.artifact_name(subproject_id, version, extension))
+        try:
+            os.utime(path)  # Accès : l'artefact redevient le plus récent pour l'éviction
+            return path
+        except FileNotFoundError:
+            pass
+
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(descriptor, 'wb') as artifact:
+                for chunk in build():
+                    artifact.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            if current_version() != version:
+                _remove(temporary_path)
+                return None
+            os.chmod(temporary_path, ARTIFACT_MODE)
+            os.replace(temporary_path, path)
+        except BaseException:
+            try:
+                os.remove(temporary_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        self._evict(keep=path, subproject_id=subproject_id, extension=extension)
+        return path
+
+    def _artifacts(self) -> List[Tuple[str, re.Match, os.stat_result]]:
+        artifacts = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                match = _ARTIFACT_NAME.match(entry.name)
+                if match is None:
+                    continue
+                try:
+                    artifacts.append((entry.path, match, entry.stat()))
+                except FileNotFoundError:
+                    pass  # Supprimé par un autre processus
+        return artifacts
+
+    def _evict(self, keep: str, subproject_id: int, extension: str) -> None:
+        """Supprime les versions périmées de l'export écrit, puis les moins récents au-delà de max_bytes."""
+        with self._lock:
+            artifacts = []
+            for path, match, stat in self._artifacts():
+                if path != keep and int(match.group(1)) == subproject_id and match.group(3) == extension:
+                    _remove(path)
+                else:
+                    artifacts.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in artifacts)
+            for _, size, path in sorted(artifacts):
+                if total <= self.max_bytes:
+                    break
+                if path != keep:
+                    _remove(path)
+                    total -= size
+
+    def discard(self, subproject_id: int) -> None:
+        """Supprime tous les artefacts d'un SubProject."""
+        if not self.enabled:
+            return
+        for path, match, _ in self._artifacts():
+            if int(match.group(1)) == subproject_id:
+                _remove(path)
+
+    def stats(self) -> Dict[str, int]:
+        if not self.enabled:
+            return {'entries': 0, 'bytes': 0, 'max_bytes': self.max_bytes}
+        artifacts = self._artifacts()
+        return {
+            'entries': len(artifacts),
+            'bytes': sum(stat.st_size for _, _, stat in artifacts),
+            'max_bytes': self.max_bytes,
+        }
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Instance partagée, configurée par create_app()
+artifact_cache = MermaidArtifactCache()
+
+
+@event.listens_for(SubProject, 'after_delete')
+def _discard_deleted_subproject(mapper, connection, target: SubProject) -> None:
+    """Un identifiant réutilisé (SQLite) repart en version 1 : les artefacts du SubProject supprimé disparaissent."""
+    artifact_cache.discard(target.id)
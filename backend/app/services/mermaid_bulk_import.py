@@ -0,0 +1,237 @@
+# backend/app/services/mermaid_bulk_import.py
+# Version 1.6
+"""
+Import en masse de plusieurs diagrammes Mermaid (.mmd) dans un même Project.
+
+L'analyse, pure et coûteuse en CPU, est répartie sur un ProcessPoolExecutor ; l'écriture reste
+dans le processus de l'application et passe par le chemin d'insertion en masse
+(populate_new_subproject pour un nouveau graphe, synchronisation par diff pour un graphe existant).
+Chaque fichier est écrit dans sa propre transaction : un fichier en échec n'annule pas les autres.
+Les sources sont consommées au fil de l'eau : seuls les fichiers en cours d'analyse (quelques-uns
+par processus) sont gardés en mémoire, jamais le lot entier.
+Le titre d'un SubProject est le nom du fichier sans répertoire : deux fichiers du lot qui donnent
+le même titre (a/chapitre1.mmd et b/chapitre1.mmd) seraient écrits l'un sur l'autre ; le second
+est donc rapporté en échec.
+Le rapport retourné détaille, par fichier, le statut, les temps d'analyse et d'écriture et l'erreur éventuelle.
+"""
+
+import os
+import tarfile
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain, islice
+from typing import IO, Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import BadRequest, HTTPException
+
+from app import db
+from app.models import SubProject
+from app.services.mermaid_grammar import ParsedGraph, ParseLimits, SourceMap, new_source_map, parse_flowchart
+from app.services.mermaid_parser import (
+    _ensure_project, _structure_hash, get_structure_hash, parse_limits, populate_new_subproject,
+    synchronize_subproject_entities,
+)
+
+MERMAID_FILE_EXTENSION = '.mmd'
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz')
+PARSE_WINDOW_PER_WORKER = 2  # Fichiers en vol par processus d'analyse
+
+# Un fichier Mermaid : (nom, contenu texte)
+MermaidSource = Tuple[str, str]
+
+
+def _decode_source(name: str, data: bytes) -> MermaidSource:
+    try:
+        return name, data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise BadRequest(f"Le fichier '{name}' n'est pas un texte UTF-8 valide.")
+
+
+def iter_directory_sources(directory: str) -> Iterator[MermaidSource]:
+    """Fichiers .mmd d'un répertoire (récursivement), triés par chemin relatif."""
+    if not os.path.isdir(directory):
+        raise BadRequest(f"Le répertoire '{directory}' n'existe pas.")
+    paths = []
+    for root, _, filenames in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in filenames if name.endswith(MERMAID_FILE_EXTENSION))
+    for path in sorted(paths):
+        with open(path, 'rb') as handle:
+            yield _decode_source(os.path.relpath(path, directory), handle.read())
+
+
+def iter_tar_sources(fileobj: IO[bytes]) -> Iterator[MermaidSource]:
+    """
+    Fichiers .mmd d'une archive tar (éventuellement compressée), lue séquentiellement (flux non
+    repositionnable accepté) : rien n'est extrait sur disque, les noms de l'archive ne servent
+    qu'au rapport et aux titres.
+    """
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(MERMAID_FILE_EXTENSION):
+                    yield _decode_source(member.name, archive.extractfile(member).read())
+    except (tarfile.TarError, EOFError, OSError):
+        raise BadRequest("Archive tar illisible : une archive .tar, .tar.gz ou .tgz de fichiers .mmd est attendue.")
+
+
+def iter_upload_sources(files: Iterable[Any]) -> Iterator[MermaidSource]:
+    """
+    Fichiers envoyés en multipart (werkzeug FileStorage) : .mmd directement, archives tar dépliées.
+    Les noms sont tous vérifiés avant la première lecture, pour refuser l'envoi avant toute écriture.
+    """
+    files = list(files)
+    for storage in files:
+        filename = storage.filename or ''
+        if not filename.endswith(TAR_EXTENSIONS + (MERMAID_FILE_EXTENSION,)):
+            raise BadRequest(f"Fichier '{filename}' ignoré : seuls les fichiers .mmd et les archives tar sont acceptés.")
+    for storage in files:
+        filename = storage.filename or ''
+        if filename.endswith(TAR_EXTENSIONS):
+            yield from iter_tar_sources(storage.stream)
+        else:
+            yield _decode_source(filename, storage.read())
+
+
+def _subproject_title(name: str) -> str:
+    """Titre du SubProject dérivé du nom de fichier (sans répertoire ni extension)."""
+    return os.path.splitext(os.path.basename(name))[0][:255] or name[:255]
+
+
+# (nom, (ParsedGraph, carte des sources) ou None, message d'erreur ou None, durée d'analyse en secondes)
+ParsedSource = Tuple[str, Optional[Tuple[ParsedGraph, SourceMap]], Optional[str], float]
+
+
+def _parse_source(source: MermaidSource, limits: Optional[ParseLimits] = None) -> ParsedSource:
+    """
+    Analyse un fichier (exécuté dans un processus du pool : aucune dépendance à Flask ni à la base).
+    Un fichier qui dépasse les budgets `limits` est rapporté en échec comme une erreur de syntaxe.
+    """
+    name, text = source
+    start = time.perf_counter()
+    try:
+        source_map = new_source_map()
+        parsed = parse_flowchart(text.split('\n'), limits=limits, source_map=source_map)
+    except Exception as e:  # Les exceptions werkzeug ne traversent pas toujours le pickling
+        return name, None, str(getattr(e, 'description', None) or e), time.perf_counter() - start
+    return name, (parsed, source_map), None, time.perf_counter() - start
+
+
+def _parse_all(sources: Iterable[MermaidSource], workers: int,
+               limits: Optional[ParseLimits] = None) -> Iterator[Tuple[MermaidSource, ParsedSource]]:
+    """
+    Analyse les sources dans l'ordre et les rend avec leur résultat. Avec plusieurs processus, au
+    plus PARSE_WINDOW_PER_WORKER fichiers par processus sont soumis d'avance : la lecture des
+    sources suit l'écriture au lieu de tout charger.
+    """
+    sources = iter(sources)
+    head = list(islice(sources, 2)) if workers > 1 else []
+    if len(head) <= 1:
+        for source in chain(head, sources):
+            yield source, _parse_source(source, limits)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight: Deque[Tuple[MermaidSource, Future]] = deque()
+        for source in chain(head, sources):
+            in_flight.append((source, executor.submit(_parse_source, source, limits)))
+            if len(in_flight) >= workers * PARSE_WINDOW_PER_WORKER:
+                source, future = in_flight.popleft()
+                yield source, future.result()
+        while in_flight:
+            source, future = in_flight.popleft()
+            yield source, future.result()
+
+
+def _write_parsed(project_id: int, title: str, text: str, parsed: ParsedGraph,
+                  source_map: SourceMap) -> Tuple[str, int, Dict]:
+    """
+    Crée ou resynchronise le SubProject `title` du fichier ; retourne (statut, id, changements).
+    Statuts : 'created', 'updated', ou 'unchanged' si l'empreinte structurelle est identique.
+    """
+    subproject = db.session.execute(
+        db.select(SubProject).filter_by(project_id=project_id, title=title)
+        .where(SubProject.import_checkpoint.is_(None))  # Imports par tranches non publiés exclus
+    ).scalar_one_or_none()
+
+    if subproject is None:
+        subproject = SubProject(project_id=project_id, title=title, mermaid_definition=text, visual_layout={})
+        db.session.add(subproject)
+        db.session.flush()
+        return 'created', subproject.id, populate_new_subproject(subproject, text, parsed, source_map)
+
+    structure_hash = _structure_hash(parsed)
+    if get_structure_hash(subproject) == structure_hash:
+        # Ré-import sans changement de structure : seul le texte est réécrit
+        subproject.mermaid_definition = text
+        subproject.structure_hash = structure_hash
+        subproject.source_map = source_map
+        return 'unchanged', subproject.id, {}
+
+    subproject.mermaid_definition = text
+    return 'updated', subproject.id, synchronize_subproject_entities(subproject, text, parsed, source_map)
+
+
+def bulk_import_mermaid(sources: Iterable[MermaidSource], project_title: str,
+                        workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Importe un lot de fichiers Mermaid dans le Project `project_title` (créé si besoin).
+    Un fichier dont le titre correspond à un SubProject existant du projet le met à jour ; un
+    fichier dont le titre est celui d'un fichier précédent du lot est rapporté en échec.
+    Une archive qui devient illisible en cours de lecture interrompt le lot (BadRequest) ; les
+    fichiers déjà écrits restent importés.
+    """
+    if workers is None:
+        workers = current_app.config.get('MERMAID_BULK_IMPORT_WORKERS') or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    sources = iter(sources)
+    first = next(sources, None)
+    if first is None:
+        raise BadRequest("Aucun fichier .mmd à importer.")
+
+    project = _ensure_project(project_title)
+    db.session.commit()
+    project_id = project.id
+
+    files: List[Dict[str, Any]] = []
+    titles: Dict[str, str] = {}  # Titre -> premier fichier du lot qui le porte
+    parsed_sources = _parse_all(chain([first], sources), workers, parse_limits())
+    for (_, text), (name, document, error, parse_seconds) in parsed_sources:
+        report: Dict[str, Any] = {
+            'name': name,
+            'status': 'failed',
+            'subproject_id': None,
+            'parse_seconds': round(parse_seconds, 4),
+            'write_seconds': None,
+            'error': error,
+        }
+        title = _subproject_title(name)
+        if title in titles:
+            report['error'] = f"Titre '{title}' déjà importé depuis '{titles[title]}' dans ce lot."
+            document = None
+        else:
+            titles[title] = name
+        if document is not None:
+            write_start = time.perf_counter()
+            try:
+                status, subproject_id, changes = _write_parsed(project_id, title, text, *document)
+                db.session.commit()
+                report.update(status=status, subproject_id=subproject_id, changes=changes)
+            except (HTTPException, SQLAlchemyError) as e:
+                db.session.rollback()
+                report['error'] = str(getattr(e, 'description', None) or e)
+            report['write_seconds'] = round(time.perf_counter() - write_start, 4)
+        files.append(report)
+
+    failed = sum(1 for report in files if report['status'] == 'failed')
+    return {
+        'project_id': project_id,
+        'project_title': project_title,
+        'workers': workers,
+        'imported': len(files) - failed,
+        'failed': failed,
+        'total_seconds': round(time.perf_counter() - start, 4),
+        'files': files,
+    }
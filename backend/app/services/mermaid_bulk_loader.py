@@ -0,0 +1,180 @@
+# backend/app/services/mermaid_bulk_loader.py
+# Version 1.3
+"""
+Chargement en masse d'un SubProject neuf sur PostgreSQL via `COPY FROM STDIN`.
+
+Les Subgraphs, peu nombreux, sont créés au préalable par l'appelant ; les nœuds (avec l'id de
+leur subgraph), relations et classdefs parsés sont copiés dans des tables temporaires de transit
+(supprimées au commit), puis fusionnés dans `node`, `relationship` et `classdef` par trois
+`INSERT ... SELECT`. Les identifiants des relations sont résolus par jointure sur
+(subproject_id, mermaid_id), sans aller-retour par entité.
+
+Les écritures passent par la connexion de la session courante : elles appartiennent à la
+transaction de l'appelant mais ne sont pas connues de l'identity map (recharger après commit).
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from flask import current_app
+
+from app import db
+from app.services.mermaid_grammar import ParsedGraph
+
+DEFAULT_COPY_MIN_ROWS = 2000
+
+_STAGING_TABLES = (
+    "CREATE TEMP TABLE IF NOT EXISTS mermaid_stage_node ("
+    " ord integer, mermaid_id text, title text, text_content text, style_class_ref text, subgraph_id integer"
+    ") ON COMMIT DROP",
+    "CREATE TEMP TABLE IF NOT EXISTS mermaid_stage_relationship ("
+    " ord integer, source_mermaid_id text, target_mermaid_id text, label text, link_type text"
+    ") ON COMMIT DROP",
+    "CREATE TEMP TABLE IF NOT EXISTS mermaid_stage_classdef ("
+    " name text, definition_raw text"
+    ") ON COMMIT DROP",
+)
+
+_MERGE_NODES = """
+    INSERT INTO node (subproject_id, mermaid_id, title, text_content, style_class_ref, subgraph_id)
+    SELECT %(subproject_id)s, mermaid_id, title, text_content, style_class_ref, subgraph_id
+    FROM mermaid_stage_node ORDER BY ord
+"""
+
+_MERGE_RELATIONSHIPS = """
+    INSERT INTO relationship (subproject_id, source_node_id, target_node_id, label, color, link_type)
+    SELECT %(subproject_id)s, source.id, target.id, stage.label, NULL, stage.link_type::link_type_enum
+    FROM mermaid_stage_relationship AS stage
+    JOIN node AS source ON source.subproject_id = %(subproject_id)s AND source.mermaid_id = stage.source_mermaid_id
+    JOIN node AS target ON target.subproject_id = %(subproject_id)s AND target.mermaid_id = stage.target_mermaid_id
+    ORDER BY stage.ord
+"""
+
+_MERGE_CLASSDEFS = """
+    INSERT INTO classdef (subproject_id, name, definition_raw)
+    SELECT %(subproject_id)s, name, definition_raw FROM mermaid_stage_classdef
+"""
+
+
+def _copy_text_value(value: Optional[object]) -> str:
+    """Encode une valeur pour le format texte de COPY (\\N pour NULL, caractères de contrôle échappés)."""
+    if value is None:
+        return '\\N'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+class CopyRowReader:
+    """
+    Flux texte au format COPY, produit à la demande depuis un itérable de lignes : `read(size)`
+    n'encode que les lignes nécessaires pour servir `size` caractères. La mémoire occupée est
+    bornée par la taille de lecture de copy_expert (8 Kio) plus une ligne, quelle que soit la
+    taille du graphe.
+    """
+
+    def __init__(self, rows: Iterable[Sequence[Optional[object]]]):
+        self._lines = ('\t'.join(_copy_text_value(value) for value in row) + '\n' for row in rows)
+        self._pending = ''
+
+    def read(self, size: int = -1) -> str:
+        if size is None or size < 0:
+            chunk, self._pending = self._pending + ''.join(self._lines), ''
+            return chunk
+        pieces: List[str] = [self._pending]
+        length = len(self._pending)
+        while length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            pieces.append(line)
+            length += len(line)
+        buffered = ''.join(pieces)
+        chunk, self._pending = buffered[:size], buffered[size:]
+        return chunk
+
+
+def encode_copy_rows(rows: Iterable[Sequence[Optional[object]]]) -> CopyRowReader:
+    """Sérialise des lignes au format texte de COPY, à la volée, dans un flux lisible par copy_expert."""
+    return CopyRowReader(rows)
+
+
+def _raw_cursor():
+    """Curseur psycopg2 de la connexion de la session, ou None si COPY n'est pas disponible."""
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return None
+    driver_connection = connection.connection.driver_connection
+    cursor = driver_connection.cursor()
+    if not hasattr(cursor, 'copy_expert'):
+        cursor.close()
+        return None
+    return cursor
+
+
+def should_bulk_load(entity_count: int) -> bool:
+    """Indique si un graphe de cette taille doit passer par COPY plutôt que par l'ORM."""
+    min_rows = current_app.config.get('MERMAID_COPY_MIN_ROWS', DEFAULT_COPY_MIN_ROWS)
+    return min_rows >= 0 and entity_count >= min_rows and db.session.get_bind().dialect.name == 'postgresql'
+
+
+def _node_rows(parsed: ParsedGraph, node_subgraph_ids: Dict[str, int]) -> Iterator[Tuple]:
+    for ord_, node in enumerate(parsed.iter_nodes()):
+        yield (ord_,) + tuple(node) + (node_subgraph_ids.get(node.mermaid_id),)
+
+
+def _relationship_rows(parsed: ParsedGraph) -> Iterator[Tuple]:
+    for ord_, edge in enumerate(parsed.iter_edges()):
+        yield ord_, edge.source, edge.target, edge.label, edge.link_type.value
+
+
+def bulk_load_new_subproject(subproject_id: int, parsed: ParsedGraph,
+                             node_subgraph_ids: Dict[str, int]) -> Optional[Dict[str, Dict[str, int]]]:
+    """
+    Peuple un SubProject qui n'a encore aucun nœud à partir d'un résultat d'analyse ;
+    `node_subgraph_ids` donne l'id du subgraph (déjà créé) de chaque nœud regroupé.
+    Les lignes COPY sont encodées à la volée depuis le ParsedGraph au fil des lectures de
+    copy_expert (CopyRowReader), sans liste ni tampon intermédiaire de la taille du graphe.
+
+    Retourne le résumé des changements (même forme que synchronize_subproject_entities), ou None si
+    la connexion ne permet pas COPY ; l'appelant utilise alors le chemin ORM.
+    """
+    cursor = _raw_cursor()
+    if cursor is None:
+        return None
+
+    params = {'subproject_id': subproject_id}
+
+    try:
+        for statement in _STAGING_TABLES:
+            cursor.execute(statement)
+        cursor.execute("TRUNCATE mermaid_stage_node, mermaid_stage_relationship, mermaid_stage_classdef")
+
+        cursor.copy_expert(
+            "COPY mermaid_stage_node (ord, mermaid_id, title, text_content, style_class_ref, subgraph_id) FROM STDIN",
+            encode_copy_rows(_node_rows(parsed, node_subgraph_ids))
+        )
+        cursor.copy_expert(
+            "COPY mermaid_stage_relationship (ord, source_mermaid_id, target_mermaid_id, label, link_type) FROM STDIN",
+            encode_copy_rows(_relationship_rows(parsed))
+        )
+        cursor.copy_expert(
+            "COPY mermaid_stage_classdef (name, definition_raw) FROM STDIN",
+            encode_copy_rows(parsed.classdefs.items())
+        )
+
+        cursor.execute(_MERGE_NODES, params)
+        nodes_inserted = cursor.rowcount
+        cursor.execute(_MERGE_RELATIONSHIPS, params)
+        relationships_inserted = cursor.rowcount
+        cursor.execute(_MERGE_CLASSDEFS, params)
+        classdefs_inserted = cursor.rowcount
+    finally:
+        cursor.close()
+
+    return {
+        'nodes': {'inserted': nodes_inserted, 'updated': 0, 'deleted': 0},
+        'classdefs': {'inserted': classdefs_inserted, 'updated': 0, 'deleted': 0},
+        'relationships': {'inserted': relationships_inserted, 'updated': 0, 'deleted': 0},
+    }
@@ -0,0 +1,278 @@
+# backend/app/services/mermaid_chunked_import.py
+# Version 1.1
+"""
+Import Mermaid par tranches validées, avec reprise, pour les très gros diagrammes.
+
+parse_and_save_mermaid écrit tout le graphe dans une seule transaction : verrous et session sont
+tenus pendant tout l'import, et un échec tardif annule tout. Ici, le SubProject est créé en état
+de préparation (import_checkpoint non nul : absent des listes de projets et de sous-projets), puis
+ses entités sont écrites par tranches de MERMAID_IMPORT_CHUNK_SIZE lignes ; chaque tranche est
+validée dans la même transaction que le point de reprise qui la suit. Après un échec,
+resume_chunked_import repart de ce point. La dernière transaction publie le SubProject
+(direction, empreinte, carte des sources) d'un seul coup.
+
+L'analyse de l'import suit les budgets MERMAID_CHUNKED_MAX_* au lieu de ceux de l'import ordinaire ;
+la reprise relit la définition stockée sans budget (elle les a déjà respectés), si bien qu'un
+changement de configuration ne rend pas un import en préparation impossible à reprendre. La reprise
+verrouille la ligne du SubProject, et chaque point de reprise est écrit par comparaison-échange :
+deux reprises concurrentes ne peuvent pas valider la même tranche, la seconde échoue en 409.
+
+Les écritures passent par le Core et la session est vidée à chaque tranche : la mémoire ne dépend
+que de la taille des tranches et des correspondances mermaid_id -> id, pas de la taille du graphe.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import and_, delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import BadRequest, Conflict, NotFound, ServiceUnavailable
+
+from app import db
+from app.models import Project, SubProject, Node, Relationship, ClassDef, Subgraph
+from app.services.mermaid_grammar import MermaidParsingError, ParsedGraph, ParseLimits, SourceMap
+from app.services.mermaid_parser import (
+    _ensure_project, _find_or_create_subproject, _get_project_with_subprojects, _handle_import_error,
+    _node_subgraph_ids, _parse_mermaid_document, _structure_hash, parse_limits,
+)
+
+DEFAULT_IMPORT_CHUNK_SIZE = 50000
+DEFAULT_CHUNKED_MAX_LINES = 2000000
+DEFAULT_CHUNKED_MAX_ENTITIES = 5000000
+
+# Étapes d'écriture, dans l'ordre : chaque étape référence les ids créés par la précédente
+CHUNKED_IMPORT_PHASES = ('subgraphs', 'nodes', 'relationships')
+
+# Point de reprise : {'phase': étape en cours, 'position': lignes de l'étape déjà validées}
+Checkpoint = Dict[str, object]
+
+# Écriture d'une étape : (modèle, nombre de lignes, fabrique des lignes [début, fin))
+PhaseWriter = Tuple[type, int, Callable[[int, int], List[Dict]]]
+
+
+class ChunkedImportInterrupted(ServiceUnavailable):
+    """
+    Échec d'écriture d'un import par tranches : les tranches validées sont conservées et
+    l'import peut être repris depuis `checkpoint` (POST /api/mermaid/import/<id>/resume).
+    """
+
+    def __init__(self, subproject_id: int, checkpoint: Checkpoint):
+        super().__init__(
+            f"Import du SubProject {subproject_id} interrompu à l'étape '{checkpoint['phase']}' "
+            f"({checkpoint['position']} lignes validées) : il peut être repris."
+        )
+        self.subproject_id = subproject_id
+        self.checkpoint = checkpoint
+
+
+def _import_chunk_size() -> int:
+    """Nombre de lignes par tranche configuré pour l'application courante."""
+    return current_app.config.get('MERMAID_IMPORT_CHUNK_SIZE', DEFAULT_IMPORT_CHUNK_SIZE)
+
+
+def _chunked_import_limits() -> ParseLimits:
+    """Budgets d'analyse de l'import par tranches : ceux de la configuration, plafonds MERMAID_CHUNKED_MAX_*."""
+    config = current_app.config
+    return parse_limits()._replace(
+        max_lines=config.get('MERMAID_CHUNKED_MAX_LINES', DEFAULT_CHUNKED_MAX_LINES),
+        max_entities=config.get('MERMAID_CHUNKED_MAX_ENTITIES', DEFAULT_CHUNKED_MAX_ENTITIES),
+    )
+
+
+def _checkpoint(phase: str, position: int) -> Checkpoint:
+    return {'phase': phase, 'position': position}
+
+
+def _checkpoint_is(checkpoint: Checkpoint):
+    """Condition SQL : le point de reprise stocké est `checkpoint` (comparé champ par champ)."""
+    return and_(
+        SubProject.import_checkpoint['phase'].as_string() == checkpoint['phase'],
+        SubProject.import_checkpoint['position'].as_integer() == checkpoint['position'],
+    )
+
+
+def _id_map(model, subproject_id: int) -> Dict[str, int]:
+    """Correspondance mermaid_id -> id des entités déjà validées (reprise comprise)."""
+    return dict(db.session.execute(
+        db.select(model.mermaid_id, model.id).where(model.subproject_id == subproject_id)
+    ).all())
+
+
+def _phase_writer(phase: str, subproject_id: int, parsed: ParsedGraph) -> PhaseWriter:
+    if phase == 'subgraphs':
+        subgraph_ids = list(parsed.subgraphs)
+
+        def subgraph_rows(start: int, stop: int) -> List[Dict]:
+            return [{
+                'subproject_id': subproject_id,
+                'mermaid_id': mermaid_id,
+                'title': parsed.subgraph_titles.get(mermaid_id) or mermaid_id,
+                'style_class_ref': parsed.subgraph_classes.get(mermaid_id),
+            } for mermaid_id in subgraph_ids[start:stop]]
+        return Subgraph, len(subgraph_ids), subgraph_rows
+
+    if phase == 'nodes':
+        node_subgraph_ids = _node_subgraph_ids(parsed, _id_map(Subgraph, subproject_id))
+
+        def node_rows(start: int, stop: int) -> List[Dict]:
+            return [{
+                'subproject_id': subproject_id,
+                'mermaid_id': parsed.node_ids[index],
+                'title': parsed.node_titles[index],
+                'text_content': parsed.text_content(index),
+                'style_class_ref': parsed.node_classes[index],
+                'subgraph_id': node_subgraph_ids.get(parsed.node_ids[index]),
+            } for index in range(start, stop)]
+        return Node, parsed.node_count, node_rows
+
+    # Les liens du ParsedGraph référencent les nœuds par indice : une liste d'ids suffit
+    node_id_map = _id_map(Node, subproject_id)
+    node_db_ids = [node_id_map[mermaid_id] for mermaid_id in parsed.node_ids]
+    del node_id_map
+
+    def relationship_rows(start: int, stop: int) -> List[Dict]:
+        return [{
+            'subproject_id': subproject_id,
+            'source_node_id': node_db_ids[parsed.edge_sources[index]],
+            'target_node_id': node_db_ids[parsed.edge_targets[index]],
+            'label': parsed.edge_labels.get(index),
+            'link_type': parsed.edge_link_type(index),
+            'color': None,
+        } for index in range(start, stop)]
+    return Relationship, parsed.edge_count, relationship_rows
+
+
+def _commit_checkpoint(subproject_id: int, expected: Checkpoint, checkpoint: Optional[Checkpoint], **values) -> None:
+    """
+    Valide la tranche en cours avec son point de reprise, puis vide la session. Le point de reprise
+    n'est remplacé que s'il vaut encore `expected` ; sinon une autre reprise a avancé entre-temps :
+    la tranche est annulée et Conflict (409) est levée.
+    """
+    result = db.session.execute(
+        update(SubProject).where(SubProject.id == subproject_id, _checkpoint_is(expected))
+        .values(import_checkpoint=checkpoint, **values),
+        execution_options={'synchronize_session': False},
+    )
+    if result.rowcount == 0:
+        db.session.rollback()
+        raise Conflict(f"L'import du SubProject {subproject_id} a été repris par une autre requête.")
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def _write_chunks(subproject_id: int, checkpoint: Checkpoint, parsed: ParsedGraph,
+                  source_map: SourceMap, chunk_size: int) -> None:
+    """Écrit les étapes restantes à partir de `checkpoint`, une transaction par tranche, puis publie."""
+    try:
+        first_phase = CHUNKED_IMPORT_PHASES.index(checkpoint['phase'])
+        for phase in CHUNKED_IMPORT_PHASES[first_phase:]:
+            position = checkpoint['position'] if phase == checkpoint['phase'] else 0
+            model, total, make_rows = _phase_writer(phase, subproject_id, parsed)
+            while position < total:
+                stop = min(position + chunk_size, total)
+                db.session.execute(insert(model), make_rows(position, stop))
+                _commit_checkpoint(subproject_id, checkpoint, _checkpoint(phase, stop))
+                checkpoint, position = _checkpoint(phase, stop), stop
+
+        # Publication : le SubProject devient visible avec sa structure complète
+        _commit_checkpoint(
+            subproject_id, checkpoint, None,
+            graph_direction=parsed.direction, structure_hash=_structure_hash(parsed), source_map=source_map,
+        )
+    except Conflict:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception("Import par tranches du SubProject %s interrompu", subproject_id)
+        raise ChunkedImportInterrupted(subproject_id, checkpoint) from e
+
+
+def import_mermaid_chunked(mermaid_code: str, project_title: str = "Graphe Importé",
+                           chunk_size: Optional[int] = None) -> Project:
+    """
+    Variante de parse_and_save_mermaid pour les très gros diagrammes : le code est analysé puis
+    écrit par tranches validées une à une (voir le module), sous les budgets MERMAID_CHUNKED_MAX_*
+    (MermaidInputTooLarge, 413, au-delà). Une erreur d'analyse n'écrit rien ;
+    un échec d'écriture lève ChunkedImportInterrupted et laisse le SubProject en préparation.
+    """
+    if chunk_size is None:
+        chunk_size = _import_chunk_size()
+
+    try:
+        parsed, source_map = _parse_mermaid_document(mermaid_code, _chunked_import_limits())
+        project = _ensure_project(project_title)
+        subproject = _find_or_create_subproject(project, mermaid_code)
+        checkpoint = _checkpoint(CHUNKED_IMPORT_PHASES[0], 0)
+        subproject.import_checkpoint = checkpoint
+        if parsed.classdefs:
+            db.session.execute(insert(ClassDef), [
+                {'subproject_id': subproject.id, 'name': name, 'definition_raw': definition_raw}
+                for name, definition_raw in parsed.classdefs.items()
+            ])
+        project_id, subproject_id = project.id, subproject.id
+        db.session.commit()
+        db.session.expunge_all()
+    except (IntegrityError, MermaidParsingError, NotFound, BadRequest) as e:
+        _handle_import_error(e)
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+    _write_chunks(subproject_id, checkpoint, parsed, source_map, chunk_size)
+    return _get_project_with_subprojects(project_id)
+
+
+def _get_subproject_or_404(subproject_id: int) -> SubProject:
+    subproject = db.session.get(SubProject, subproject_id)
+    if subproject is None:
+        raise NotFound(f"SubProject ID {subproject_id} non trouvé.")
+    return subproject
+
+
+def get_chunked_import_status(subproject_id: int) -> Dict:
+    """État d'un import par tranches : 'staging' avec son point de reprise, ou 'published'."""
+    subproject = _get_subproject_or_404(subproject_id)
+    return {
+        'subproject_id': subproject.id,
+        'project_id': subproject.project_id,
+        'status': 'published' if subproject.import_checkpoint is None else 'staging',
+        'checkpoint': subproject.import_checkpoint,
+    }
+
+
+def resume_chunked_import(subproject_id: int, chunk_size: Optional[int] = None) -> Project:
+    """
+    Reprend un import par tranches interrompu depuis son dernier point de reprise. Le code est
+    relu depuis la définition stockée, sans budget (il a passé ceux de l'import) ; l'analyse étant
+    déterministe, les indices du point de reprise désignent les mêmes entités. La ligne du
+    SubProject est verrouillée pendant la lecture du point de reprise et la première tranche ; une
+    reprise concurrente qui a avancé entre-temps fait échouer celle-ci en 409. Un import déjà publié
+    est retourné tel quel.
+    """
+    if chunk_size is None:
+        chunk_size = _import_chunk_size()
+
+    subproject = db.session.execute(
+        db.select(SubProject).where(SubProject.id == subproject_id).with_for_update()
+    ).scalar_one_or_none()
+    if subproject is None:
+        raise NotFound(f"SubProject ID {subproject_id} non trouvé.")
+    project_id, checkpoint = subproject.project_id, subproject.import_checkpoint
+    if checkpoint is not None:
+        parsed, source_map = _parse_mermaid_document(subproject.mermaid_definition, ParseLimits())
+        db.session.expunge_all()
+        _write_chunks(subproject_id, checkpoint, parsed, source_map, chunk_size)
+    return _get_project_with_subprojects(project_id)
+
+
+def discard_chunked_import(subproject_id: int) -> None:
+    """Abandonne un import par tranches non publié : le SubProject et ses entités sont supprimés."""
+    subproject = _get_subproject_or_404(subproject_id)
+    if subproject.import_checkpoint is None:
+        raise BadRequest(f"Le SubProject {subproject_id} est publié : le supprimer via /api/subprojects.")
+
+    db.session.expunge(subproject)
+    for model in (Relationship, Node, Subgraph, ClassDef):
+        db.session.execute(delete(model).where(model.subproject_id == subproject_id))
+    db.session.execute(delete(SubProject).where(SubProject.id == subproject_id))
+    db.session.commit()
@@ -0,0 +1,354 @@
+# backend/app/services/mermaid_exporters.py
+# Version 1.1
+"""
+Exports d'un SubProject en plusieurs formats à partir d'un même chargeur : code Mermaid, graphe JSON
+(JSON Graph Format), GraphML, Graphviz DOT et instantané MessagePack compact (nœuds indexés par entier,
+liens en tableaux). Les outils en aval lisent ainsi le graphe sans analyser une seconde fois le texte.
+
+Le chargeur (load_subproject_graph) lit l'en-tête du SubProject en une ligne ; classDefs et subgraphs,
+peu nombreux, sont lus d'une requête à la demande ; nœuds et liens sont lus en flux par curseur côté
+serveur (tuples, sans objets ORM). Chaque format produit des morceaux au fil de la lecture.
+
+Un format est ajouté avec le décorateur register_exporter ; son nom est celui du paramètre 'format'
+de la route d'export.
+"""
+
+import json
+import re
+from typing import AnyStr, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from xml.sax.saxutils import escape, quoteattr
+
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+from werkzeug.exceptions import BadRequest, NotFound, NotImplemented as HTTPNotImplemented
+
+from app import db
+from app.models import ClassDef, LinkType, Node, Relationship, SubProject, Subgraph
+from app.services.mermaid_generator import iter_mermaid_lines
+from app.services.mermaid_render import EXPORT_CHUNK_SIZE, join_chunks, stream_rows
+
+try:
+    import msgpack
+except ImportError:  # Dépendance optionnelle : seul l'export MessagePack en a besoin
+    msgpack = None
+
+DEFAULT_FORMAT = 'mermaid'
+
+# Ordre des types de lien dans l'instantané MessagePack (les liens y référencent leur type par indice)
+SNAPSHOT_LINK_TYPES = [link_type.value for link_type in LinkType]
+SNAPSHOT_SCHEMA_VERSION = 1
+
+_DOT_RANKDIR = {'TD': 'TB', 'TB': 'TB', 'BT': 'BT', 'LR': 'LR', 'RL': 'RL'}
+# Caractères interdits en XML 1.0 (contrôles hors tabulation et fins de ligne)
+_XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+# --- Chargeur ---
+
+class SubprojectGraph:
+    """
+    Graphe d'un SubProject lu pour l'export. Les nœuds sont des tuples (id, mermaid_id, label,
+    subgraph_id, style_class_ref), le libellé étant le titre ou, à défaut, le texte ; les liens sont des
+    tuples (source_node_id, target_node_id, source mermaid_id, cible mermaid_id, link_type, label, color),
+    sans les liens dont une extrémité n'existe plus.
+    """
+
+    def __init__(self, subproject_id: int, title: str, graph_direction: str, version: int):
+        self.subproject_id = subproject_id
+        self.title = title
+        self.graph_direction = graph_direction
+        self.version = version
+
+    def class_defs(self) -> List[Tuple[str, str]]:
+        return db.session.execute(
+            db.select(ClassDef.name, ClassDef.definition_raw)
+            .where(ClassDef.subproject_id == self.subproject_id).order_by(ClassDef.id)
+        ).all()
+
+    def subgraphs(self) -> List[Tuple[int, str, str, Optional[str]]]:
+        return db.session.execute(
+            db.select(Subgraph.id, Subgraph.mermaid_id, Subgraph.title, Subgraph.style_class_ref)
+            .where(Subgraph.subproject_id == self.subproject_id).order_by(Subgraph.id)
+        ).all()
+
+    def _nodes_statement(self):
+        return (
+            db.select(Node.id, Node.mermaid_id, func.coalesce(Node.title, Node.text_content),
+                      Node.subgraph_id, Node.style_class_ref)
+            .where(Node.subproject_id == self.subproject_id)
+        )
+
+    def _edges_statement(self):
+        source, target = aliased(Node), aliased(Node)
+        return (
+            db.select(Relationship.source_node_id, Relationship.target_node_id, source.mermaid_id, target.mermaid_id,
+                      Relationship.link_type, Relationship.label, Relationship.color)
+            .join(source, Relationship.source_node_id == source.id)
+            .join(target, Relationship.target_node_id == target.id)
+            .where(Relationship.subproject_id == self.subproject_id)
+        )
+
+    def iter_nodes(self, by_subgraph: bool = False) -> Iterator[Tuple]:
+        """Nœuds par id ; avec `by_subgraph`, les nœuds hors subgraph d'abord, puis subgraph par subgraph."""
+        order = (Node.subgraph_id.isnot(None), Node.subgraph_id, Node.id) if by_subgraph else (Node.id,)
+        return stream_rows(self._nodes_statement().order_by(*order))
+
+    def iter_edges(self) -> Iterator[Tuple]:
+        return stream_rows(self._edges_statement().order_by(Relationship.id))
+
+    def count_nodes(self) -> int:
+        return db.session.scalar(db.select(func.count()).select_from(self._nodes_statement().subquery()))
+
+    def count_edges(self) -> int:
+        return db.session.scalar(db.select(func.count()).select_from(self._edges_statement().subquery()))
+
+
+def load_subproject_graph(subproject_id: int) -> SubprojectGraph:
+    """Lit l'en-tête d'un SubProject (une ligne) ; lève NotFound s'il n'existe pas."""
+    header = db.session.execute(
+        db.select(SubProject.title, SubProject.graph_direction, SubProject.version).where(SubProject.id == subproject_id)
+    ).one_or_none()
+    if header is None:
+        raise NotFound(f"SubProject ID {subproject_id} non trouvé.")
+    return SubprojectGraph(subproject_id, *header)
+
+
+# --- Registre des formats ---
+
+class GraphExporter(NamedTuple):
+    name: str
+    extension: str
+    mimetype: str
+    render: Callable[[SubprojectGraph], Iterable[Union[str, bytes]]]
+    available: bool = True
+
+
+EXPORTERS: Dict[str, GraphExporter] = {}
+
+
+def register_exporter(name: str, extension: str, mimetype: str, available: bool = True):
+    """Enregistre une fonction de rendu (graphe -> morceaux de texte ou d'octets) sous le nom `name`."""
+    def decorator(render: Callable[[SubprojectGraph], Iterable[Union[str, bytes]]]):
+        EXPORTERS[name] = GraphExporter(name, extension, mimetype, render, available)
+        return render
+    return decorator
+
+
+def get_exporter(name: str) -> GraphExporter:
+    """Format d'export `name` ; BadRequest s'il est inconnu, NotImplemented si sa dépendance manque."""
+    exporter = EXPORTERS.get(name)
+    if exporter is None:
+        raise BadRequest(f"Format d'export inconnu : '{name}'. Formats disponibles : {', '.join(sorted(EXPORTERS))}.")
+    if not exporter.available:
+        raise HTTPNotImplemented(f"Format d'export '{name}' indisponible sur ce serveur (dépendance optionnelle manquante).")
+    return exporter
+
+
+def _join_pieces(pieces: Iterable[AnyStr], chunk_size: int) -> Iterator[AnyStr]:
+    """Regroupe des morceaux (tous str ou tous bytes) en morceaux d'au moins `chunk_size` éléments."""
+    buffer: List[AnyStr] = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield buffer[0][:0].join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield buffer[0][:0].join(buffer)
+
+
+def iter_export(subproject_id: int, format_name: str = DEFAULT_FORMAT,
+                chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[Union[str, bytes]]:
+    """
+    Export en flux d'un SubProject au format `format_name`. Le format et l'existence du SubProject sont
+    vérifiés immédiatement ; les morceaux sont ensuite produits à la demande.
+    """
+    exporter = get_exporter(format_name)
+    graph = load_subproject_graph(subproject_id)
+    return _join_pieces(exporter.render(graph), chunk_size)
+
+
+# --- Formats ---
+
+@register_exporter('mermaid', 'mmd', 'text/plain; charset=utf-8')
+def render_mermaid(graph: SubprojectGraph) -> Iterator[str]:
+    """Code Mermaid, texte identique à generate_mermaid_from_subproject."""
+    return join_chunks(iter_mermaid_lines(graph.subproject_id, graph.graph_direction), EXPORT_CHUNK_SIZE)
+
+
+def _json(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _metadata(**values) -> Dict[str, object]:
+    return {key: value for key, value in values.items() if value is not None and value != ''}
+
+
+@register_exporter('json', 'json', 'application/json')
+def render_json_graph(graph: SubprojectGraph) -> Iterator[str]:
+    """
+    Graphe au format JSON Graph Format (v2) : nœuds indexés par mermaid_id, liens en tableau ; subgraphs
+    et classDefs dans les métadonnées du graphe. Une entité par ligne.
+    """
+    subgraphs = graph.subgraphs()
+    subgraph_ids = {subgraph_id: mermaid_id for subgraph_id, mermaid_id, _, _ in subgraphs}
+    metadata = {
+        'subproject_id': graph.subproject_id,
+        'version': graph.version,
+        'graph_direction': graph.graph_direction,
+        'class_defs': {name: definition_raw for name, definition_raw in graph.class_defs()},
+        'subgraphs': {mermaid_id: _metadata(label=title, class_ref=class_ref)
+                      for _, mermaid_id, title, class_ref in subgraphs},
+    }
+    yield f'{{"graph":{{"id":{_json(f"sp{graph.subproject_id}")},"label":{_json(graph.title)},"directed":true,'
+    yield f'"metadata":{_json(metadata)},\n"nodes":{{'
+    separator = "\n"
+    for _, mermaid_id, label, subgraph_id, class_ref in graph.iter_nodes():
+        node = {'label': label or mermaid_id}
+        node_metadata = _metadata(subgraph=subgraph_ids.get(subgraph_id), class_ref=class_ref)
+        if node_metadata:
+            node['metadata'] = node_metadata
+        yield f'{separator}{_json(mermaid_id)}:{_json(node)}'
+        separator = ",\n"
+    yield '},\n"edges":['
+    separator = "\n"
+    for _, _, source_id, target_id, link_type, label, color in graph.iter_edges():
+        edge = {'source': source_id, 'target': target_id, 'relation': link_type.value}
+        if label:
+            edge['label'] = label
+        if color:
+            edge['metadata'] = {'color': color}
+        yield f'{separator}{_json(edge)}'
+        separator = ",\n"
+    yield ']}}\n'
+
+
+def _xml_text(value: str) -> str:
+    return escape(_XML_INVALID_CHARS.sub('', value))
+
+
+def _xml_attr(value: str) -> str:
+    return quoteattr(_XML_INVALID_CHARS.sub('', value))
+
+
+def _graphml_data(key: str, value: Optional[str]) -> str:
+    return f'<data key="{key}">{_xml_text(value)}</data>' if value else ''
+
+
+@register_exporter('graphml', 'graphml', 'application/graphml+xml; charset=utf-8')
+def render_graphml(graph: SubprojectGraph) -> Iterator[str]:
+    """Graphe GraphML orienté : subgraph et classe portés par les nœuds (clés 'subgraph' et 'class')."""
+    subgraph_ids = {subgraph_id: mermaid_id for subgraph_id, mermaid_id, _, _ in graph.subgraphs()}
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+    for key, domain, name in (('title', 'graph', 'title'), ('direction', 'graph', 'graph_direction'),
+                              ('label', 'node', 'label'), ('subgraph', 'node', 'subgraph'), ('class', 'node', 'class'),
+                              ('link_type', 'edge', 'link_type'), ('edge_label', 'edge', 'label'),
+                              ('color', 'edge', 'color')):
+        yield f'  <key id="{key}" for="{domain}" attr.name="{name}" attr.type="string"/>\n'
+    yield (f'  <graph id="sp{graph.subproject_id}" edgedefault="directed">'
+           f'{_graphml_data("title", graph.title)}{_graphml_data("direction", graph.graph_direction)}\n')
+    for _, mermaid_id, label, subgraph_id, class_ref in graph.iter_nodes():
+        yield (f'    <node id={_xml_attr(mermaid_id)}>{_graphml_data("label", label or mermaid_id)}'
+               f'{_graphml_data("subgraph", subgraph_ids.get(subgraph_id))}{_graphml_data("class", class_ref)}</node>\n')
+    for _, _, source_id, target_id, link_type, label, color in graph.iter_edges():
+        yield (f'    <edge source={_xml_attr(source_id)} target={_xml_attr(target_id)}>'
+               f'{_graphml_data("link_type", link_type.value)}{_graphml_data("edge_label", label)}'
+               f'{_graphml_data("color", color)}</edge>\n')
+    yield '  </graph>\n</graphml>\n'
+
+
+def _dot_string(value: str) -> str:
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"').replace('\r\n', '\n').replace('\n', '\\n')
+    return f'"{escaped}"'
+
+
+def _dot_attributes(**values: Optional[str]) -> str:
+    attributes = [f'{name}={_dot_string(value)}' for name, value in values.items() if value]
+    return f' [{", ".join(attributes)}]' if attributes else ''
+
+
+@register_exporter('dot', 'dot', 'text/vnd.graphviz; charset=utf-8')
+def render_dot(graph: SubprojectGraph) -> Iterator[str]:
+    """
+    Graphe Graphviz DOT : un cluster par subgraph, classes Mermaid en attribut 'class', liens sans
+    flèche (Mermaid '---') avec arrowhead=none. Les classDefs sont reportées en commentaires.
+    """
+    subgraphs = {subgraph_id: (mermaid_id, title, class_ref) for subgraph_id, mermaid_id, title, class_ref in graph.subgraphs()}
+    yield f'digraph {_dot_string(graph.title)} {{\n'
+    yield f'  rankdir={_DOT_RANKDIR.get(graph.graph_direction, "TB")};\n  node [shape=box];\n'
+    for name, definition_raw in graph.class_defs():
+        yield f'  // classDef {name} {definition_raw.replace(chr(10), " ")}\n'
+
+    def cluster_header(subgraph_id: int) -> str:
+        mermaid_id, title, class_ref = subgraphs.pop(subgraph_id)
+        return f'  subgraph {_dot_string("cluster_" + mermaid_id)} {{\n    graph{_dot_attributes(label=title, **{"class": class_ref})};\n'
+
+    current_subgraph = None
+    for _, mermaid_id, label, subgraph_id, class_ref in graph.iter_nodes(by_subgraph=True):
+        if subgraph_id != current_subgraph:
+            if current_subgraph is not None:
+                yield '  }\n'
+            current_subgraph = subgraph_id
+            yield cluster_header(subgraph_id)
+        indent = '    ' if subgraph_id is not None else '  '
+        yield f'{indent}{_dot_string(mermaid_id)}{_dot_attributes(label=label or mermaid_id, **{"class": class_ref})};\n'
+    if current_subgraph is not None:
+        yield '  }\n'
+    for subgraph_id in list(subgraphs):  # Subgraphs vides
+        yield cluster_header(subgraph_id) + '  }\n'
+
+    for _, _, source_id, target_id, link_type, label, color in graph.iter_edges():
+        arrowhead = 'none' if link_type == LinkType.INVISIBLE else None
+        yield f'  {_dot_string(source_id)} -> {_dot_string(target_id)}{_dot_attributes(label=label, color=color, arrowhead=arrowhead)};\n'
+    yield '}\n'
+
+
+@register_exporter('msgpack', 'msgpack', 'application/msgpack', available=msgpack is not None)
+def render_msgpack_snapshot(graph: SubprojectGraph) -> Iterator[bytes]:
+    """
+    Instantané MessagePack compact. Nœuds : [mermaid_id, libellé, indice du subgraph ou nil, classe] ;
+    liens : [indice source, indice cible, indice du type dans 'link_types', libellé, couleur], les
+    indices étant les positions dans les tableaux. Les tailles des tableaux sont comptées avant
+    l'envoi ; seule la table id -> indice des nœuds est gardée en mémoire.
+    """
+    packer = msgpack.Packer(autoreset=True)
+    subgraphs = graph.subgraphs()
+    subgraph_indexes = {row[0]: index for index, row in enumerate(subgraphs)}
+    link_type_indexes = {value: index for index, value in enumerate(SNAPSHOT_LINK_TYPES)}
+    node_count, edge_count = graph.count_nodes(), graph.count_edges()
+
+    yield packer.pack_map_header(7)
+    yield packer.pack('schema') + packer.pack(SNAPSHOT_SCHEMA_VERSION)
+    yield packer.pack('subproject') + packer.pack({
+        'id': graph.subproject_id, 'title': graph.title, 'version': graph.version,
+        'graph_direction': graph.graph_direction,
+    })
+    yield packer.pack('link_types') + packer.pack(SNAPSHOT_LINK_TYPES)
+    yield packer.pack('class_defs') + packer.pack([list(row) for row in graph.class_defs()])
+    yield packer.pack('subgraphs') + packer.pack([[mermaid_id, title, class_ref] for _, mermaid_id, title, class_ref in subgraphs])
+
+    def modified() -> RuntimeError:
+        return RuntimeError(f"SubProject {graph.subproject_id} modifié pendant l'export MessagePack.")
+
+    node_indexes: Dict[int, int] = {}
+    yield packer.pack('nodes') + packer.pack_array_header(node_count)
+    for node_id, mermaid_id, label, subgraph_id, class_ref in graph.iter_nodes():
+        if len(node_indexes) == node_count:
+            raise modified()
+        node_indexes[node_id] = len(node_indexes)
+        yield packer.pack([mermaid_id, label or mermaid_id, subgraph_indexes.get(subgraph_id), class_ref])
+    if len(node_indexes) != node_count:
+        raise modified()
+
+    written = 0
+    yield packer.pack('edges') + packer.pack_array_header(edge_count)
+    for source_node_id, target_node_id, _, _, link_type, label, color in graph.iter_edges():
+        if written == edge_count or source_node_id not in node_indexes or target_node_id not in node_indexes:
+            raise modified()
+        written += 1
+        yield packer.pack([node_indexes[source_node_id], node_indexes[target_node_id],
+                           link_type_indexes[link_type.value], label, color])
+    if written != edge_count:
+        raise modified()
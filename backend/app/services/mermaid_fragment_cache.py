@@ -0,0 +1,483 @@
+# backend/app/services/mermaid_fragment_cache.py
+# Version 1.4
+"""
+Cache des fragments du code Mermaid généré, par SubProject.
+
+Le texte produit par le générateur est découpé en fragments : une ligne par nœud, un bloc par
+subgraph (et un pour les nœuds hors subgraph), la section classDef, la section des applications
+de classes et la section des relations. Chaque écriture ORM sur Node, Subgraph, Relationship ou
+ClassDef marque l'entité touchée dans la session ; au rendu, seules les entités marquées sont relues
+(par id) et re-rendues, puis le texte est réassemblé à partir des fragments. Les marques d'une
+transaction validée sans rendu sont reportées sur l'entrée du cache pour le rendu suivant. Les mises
+à jour en masse par le Core, invisibles de l'ORM, signalent leurs nœuds avec mark_stale().
+
+Les SubProjects marqués sont aussi ceux dont la définition est régénérée au commit
+(voir mermaid_generator) : dirty_subproject_ids() en donne la liste.
+
+Une entrée n'est réutilisée que si elle a été validée pour la version courante du SubProject et si
+l'empreinte du texte qu'elle a produit est celle de la définition stockée. La version est attachée
+à l'entrée au commit de la transaction qui l'a rendue (jamais si elle est annulée) : toute écriture
+ailleurs (synchronisation depuis le texte, entités supprimées puis recréées par un autre processus)
+change la version et provoque une reconstruction complète, même si le texte est identique.
+"""
+
+import bisect
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import ClassDef, LinkType, Node, Relationship, SubProject, Subgraph
+from app.services.mermaid_render import ID_BATCH_SIZE, node_line, relationship_line, rows_by_id, subgraph_header
+
+DEFAULT_MAX_ENTRIES = 16
+# Au-delà de cette part d'entités marquées (et d'un lot de requête), tout reconstruire coûte moins cher
+FULL_REBUILD_RATIO = 0.25
+_SESSION_MARKS_KEY = 'mermaid_fragment_marks'
+_SESSION_VERSIONS_KEY = 'mermaid_fragment_versions'
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _insert_sorted(mapping: Dict[int, Any], key: int, value: Any) -> None:
+    """Affecte mapping[key] en gardant les clés triées (les nouveaux ids sont en pratique les plus grands)."""
+    if key in mapping or not mapping or key > next(reversed(mapping)):
+        mapping[key] = value
+        return
+    mapping[key] = value
+    items = sorted(mapping.items())
+    mapping.clear()
+    mapping.update(items)
+
+
+class _FullRebuild(Exception):
+    """Les fragments ne peuvent pas être mis à jour incrémentalement."""
+
+
+class _Marks:
+    """Entités d'un SubProject modifiées dans la transaction courante."""
+
+    __slots__ = ('nodes', 'subgraphs', 'relationships', 'classdefs')
+
+    def __init__(self):
+        self.nodes: Set[int] = set()
+        self.subgraphs: Set[int] = set()
+        self.relationships: Set[int] = set()
+        self.classdefs = False
+
+    def update(self, other: "_Marks") -> None:
+        self.nodes |= other.nodes
+        self.subgraphs |= other.subgraphs
+        self.relationships |= other.relationships
+        self.classdefs = self.classdefs or other.classdefs
+
+
+class _SubprojectFragments:
+    """Fragments rendus d'un SubProject ; toutes les collections sont ordonnées par id."""
+
+    def __init__(self, subproject_id: int):
+        self.subproject_id = subproject_id
+        self.digest: Optional[str] = None
+        self.version: Optional[int] = None  # Version du SubProject validée avec ce rendu
+        self.nodes: Dict[int, Tuple[str, Optional[int], Optional[str]]] = {}  # id -> (mermaid_id, subgraph_id, classe)
+        self.node_lines: Dict[int, str] = {}
+        self.members: Dict[Optional[int], List[int]] = {None: []}  # groupe (None = hors subgraph) -> ids triés
+        self.subgraphs: Dict[int, Tuple[str, str, Optional[str]]] = {}  # id -> (mermaid_id, en-tête, classe)
+        self.edges: Dict[int, Tuple[int, int, Optional[str]]] = {}  # id -> (source, cible, ligne)
+        self.classed: Dict[int, str] = {}  # id de nœud -> ligne 'class ...'
+        self.blocks: Dict[Optional[int], str] = {}
+        self.classdef_section = ""
+        self.class_section: Optional[str] = None
+        self.edge_section: Optional[str] = None
+        self.stale_blocks: Set[Optional[int]] = set()
+
+    # --- Chargement ---
+
+    @classmethod
+    def load(cls, subproject_id: int, session) -> "_SubprojectFragments":
+        """Reconstruction complète : quatre requêtes de colonnes dans `session`, sans objets ORM."""
+        fragments = cls(subproject_id)
+        fragments._load_classdefs(session)
+        for subgraph_id, mermaid_id, title, style_class_ref in session.execute(
+            db.select(Subgraph.id, Subgraph.mermaid_id, Subgraph.title, Subgraph.style_class_ref)
+            .where(Subgraph.subproject_id == subproject_id).order_by(Subgraph.id)
+        ):
+            fragments.subgraphs[subgraph_id] = (mermaid_id, subgraph_header(mermaid_id, title), style_class_ref)
+            fragments.members[subgraph_id] = []
+        for node_id, mermaid_id, label, subgraph_id, style_class_ref in session.execute(
+            fragments._node_columns().order_by(Node.id)
+        ):
+            fragments.nodes[node_id] = (mermaid_id, subgraph_id, style_class_ref)
+            fragments.node_lines[node_id] = node_line(mermaid_id, label)
+            fragments.members.setdefault(subgraph_id, []).append(node_id)
+            if style_class_ref:
+                fragments.classed[node_id] = f"class {mermaid_id} {style_class_ref}"
+        for edge_id, source_id, target_id, link_type, label in session.execute(
+            fragments._relationship_columns().order_by(Relationship.id)
+        ):
+            fragments.edges[edge_id] = (source_id, target_id, fragments._edge_line(source_id, target_id, link_type, label))
+        fragments.stale_blocks.update(fragments.members)
+        return fragments
+
+    def _node_columns(self):
+        # text_content n'est lu que pour les nœuds sans titre
+        return db.select(
+            Node.id, Node.mermaid_id, func.coalesce(Node.title, Node.text_content), Node.subgraph_id, Node.style_class_ref
+        ).where(Node.subproject_id == self.subproject_id)
+
+    def _relationship_columns(self):
+        return db.select(
+            Relationship.id, Relationship.source_node_id, Relationship.target_node_id, Relationship.link_type, Relationship.label
+        ).where(Relationship.subproject_id == self.subproject_id)
+
+    def _load_classdefs(self, session) -> None:
+        lines = [f"classDef {name} {definition_raw}" for name, definition_raw in session.execute(
+            db.select(ClassDef.name, ClassDef.definition_raw)
+            .where(ClassDef.subproject_id == self.subproject_id).order_by(ClassDef.id)
+        )]
+        self.classdef_section = "\n".join(["%% Class Definitions", *lines, ""]) if lines else ""
+
+    def _edge_line(self, source_id: int, target_id: int, link_type: LinkType, label: Optional[str]) -> Optional[str]:
+        source, target = self.nodes.get(source_id), self.nodes.get(target_id)
+        if source is None or target is None:
+            return None  # Comme le générateur : relation vers un nœud hors du SubProject ignorée
+        return relationship_line(source[0], target[0], link_type, label)
+
+    # --- Mise à jour incrémentale ---
+
+    def refresh(self, marks: _Marks, session) -> None:
+        """Relit (dans `session`) et re-rend les seules entités marquées."""
+        marked = len(marks.nodes) + len(marks.subgraphs) + len(marks.relationships)
+        if marked > ID_BATCH_SIZE and marked > FULL_REBUILD_RATIO * (len(self.nodes) + len(self.edges)):
+            raise _FullRebuild()
+        if marks.classdefs:
+            self._load_classdefs(session)
+        stale_nodes = set(marks.nodes)
+        stale_edges = set(marks.relationships)
+        if marks.subgraphs:
+            self._refresh_subgraphs(marks.subgraphs, stale_nodes, session)
+        if stale_nodes:
+            self._refresh_nodes(stale_nodes, stale_edges, session)
+        if stale_edges:
+            self._refresh_edges(stale_edges, session)
+
+    def _refresh_subgraphs(self, subgraph_ids: Set[int], stale_nodes: Set[int], session) -> None:
+        rows = rows_by_id(
+            db.select(Subgraph.id, Subgraph.mermaid_id, Subgraph.title, Subgraph.style_class_ref)
+            .where(Subgraph.subproject_id == self.subproject_id),
+            Subgraph.id, subgraph_ids, session,
+        )
+        for subgraph_id in subgraph_ids:
+            row = rows.get(subgraph_id)
+            previous = self.subgraphs.get(subgraph_id)
+            if row is None:
+                if previous is not None:
+                    # Subgraph supprimé : ses nœuds ont été détachés (souvent par le Core), on les relit
+                    del self.subgraphs[subgraph_id]
+                    stale_nodes.update(self.members.pop(subgraph_id, ()))
+                    self.blocks.pop(subgraph_id, None)
+                    self.class_section = None
+                continue
+            mermaid_id, title, style_class_ref = row
+            _insert_sorted(self.subgraphs, subgraph_id, (mermaid_id, subgraph_header(mermaid_id, title), style_class_ref))
+            self.members.setdefault(subgraph_id, [])
+            self.stale_blocks.add(subgraph_id)
+            if previous is None or (previous[0], previous[2]) != (mermaid_id, style_class_ref):
+                self.class_section = None
+
+    def _remove_member(self, group: Optional[int], node_id: int) -> None:
+        members = self.members.get(group)
+        if members:
+            index = bisect.bisect_left(members, node_id)
+            if index < len(members) and members[index] == node_id:
+                del members[index]
+                self.stale_blocks.add(group)
+
+    def _refresh_nodes(self, node_ids: Set[int], stale_edges: Set[int], session) -> None:
+        rows = rows_by_id(self._node_columns(), Node.id, node_ids, session)
+        renamed: Set[int] = set()
+        for node_id in node_ids:
+            row = rows.get(node_id)
+            previous = self.nodes.get(node_id)
+            if previous is not None and (row is None or row[2] != previous[1]):
+                self._remove_member(previous[1], node_id)
+            if row is None:
+                if previous is not None:
+                    del self.nodes[node_id], self.node_lines[node_id]
+                    if self.classed.pop(node_id, None) is not None:
+                        self.class_section = None
+                    renamed.add(node_id)
+                continue
+
+            mermaid_id, label, subgraph_id, style_class_ref = row
+            if subgraph_id not in self.members:
+                raise _FullRebuild()  # Subgraph inconnu des fragments
+            if previous is None or subgraph_id != previous[1]:
+                bisect.insort(self.members[subgraph_id], node_id)
+            line = node_line(mermaid_id, label)
+            if self.node_lines.get(node_id) != line or previous is None or subgraph_id != previous[1]:
+                self.stale_blocks.add(subgraph_id)
+            _insert_sorted(self.nodes, node_id, (mermaid_id, subgraph_id, style_class_ref))
+            self.node_lines[node_id] = line
+
+            class_line = f"class {mermaid_id} {style_class_ref}" if style_class_ref else None
+            if self.classed.get(node_id) != class_line:
+                if class_line is None:
+                    del self.classed[node_id]
+                else:
+                    _insert_sorted(self.classed, node_id, class_line)
+                self.class_section = None
+            if previous is None or previous[0] != mermaid_id:
+                renamed.add(node_id)
+
+        if renamed:
+            # Identifiant Mermaid changé, nœud apparu ou disparu : les lignes de ses relations changent
+            stale_edges.update(
+                edge_id for edge_id, (source_id, target_id, _) in self.edges.items()
+                if source_id in renamed or target_id in renamed
+            )
+
+    def _refresh_edges(self, edge_ids: Set[int], session) -> None:
+        rows = rows_by_id(self._relationship_columns(), Relationship.id, edge_ids, session)
+        for edge_id in edge_ids:
+            row = rows.get(edge_id)
+            if row is None:
+                self.edges.pop(edge_id, None)
+            else:
+                source_id, target_id, link_type, label = row
+                _insert_sorted(self.edges, edge_id, (source_id, target_id, self._edge_line(*row)))
+        self.edge_section = None
+
+    # --- Assemblage ---
+
+    def assemble(self, graph_direction: str) -> str:
+        """Re-rend les fragments périmés et assemble le texte (identique à generate_mermaid_document)."""
+        for group in self.stale_blocks:
+            if group is None:
+                self.blocks[None] = "\n".join(self.node_lines[node_id] for node_id in self.members[None])
+            elif group in self.subgraphs:
+                member_lines = [self.node_lines[node_id] for node_id in self.members.get(group, ())]
+                self.blocks[group] = "\n".join([self.subgraphs[group][1], *member_lines, "end", ""])
+        self.stale_blocks.clear()
+        if self.class_section is None:
+            subgraph_lines = [f"class {mermaid_id} {style}" for mermaid_id, _, style in self.subgraphs.values() if style]
+            self.class_section = "\n".join([*self.classed.values(), *subgraph_lines])
+        if self.edge_section is None:
+            self.edge_section = "\n".join(line for _, _, line in self.edges.values() if line is not None)
+
+        pieces = [f"graph {graph_direction}", ""]
+        if self.classdef_section:
+            pieces.append(self.classdef_section)
+        pieces.append("%% Nodes & Subgraphs Definitions")
+        if self.members[None]:
+            pieces.append(self.blocks[None])
+        pieces.extend(self.blocks[subgraph_id] for subgraph_id in self.subgraphs)
+        pieces.extend(["", "%% Class Applications"])
+        if self.class_section:
+            pieces.append(self.class_section)
+        pieces.extend(["", "%% Relationships"])
+        if self.edge_section:
+            pieces.append(self.edge_section)
+        return "\n".join(pieces)
+
+
+class MermaidFragmentCache:
+    """Cache LRU thread-safe des fragments, borné en nombre de SubProjects."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _SubprojectFragments]" = OrderedDict()
+        # Marques validées sans rendu, par SubProject en cache (ou en cours de rendu)
+        self._pending: Dict[int, _Marks] = {}
+        self._rendering: Set[int] = set()
+        self._lock = threading.Lock()
+        self.full_builds = 0
+        self.incremental_renders = 0
+
+    def init_app(self, app) -> None:
+        """Applique la limite définie dans la configuration de l'application."""
+        self.max_entries = app.config.get('MERMAID_FRAGMENT_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+        self.clear()
+
+    def render(self, subproject: SubProject) -> str:
+        """
+        Code Mermaid du SubProject, assemblé à partir des fragments en cache mis à jour avec les
+        marques de la transaction courante (reconstruction complète si l'entrée est absente ou caduque).
+        Marques et lectures passent par la session du SubProject (à défaut, db.session). Le rendu
+        n'est réutilisable qu'une fois sa version validée (voir record_rendered_version).
+        """
+        session = Session.object_session(subproject) or db.session
+        session.flush()  # Les écritures en attente posent leurs marques avant le rendu
+        marks = _session_marks(session).pop(subproject.id, None) or _Marks()
+        # L'entrée est retirée du cache le temps du rendu : aucun autre thread ne la modifie
+        with self._lock:
+            fragments = self._entries.pop(subproject.id, None)
+            pending = self._pending.pop(subproject.id, None)
+            self._rendering.add(subproject.id)
+        if pending is not None:
+            marks.update(pending)
+
+        if (fragments is not None and fragments.version == subproject.version
+                and fragments.digest == _digest(subproject.mermaid_definition or "")):
+            try:
+                fragments.refresh(marks, session)
+                with self._lock:
+                    self.incremental_renders += 1
+            except _FullRebuild:
+                fragments = None
+        else:
+            fragments = None
+        if fragments is None:
+            try:
+                fragments = _SubprojectFragments.load(subproject.id, session)
+            except Exception:
+                with self._lock:
+                    self._rendering.discard(subproject.id)
+                raise
+            with self._lock:
+                self.full_builds += 1
+
+        try:
+            text = fragments.assemble(subproject.graph_direction)
+        finally:
+            with self._lock:
+                self._rendering.discard(subproject.id)
+        fragments.digest = _digest(text)
+        fragments.version = None  # Attachée au commit (record_rendered_version)
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[subproject.id] = fragments
+                while len(self._entries) > self.max_entries:
+                    evicted_id, _ = self._entries.popitem(last=False)
+                    self._pending.pop(evicted_id, None)
+        return text
+
+    def validate(self, subproject_id: int, version: int) -> None:
+        """Attache la version validée au commit au dernier rendu en cache du SubProject."""
+        with self._lock:
+            fragments = self._entries.get(subproject_id)
+            if fragments is not None:
+                fragments.version = version
+
+    def defer(self, subproject_id: int, marks: _Marks) -> None:
+        """Reporte les marques d'une transaction validée sur le prochain rendu du SubProject."""
+        with self._lock:
+            if subproject_id in self._entries or subproject_id in self._rendering:
+                self._pending.setdefault(subproject_id, _Marks()).update(marks)
+
+    def discard(self, subproject_id: int) -> None:
+        with self._lock:
+            self._entries.pop(subproject_id, None)
+            self._pending.pop(subproject_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+            self.full_builds = self.incremental_renders = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'full_builds': self.full_builds,
+                'incremental_renders': self.incremental_renders,
+            }
+
+
+# Instance partagée, configurée par create_app()
+fragment_cache = MermaidFragmentCache()
+
+
+# --- Marquage des entités modifiées ---
+
+def _session_marks(session) -> Dict[int, _Marks]:
+    return session.info.setdefault(_SESSION_MARKS_KEY, {})
+
+
+def mark_stale(subproject_id: int, nodes: Iterable[int] = (), subgraphs: Iterable[int] = (),
+               relationships: Iterable[int] = (), classdefs: bool = False) -> None:
+    """
+    Signale des entités modifiées hors de l'ORM (mises à jour en masse par le Core) : elles seront
+    relues au prochain rendu du SubProject, régénéré au commit de la transaction.
+    """
+    marks = _session_marks(db.session).setdefault(subproject_id, _Marks())
+    marks.nodes.update(nodes)
+    marks.subgraphs.update(subgraphs)
+    marks.relationships.update(relationships)
+    marks.classdefs = marks.classdefs or classdefs
+
+
+def mark_definition_current(subproject_id: int) -> None:
+    """La définition vient d'être écrite depuis le texte (synchronisation) : rien à régénérer au commit."""
+    _session_marks(db.session).pop(subproject_id, None)
+
+
+def record_rendered_version(session, subproject_id: int, version: int) -> None:
+    """
+    Version que prend le SubProject avec la définition rendue dans la transaction de `session` :
+    elle est attachée à l'entrée du cache au commit, et oubliée si la transaction est annulée.
+    """
+    session.info.setdefault(_SESSION_VERSIONS_KEY, {})[subproject_id] = version
+
+
+def dirty_subproject_ids(session) -> List[int]:
+    """SubProjects dont des entités ont changé dans la transaction de `session` sans être re-rendus."""
+    return list(session.info.get(_SESSION_MARKS_KEY, ()))
+
+
+def _mark_entity(target) -> None:
+    session = Session.object_session(target)
+    if session is None:
+        return
+    # Entité déplacée d'un SubProject à l'autre : les deux sont marqués
+    history = inspect(target).attrs.subproject_id.history
+    subproject_ids = {target.subproject_id, *history.deleted} - {None}
+    marks = _session_marks(session)
+    for subproject_id in subproject_ids:
+        entry = marks.setdefault(subproject_id, _Marks())
+        if isinstance(target, Node):
+            entry.nodes.add(target.id)
+        elif isinstance(target, Subgraph):
+            entry.subgraphs.add(target.id)
+        elif isinstance(target, Relationship):
+            entry.relationships.add(target.id)
+        else:
+            entry.classdefs = True
+
+
+for _model in (Node, Subgraph, Relationship, ClassDef):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, lambda mapper, connection, target: _mark_entity(target))
+
+
+@event.listens_for(SubProject, 'after_delete')
+def _discard_deleted_subproject(mapper, connection, target: SubProject) -> None:
+    fragment_cache.discard(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _defer_session_marks(session) -> None:
+    """
+    Les rendus de la transaction sont validés pour leur version ; les marques non consommées par un
+    rendu passent au cache. La session repart à vide.
+    """
+    for subproject_id, version in session.info.pop(_SESSION_VERSIONS_KEY, {}).items():
+        fragment_cache.validate(subproject_id, version)
+    for subproject_id, marks in session.info.pop(_SESSION_MARKS_KEY, {}).items():
+        fragment_cache.defer(subproject_id, marks)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_session_marks(session, previous_transaction) -> None:
+    """Les marques et rendus d'une transaction annulée sont abandonnés (rendus jamais validés)."""
+    if previous_transaction.parent is None:
+        session.info.pop(_SESSION_MARKS_KEY, None)
+        session.info.pop(_SESSION_VERSIONS_KEY, None)
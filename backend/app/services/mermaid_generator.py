@@ -1,137 +1,245 @@
 # backend/app/services/mermaid_generator.py
-# Version 1.2
+# Version 2.3
 
-from typing import List, Dict
-from sqlalchemy.orm import selectinload
+from collections import defaultdict
+from typing import Iterator, List, Dict, Optional, Tuple
+from sqlalchemy import event, func
+from sqlalchemy.orm import aliased
 from werkzeug.exceptions import NotFound
 
 from app import db
-from app.models import SubProject, Node, Relationship, ClassDef, LinkType, Subgraph
+from app.models import SubProject, Node, Relationship, ClassDef, Subgraph, bump_subproject_version
+from app.services.mermaid_fragment_cache import dirty_subproject_ids, fragment_cache, record_rendered_version
+from app.services.mermaid_grammar import SourceMap, edge_source_key, new_source_map
+from app.services.mermaid_render import (
+    EXPORT_CHUNK_SIZE, join_chunks, node_line, relationship_line, stream_rows, subgraph_header,
+)
 
-# --- Constantes ---
-RELATIONSHIP_LINK_MAP = {
-    LinkType.VISIBLE: "-->",
-    LinkType.INVISIBLE: "---",
-}
 
-def _sanitize_title(title: str, default_id: str) -> str:
-    """Nettoie le titre pour l'affichage dans un nœud Mermaid (met entre guillemets si nécessaire)."""
-    if not title:
-        return default_id
-
-    # Échapper les guillemets internes si le titre est long
-    safe_title = title.replace('"', '#quot;')
+def generate_mermaid_from_subproject(subproject_id: int) -> str:
+    """
+    Génère le code Mermaid complet à partir des entités de la base de données
+    pour un SubProject donné, en incluant les subgraphs.
+    """
+    return generate_mermaid_document(subproject_id)[0]
 
-    # Si le titre contient des espaces ou des caractères spéciaux, le mettre entre guillemets
-    # Le titre d'un subgraph peut contenir des crochets, il faut les autoriser
-    if ' ' in title:
-        return f'"{safe_title}"'
 
-    return safe_title
+def regenerate_mermaid_definition(subproject: SubProject) -> None:
+    """
+    Régénère la définition Mermaid d'un SubProject à partir des fragments en cache : seules les
+    entités modifiées depuis le dernier rendu sont relues. Le texte produit n'est pas ré-analysé :
+    l'empreinte structurelle et la carte des sources, effacées par l'écriture de la définition, sont
+    recalculées à la première lecture (get_structure_hash, get_source_map).
+    """
+    subproject.mermaid_definition = fragment_cache.render(subproject)
 
 
-def generate_mermaid_from_subproject(subproject_id: int) -> str:
+@event.listens_for(db.session.session_factory.class_, 'before_commit')
+def _regenerate_dirty_subprojects(session) -> None:
     """
-    Génère le code Mermaid complet à partir des entités de la base de données
-    pour un SubProject donné, en incluant les subgraphs.
+    Régénère, une seule fois par transaction, la définition de chaque SubProject dont des entités ont
+    changé (marques posées au flush). Les services n'appellent donc plus le générateur eux-mêmes.
+    La version est incrémentée même si le texte est inchangé (contenu d'un nœud titré, par exemple).
+    Les SubProjects supprimés ou en cours d'import par morceaux sont ignorés. Seules les sessions de
+    db.session sont écoutées ; le rendu passe par la session reçue. La version obtenue est notée
+    pour le cache de fragments, qui ne réutilise le rendu que pour cette version.
+    """
+    session.flush()
+    regenerated = []
+    for subproject_id in dirty_subproject_ids(session):
+        subproject = session.get(SubProject, subproject_id)
+        if subproject is not None and subproject.import_checkpoint is None:
+            regenerate_mermaid_definition(subproject)
+            bump_subproject_version(subproject)
+            regenerated.append(subproject)
+    if regenerated:
+        session.flush()
+        for subproject in regenerated:
+            record_rendered_version(session, subproject.id, subproject.version)
+
+
+def generate_mermaid_document(subproject_id: int) -> Tuple[str, SourceMap]:
     """
+    Génère le code Mermaid d'un SubProject et sa carte des sources (même format que
+    parse_flowchart : intervalle de lignes de chaque nœud, lien, classDef et subgraph).
 
-    # 1. Charger le SubProject avec toutes ses relations (eager loading)
-    subproject = db.session.execute(
-        db.select(SubProject)
-        .options(
-            selectinload(SubProject.nodes), # type: ignore[arg-type]
-            selectinload(SubProject.relationships), # type: ignore[arg-type]
-            selectinload(SubProject.class_defs), # type: ignore[arg-type]
-            selectinload(SubProject.subgraphs).options(selectinload(Subgraph.nodes)) # type: ignore[arg-type]
-        )
-        .filter(SubProject.id == subproject_id)
-    ).scalar_one_or_none()
+    Les entités sont lues colonne par colonne (tuples, sans objets ORM) en quatre requêtes ;
+    text_content n'est lu que pour les nœuds sans titre.
+    """
+
+    # 1. Direction du graphe et subgraphs (jointure externe : un SubProject sans subgraph donne une ligne)
+    subgraph_rows = db.session.execute(
+        db.select(SubProject.graph_direction, Subgraph.id, Subgraph.mermaid_id, Subgraph.title, Subgraph.style_class_ref)
+        .outerjoin(Subgraph, Subgraph.subproject_id == SubProject.id)
+        .where(SubProject.id == subproject_id).order_by(Subgraph.id)
+    ).all()
 
-    if subproject is None:
+    if not subgraph_rows:
         raise NotFound(f"SubProject ID {subproject_id} non trouvé.")
 
+    graph_direction = subgraph_rows[0][0]
+    subgraphs = [row[1:] for row in subgraph_rows if row[1] is not None]
+    class_defs = db.session.execute(
+        db.select(ClassDef.name, ClassDef.definition_raw)
+        .where(ClassDef.subproject_id == subproject_id).order_by(ClassDef.id)
+    ).all()
+    nodes = db.session.execute(
+        db.select(Node.id, Node.mermaid_id, func.coalesce(Node.title, Node.text_content), Node.subgraph_id, Node.style_class_ref)
+        .where(Node.subproject_id == subproject_id).order_by(Node.id)
+    ).all()
+    relationships = db.session.execute(
+        db.select(Relationship.source_node_id, Relationship.target_node_id, Relationship.link_type, Relationship.label)
+        .where(Relationship.subproject_id == subproject_id).order_by(Relationship.id)
+    ).all()
+
     mermaid_parts: List[str] = []
+    source_map = new_source_map()
+    # Le numéro (à partir de 1) de la prochaine ligne est len(mermaid_parts) + 1
+
+    def append_node(mermaid_id: str, label: Optional[str]) -> None:
+        mermaid_parts.append(node_line(mermaid_id, label))
+        source_map['nodes'][mermaid_id] = [len(mermaid_parts)] * 2
 
     # --- 2. Déclaration du type de graphe ---
-    mermaid_parts.append(f"graph {subproject.graph_direction}")
+    mermaid_parts.append(f"graph {graph_direction}")
     mermaid_parts.append("")
 
     # --- 3. Ajout des Définitions de Classe (classDef) ---
-    if subproject.class_defs:
+    if class_defs:
         mermaid_parts.append("%% Class Definitions")
-        for class_def in subproject.class_defs:
-            mermaid_parts.append(f"classDef {class_def.name} {class_def.definition_raw}")
+        for name, definition_raw in class_defs:
+            mermaid_parts.append(f"classDef {name} {definition_raw}")
+            source_map['classdefs'][name] = [len(mermaid_parts)] * 2
         mermaid_parts.append("")
 
     # --- 4. Définition des Nœuds et Subgraphs ---
     mermaid_parts.append("%% Nodes & Subgraphs Definitions")
 
-    # Nœuds qui ne sont dans aucun subgraph
-    nodes_without_subgraph = [node for node in subproject.nodes if node.subgraph_id is None]
+    # Une seule passe sur les nœuds : regroupement par subgraph_id (None = hors subgraph), ordre conservé
+    nodes_by_subgraph: Dict[Optional[int], List[Tuple[str, Optional[str]]]] = defaultdict(list)
+    for _, mermaid_id, label, subgraph_id, _ in nodes:
+        nodes_by_subgraph[subgraph_id].append((mermaid_id, label))
 
-    for node in nodes_without_subgraph:
-        title = node.title if node.title is not None else node.text_content
-        safe_title = _sanitize_title(title, node.mermaid_id)
-        mermaid_parts.append(f"    {node.mermaid_id}[{safe_title}]")
+    # Nœuds qui ne sont dans aucun subgraph
+    for mermaid_id, label in nodes_by_subgraph.get(None, ()):
+        append_node(mermaid_id, label)
 
     # Itérer sur les subgraphs
-    if subproject.subgraphs:
-        for subgraph in subproject.subgraphs:
-            safe_subgraph_title = _sanitize_title(subgraph.title, subgraph.mermaid_id)
-            mermaid_parts.append(f"subgraph {subgraph.mermaid_id}[{safe_subgraph_title}]")
-            
-            # Charger les nœuds de ce subgraph depuis subproject.nodes
-            subgraph_nodes = [node for node in subproject.nodes if node.subgraph_id == subgraph.id]
-            for node in subgraph_nodes:
-                title = node.title if node.title is not None else node.text_content
-                safe_title = _sanitize_title(title, node.mermaid_id)
-                mermaid_parts.append(f"    {node.mermaid_id}[{safe_title}]")
-            mermaid_parts.append("end")
-            mermaid_parts.append("")
+    for subgraph_id, subgraph_mermaid_id, subgraph_title, _ in subgraphs:
+        mermaid_parts.append(subgraph_header(subgraph_mermaid_id, subgraph_title))
+        subgraph_start = len(mermaid_parts)
+        for mermaid_id, label in nodes_by_subgraph.get(subgraph_id, ()):
+            append_node(mermaid_id, label)
+        mermaid_parts.append("end")
+        source_map['subgraphs'][subgraph_mermaid_id] = [subgraph_start, len(mermaid_parts)]
+        mermaid_parts.append("")
 
     mermaid_parts.append("")
 
     # --- 5. Application des Classes (sur nœuds et subgraphs) ---
     mermaid_parts.append("%% Class Applications")
-    node_classes_applied = {
-        node.mermaid_id: node.style_class_ref
-        for node in subproject.nodes if node.style_class_ref
-    }
-    subgraph_classes_applied = {
-        subgraph.mermaid_id: subgraph.style_class_ref
-        for subgraph in subproject.subgraphs if subgraph.style_class_ref
-    }
-
-    if node_classes_applied:
-        for mermaid_id, class_ref in node_classes_applied.items():
+    for _, mermaid_id, _, _, class_ref in nodes:
+        if class_ref:
             mermaid_parts.append(f"class {mermaid_id} {class_ref}")
-    if subgraph_classes_applied:
-        for mermaid_id, class_ref in subgraph_classes_applied.items():
+    for _, mermaid_id, _, class_ref in subgraphs:
+        if class_ref:
             mermaid_parts.append(f"class {mermaid_id} {class_ref}")
     mermaid_parts.append("")
 
 
     # --- 6. Définition des Relations (A-->B) ---
     mermaid_parts.append("%% Relationships")
-    nodes_map: Dict[int, Node] = {node.id: node for node in subproject.nodes}
-    for rel in subproject.relationships:
-        source_node = nodes_map.get(rel.source_node_id)
-        target_node = nodes_map.get(rel.target_node_id)
+    mermaid_ids: Dict[int, str] = {node_id: mermaid_id for node_id, mermaid_id, _, _, _ in nodes}
+    for source_node_id, target_node_id, link_type, label in relationships:
+        source_id = mermaid_ids.get(source_node_id)
+        target_id = mermaid_ids.get(target_node_id)
 
-        if not source_node or not target_node:
+        if source_id is None or target_id is None:
             continue
 
-        connector = RELATIONSHIP_LINK_MAP.get(rel.link_type, "---")
-
-        label_part = ""
-        if rel.label:
-            safe_label = rel.label.replace('|', '/')
-            label_part = f"|{safe_label}|"
-
-        mermaid_parts.append(
-            f"{source_node.mermaid_id}{connector}{label_part}{target_node.mermaid_id}"
-        )
+        mermaid_parts.append(relationship_line(source_id, target_id, link_type, label))
+        source_map['edges'].setdefault(edge_source_key(source_id, target_id), []).append([len(mermaid_parts)] * 2)
 
     # Reconstruit la chaîne complète
-    return "\n".join(mermaid_parts)
\ No newline at end of file
+    return "\n".join(mermaid_parts), source_map
+
+def iter_mermaid_lines(subproject_id: int, graph_direction: str) -> Iterator[str]:
+    """
+    Lignes du code Mermaid d'un SubProject, dans l'ordre de generate_mermaid_document, lues
+    colonne par colonne (tuples, sans objets ORM). Les nœuds des subgraphs arrivent triés par
+    (subgraph, nœud) : chaque bloc est émis au fil de l'eau, sans retenir les nœuds en mémoire.
+    """
+    yield f"graph {graph_direction}"
+    yield ""
+
+    class_defs = db.session.execute(
+        db.select(ClassDef.name, ClassDef.definition_raw)
+        .where(ClassDef.subproject_id == subproject_id).order_by(ClassDef.id)
+    ).all()
+    if class_defs:
+        yield "%% Class Definitions"
+        for name, definition_raw in class_defs:
+            yield f"classDef {name} {definition_raw}"
+        yield ""
+
+    yield "%% Nodes & Subgraphs Definitions"
+    node_label = func.coalesce(Node.title, Node.text_content)
+    for mermaid_id, label in stream_rows(
+        db.select(Node.mermaid_id, node_label)
+        .where(Node.subproject_id == subproject_id, Node.subgraph_id.is_(None)).order_by(Node.id)
+    ):
+        yield node_line(mermaid_id, label)
+
+    # Jointure externe : les subgraphs vides produisent une ligne sans nœud
+    current_subgraph = None
+    for subgraph_id, subgraph_mermaid_id, subgraph_title, mermaid_id, label in stream_rows(
+        db.select(Subgraph.id, Subgraph.mermaid_id, Subgraph.title, Node.mermaid_id, node_label)
+        .outerjoin(Node, Node.subgraph_id == Subgraph.id)
+        .where(Subgraph.subproject_id == subproject_id).order_by(Subgraph.id, Node.id)
+    ):
+        if subgraph_id != current_subgraph:
+            if current_subgraph is not None:
+                yield "end"
+                yield ""
+            current_subgraph = subgraph_id
+            yield subgraph_header(subgraph_mermaid_id, subgraph_title)
+        if mermaid_id is not None:
+            yield node_line(mermaid_id, label)
+    if current_subgraph is not None:
+        yield "end"
+        yield ""
+    yield ""
+
+    yield "%% Class Applications"
+    for model in (Node, Subgraph):
+        for mermaid_id, class_ref in stream_rows(
+            db.select(model.mermaid_id, model.style_class_ref)
+            .where(model.subproject_id == subproject_id, model.style_class_ref.isnot(None), model.style_class_ref != '')
+            .order_by(model.id)
+        ):
+            yield f"class {mermaid_id} {class_ref}"
+    yield ""
+
+    yield "%% Relationships"
+    source, target = aliased(Node), aliased(Node)
+    for source_id, target_id, link_type, label in stream_rows(
+        db.select(source.mermaid_id, target.mermaid_id, Relationship.link_type, Relationship.label)
+        .join(source, Relationship.source_node_id == source.id)
+        .join(target, Relationship.target_node_id == target.id)
+        .where(Relationship.subproject_id == subproject_id).order_by(Relationship.id)
+    ):
+        yield relationship_line(source_id, target_id, link_type, label)
+
+
+def iter_mermaid_export(subproject_id: int, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Export en flux du code Mermaid d'un SubProject (même texte que generate_mermaid_from_subproject).
+    L'existence du SubProject est vérifiée immédiatement (NotFound) ; les morceaux sont ensuite
+    produits à la demande : le premier octet et la mémoire ne dépendent pas de la taille du graphe.
+    """
+    graph_direction = db.session.execute(
+        db.select(SubProject.graph_direction).where(SubProject.id == subproject_id)
+    ).scalar_one_or_none()
+    if graph_direction is None:
+        raise NotFound(f"SubProject ID {subproject_id} non trouvé.")
+    return join_chunks(iter_mermaid_lines(subproject_id, graph_direction), chunk_size)
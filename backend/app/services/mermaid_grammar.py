@@ -0,0 +1,699 @@
+# backend/app/services/mermaid_grammar.py
+# Version 1.6
+"""
+Analyseur syntaxique des flowcharts Mermaid (sans accès à la base de données).
+
+Chaque ligne est parcourue une seule fois, de gauche à droite : l'analyseur
+aiguille sur le jeton de tête (commentaire, mot-clé ou identifiant de nœud)
+puis consomme l'instruction jusqu'au ';' ou à la fin de ligne. Les seules
+expressions régulières utilisées sont des jetons ancrés sans retour arrière,
+et chaque recherche de délimiteur (crochet, guillemet, pipe) reprend là où la
+précédente s'est arrêtée : le temps d'analyse est linéaire en la taille du texte.
+
+Grammaire couverte : nœuds et toutes leurs formes ([], (), ([]), [[]], [()],
+(()), ((())), >], {}, {{}}, [//], [\\\\], [/\\], [\\/]), chaînes de liens
+(A --> B --> C), groupes '&', liens pleins/pointillés/épais/invisibles avec
+ou sans tête (-->, ---, -.->, -.-, ==>, ===, ~~~, --o, --x, <-->), étiquettes
+'|texte|' ou intégrées ('-- texte -->'), raccourci ':::classe', subgraphs
+imbriqués, classDef et class multiples. Les instructions purement visuelles
+(style, linkStyle, click, direction, accTitle, accDescr) sont ignorées.
+
+parse_flowchart agrège les événements dans un ParsedGraph stocké en colonnes
+(identifiants internés, liens en tableaux d'entiers parallèles) et peut aussi
+produire une carte des sources : pour chaque entité,
+l'intervalle de lignes [début, fin] (numérotées à partir de 1) qui la décrit.
+"""
+
+import re
+import sys
+import time
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+from app.models import LinkType
+
+
+class MermaidParsingError(BadRequest):
+    """Erreur spécifique de syntaxe Mermaid."""
+
+    def __init__(self, description: Optional[str] = None, line: Optional[int] = None, column: Optional[int] = None,
+                 reason: Optional[str] = None):
+        super().__init__(description)
+        self.line = line
+        self.column = column
+        self.reason = reason or description  # Message sans la position, pour les diagnostics
+
+
+class MermaidInputTooLarge(RequestEntityTooLarge):
+    """Le code Mermaid dépasse une des limites d'analyse (ParseLimits) : réponse 413."""
+
+    def __init__(self, description: Optional[str] = None, line: Optional[int] = None):
+        super().__init__(description)
+        self.line = line
+
+
+class ParseLimits(NamedTuple):
+    """
+    Budgets d'analyse (0 = illimité). Le coût d'une ligne étant linéaire en sa longueur, l'échéance
+    est contrôlée toutes les DEADLINE_CHECK_INTERVAL lignes ou tous les DEADLINE_CHECK_CHARS caractères :
+    avec la longueur des lignes bornée, le délai entre deux contrôles l'est aussi.
+    """
+    max_line_length: int = 0   # caractères par ligne (fin de ligne exclue)
+    max_lines: int = 0
+    max_entities: int = 0      # nœuds distincts + liens
+    timeout: float = 0         # secondes d'analyse
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> 'ParseLimits':
+        return cls(
+            max_line_length=config.get('MERMAID_MAX_LINE_LENGTH', 0),
+            max_lines=config.get('MERMAID_MAX_LINES', 0),
+            max_entities=config.get('MERMAID_MAX_ENTITIES', 0),
+            timeout=config.get('MERMAID_PARSE_TIMEOUT', 0),
+        )
+
+
+DEADLINE_CHECK_INTERVAL = 256
+# Caractères analysés au plus entre deux contrôles de l'échéance (plus une ligne), quel que soit le nombre de lignes
+DEADLINE_CHECK_CHARS = 64 * 1024
+
+
+# --- Événements émis par iter_flowchart_events ---
+# Chaque événement est un tuple dont le premier élément est le type, le second le numéro de ligne.
+EVENT_DIRECTION = 'direction'            # (type, ligne, direction)
+EVENT_NODE = 'node'                      # (type, ligne, mermaid_id, titre | None, subgraph_mermaid_id | None)
+EVENT_NODE_CLASS = 'node_class'          # (type, ligne, mermaid_id, classe)
+EVENT_EDGE = 'edge'                      # (type, ligne, source, cible, label | None, LinkType)
+EVENT_CLASSDEF = 'classdef'              # (type, ligne, nom, définition brute)
+EVENT_SUBGRAPH_START = 'subgraph_start'  # (type, ligne, subgraph_mermaid_id, titre | None)
+EVENT_SUBGRAPH_END = 'subgraph_end'      # (type, ligne, subgraph_mermaid_id)
+EVENT_SUBGRAPH_CLASS = 'subgraph_class'  # (type, ligne, subgraph_mermaid_id, classe)
+
+# --- Jetons ---
+GRAPH_TYPE_PATTERN = re.compile(r'^\s*graph\s+(\w+)\s*', re.IGNORECASE)
+_WS = re.compile(r'\s*')
+_ID = re.compile(r'\w+')
+_NODE_ID = re.compile(r'(\w+)\s*')
+_CLASS_NAME = re.compile(r'[\w-]+')
+_NAME_LIST = re.compile(r'[\w-]+(?:\s*,\s*[\w-]+)*')
+# Lien : marqueur de départ optionnel, corps (--, ==, -.-, ~~~) puis tête optionnelle.
+# Une tête 'x'/'o' n'est retenue que si elle n'entame pas un identifiant (A---oB cible 'oB').
+_LINK = re.compile(r'(?:<|[xo](?=[-=]))?(?:-{2,}|={2,}|-\.+-|~{3,})(?:>|[xo](?!\w))?')
+_LINK_WS = re.compile(r'((?:<|[xo](?=[-=]))?(?:-{2,}|={2,}|-\.+-|~{3,})(?:>|[xo](?!\w))?)\s*')
+# Ouverture d'un lien à texte intégré : "-- texte -->", "== texte ==>", "-. texte .->"
+_LINK_TEXT_START = re.compile(r'(?:<|[xo](?=[-=]))?(--|==|-\.)(?=\s)')
+_DOTTED_LINK_CLOSE = re.compile(r'\.-(?:>|[xo](?!\w))?')
+
+# Formes de nœuds : (ouvrant, fermant, caractères à retirer avant le fermant).
+# La forme est choisie sur les deux premiers caractères, puis sur le premier ; '(((' est traité à part.
+_SHAPES_2: Dict[str, Tuple[str, str, str]] = {
+    '((': ('((', '))', ''), '([': ('([', '])', ''), '[[': ('[[', ']]', ''), '[(': ('[(', ')]', ''),
+    '[/': ('[/', ']', '/\\'), '[\\': ('[\\', ']', '/\\'), '{{': ('{{', '}}', ''),
+}
+_SHAPES_1: Dict[str, Tuple[str, str, str]] = {
+    '(': ('(', ')', ''), '[': ('[', ']', ''), '{': ('{', '}', ''), '>': ('>', ']', ''),
+}
+_SHAPE_CIRCLE_3 = ('(((', ')))', '')
+_WS_CHARS = ' \t\r\n\f\v'
+
+# Mots-clés : 'subgraph' et 'classDef' sont insensibles à la casse (compatibilité), les autres
+# suivent Mermaid à la lettre pour ne pas capturer des nœuds nommés 'End' ou 'Class'.
+_KEYWORDS_ANY_CASE = {'subgraph', 'classdef'}
+_KEYWORDS = {'end', 'class', 'style', 'linkStyle', 'click', 'direction', 'accTitle', 'accDescr'}
+_IGNORED_KEYWORDS = {'style', 'linkStyle', 'click', 'direction'}
+_KEYWORD_BOUNDARY = _WS_CHARS + ';:'
+_KEYWORD_INITIALS = frozenset(word[0] for word in _KEYWORDS) | frozenset('sScC')
+
+HEADER_ERROR_MESSAGE = "Le code Mermaid doit commencer par 'graph TD', 'graph LR', etc."
+
+
+def _skip_ws(line: str, pos: int) -> int:
+    return _WS.match(line, pos).end()  # type: ignore[union-attr]
+
+
+def _clean_text(text: str) -> Optional[str]:
+    """Normalise un texte de nœud ou d'étiquette (guillemets, entité #quot;)."""
+    text = text.strip()
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"':
+        text = text[1:-1].strip()
+    if '#quot;' in text:
+        text = text.replace('#quot;', '"')
+    return text or None
+
+
+def _link_type(token: str) -> LinkType:
+    """Un lien avec tête (>, x, o ou <) est visible ; un lien ouvert (---, -.-, ~~~) ne l'est pas."""
+    if token[-1] in '>xo' or token[0] == '<':
+        return LinkType.VISIBLE
+    return LinkType.INVISIBLE
+
+
+def _error(message: str, lineno: int, pos: int) -> MermaidParsingError:
+    return MermaidParsingError(f"Ligne {lineno}, colonne {pos + 1}: {message}", line=lineno, column=pos + 1, reason=message)
+
+
+class _FlowchartScanner:
+    """Analyse les lignes d'un flowchart et accumule les événements produits."""
+
+    __slots__ = ('stack', 'subgraph_ids', 'in_acc_block')
+
+    def __init__(self) -> None:
+        self.stack: List[Tuple[str, int]] = []  # [(subgraph_mermaid_id, ligne d'ouverture)]
+        self.subgraph_ids: set = set()
+        self.in_acc_block = False
+
+    # --- Instructions ---
+
+    def scan_line(self, line: str, pos: int, lineno: int, events: list) -> None:
+        if self.in_acc_block:
+            if '}' in line:
+                self.in_acc_block = False
+            return
+
+        n = len(line)
+        if pos < n and line[pos] in _WS_CHARS:
+            pos = _skip_ws(line, pos)
+        while pos < n:
+            ch = line[pos]
+            if ch == ';':
+                pos = _skip_ws(line, pos + 1)
+                continue
+            if line.startswith('%%', pos):
+                return
+
+            if ch in _KEYWORD_INITIALS:
+                m = _ID.match(line, pos)
+                word, end = m.group(), m.end()  # type: ignore[union-attr]
+                at_boundary = end == n or line[end] in _KEYWORD_BOUNDARY
+                if at_boundary and (word in _KEYWORDS or word.lower() in _KEYWORDS_ANY_CASE):
+                    pos = self._scan_keyword(word, line, end, lineno, events)
+                    pos = self._expect_statement_end(line, pos, lineno)
+                    continue
+            pos = self._scan_vertex_statement(line, pos, lineno, events)
+
+    def _expect_statement_end(self, line: str, pos: int, lineno: int) -> int:
+        pos = _skip_ws(line, pos)
+        if pos < len(line) and line[pos] != ';' and not line.startswith('%%', pos):
+            raise _error(f"Jeton inattendu '{line[pos]}'.", lineno, pos)
+        return pos
+
+    def _scan_keyword(self, word: str, line: str, pos: int, lineno: int, events: list) -> int:
+        keyword = word.lower()
+        if keyword == 'subgraph':
+            return self._scan_subgraph(line, pos, lineno, events)
+        if word == 'end':
+            if not self.stack:
+                raise _error("'end' sans 'subgraph' correspondant.", lineno, pos - 3)
+            subgraph_id, _ = self.stack.pop()
+            events.append((EVENT_SUBGRAPH_END, lineno, subgraph_id))
+            return pos
+        if keyword == 'classdef':
+            return self._scan_classdef(line, pos, lineno, events)
+        if word == 'class':
+            return self._scan_class(line, pos, lineno, events)
+        if word in _IGNORED_KEYWORDS:
+            stop = line.find(';', pos)
+            return len(line) if stop < 0 else stop
+        # accTitle / accDescr : texte libre jusqu'à la fin de ligne, ou bloc '{ ... }' multi-lignes
+        brace = line.find('{', pos)
+        if brace >= 0 and line.find('}', brace) < 0:
+            self.in_acc_block = True
+        return len(line)
+
+    def _scan_subgraph(self, line: str, pos: int, lineno: int, events: list) -> int:
+        n = len(line)
+        pos = _skip_ws(line, pos)
+        title: Optional[str]
+        if pos < n and line[pos] == '"':
+            close = line.find('"', pos + 1)
+            if close < 0:
+                raise _error("Chaîne non terminée.", lineno, pos)
+            title = _clean_text(line[pos + 1:close])
+            if title is None:
+                raise _error("Identifiant de subgraph manquant.", lineno, pos)
+            subgraph_id, pos = title, close + 1
+        else:
+            m = _ID.match(line, pos)
+            if m is None:
+                raise _error("Identifiant de subgraph manquant.", lineno, pos)
+            subgraph_id, pos = m.group(), m.end()
+            start = _skip_ws(line, pos)
+            if start < n and line[start] == '[':
+                title, pos = self._scan_shape(line, start, lineno)
+            else:
+                stop = line.find(';', start)
+                stop = n if stop < 0 else stop
+                title = _clean_text(line[start:stop])
+                pos = stop
+
+        self.stack.append((subgraph_id, lineno))
+        self.subgraph_ids.add(subgraph_id)
+        events.append((EVENT_SUBGRAPH_START, lineno, subgraph_id, title))
+        return pos
+
+    def _scan_classdef(self, line: str, pos: int, lineno: int, events: list) -> int:
+        pos = _skip_ws(line, pos)
+        m = _NAME_LIST.match(line, pos)
+        if m is None:
+            raise _error("Nom de classDef manquant.", lineno, pos)
+        names = [name.strip() for name in m.group().split(',')]
+        start = _skip_ws(line, m.end())
+        stop = line.find(';', start)
+        stop = len(line) if stop < 0 else stop
+        definition = line[start:stop].strip()
+        if not definition:
+            raise _error(f"Définition de style manquante pour classDef '{names[0]}'.", lineno, start)
+        for name in names:
+            events.append((EVENT_CLASSDEF, lineno, name, definition))
+        return stop
+
+    def _scan_class(self, line: str, pos: int, lineno: int, events: list) -> int:
+        pos = _skip_ws(line, pos)
+        m = _NAME_LIST.match(line, pos)
+        if m is None:
+            raise _error("Identifiant de nœud manquant après 'class'.", lineno, pos)
+        targets = [target.strip() for target in m.group().split(',')]
+        pos = _skip_ws(line, m.end())
+        m = _CLASS_NAME.match(line, pos)
+        if m is None:
+            raise _error("Nom de classe manquant après 'class'.", lineno, pos)
+        class_name = m.group()
+        for target in targets:
+            if target in self.subgraph_ids:
+                events.append((EVENT_SUBGRAPH_CLASS, lineno, target, class_name))
+            else:
+                events.append((EVENT_NODE_CLASS, lineno, target, class_name))
+        return m.end()
+
+    # --- Nœuds et liens ---
+
+    def _scan_vertex_statement(self, line: str, pos: int, lineno: int, events: list) -> int:
+        """
+        Analyse 'groupe (lien groupe)*' où groupe = nœud ('&' nœud)*. Chaque lien relie toutes les
+        paires (source, cible) de ses deux groupes. S'arrête sur ';', un commentaire ou la fin de ligne.
+        """
+        n = len(line)
+        subgraph_id = self.stack[-1][0] if self.stack else None
+        sources: Optional[List[str]] = None
+        group: List[str] = []
+        label: Optional[str] = None
+        link_type = LinkType.VISIBLE
+        while True:
+            m = _NODE_ID.match(line, pos)
+            if m is None:
+                raise _error("Identifiant de nœud attendu.", lineno, pos)
+            node_id, end, pos = m.group(1), m.end(1), m.end()
+
+            title = None
+            if pos < n:
+                ch = line[pos]
+                if ch in '[({' or (ch == '>' and pos == end):
+                    title, end = self._scan_shape(line, pos, lineno)
+                    pos = end
+            events.append((EVENT_NODE, lineno, node_id, title, subgraph_id))
+            group.append(node_id)
+
+            if line.startswith(':::', end):
+                m = _CLASS_NAME.match(line, end + 3)
+                if m is None:
+                    raise _error("Nom de classe manquant après ':::'.", lineno, end + 3)
+                events.append((EVENT_NODE_CLASS, lineno, node_id, m.group()))
+                pos = m.end()
+            if pos < n and line[pos] in _WS_CHARS:
+                pos = _skip_ws(line, pos)
+
+            if pos < n and line[pos] == '&':
+                pos = _skip_ws(line, pos + 1)
+                continue
+
+            if sources is not None:
+                for source in sources:
+                    for target in group:
+                        events.append((EVENT_EDGE, lineno, source, target, label, link_type))
+            if pos >= n or line[pos] == ';' or line.startswith('%%', pos):
+                return pos
+            label, link_type, pos = self._scan_link(line, pos, lineno)
+            sources, group = group, []
+
+    def _scan_shape(self, line: str, pos: int, lineno: int) -> Tuple[Optional[str], int]:
+        shape = _SHAPES_2.get(line[pos:pos + 2])
+        if shape is None:
+            shape = _SHAPES_1[line[pos]]
+        elif shape[0] == '((' and line.startswith('(((', pos):
+            shape = _SHAPE_CIRCLE_3
+        opener, closer, trim = shape
+        start = pos + len(opener)
+
+        n = len(line)
+        quote = start
+        if quote < n and line[quote] in _WS_CHARS:
+            quote = _skip_ws(line, quote)
+        if quote < n and line[quote] == '"':
+            close_quote = line.find('"', quote + 1)
+            if close_quote < 0:
+                raise _error("Chaîne non terminée.", lineno, quote)
+            after = _skip_ws(line, close_quote + 1)
+            if trim and after < n and line[after] in trim:
+                after += 1
+            if not line.startswith(closer, after):
+                raise _error(f"'{closer}' attendu pour fermer la forme '{opener}'.", lineno, after)
+            return _clean_text(line[quote + 1:close_quote]), after + len(closer)
+
+        close = line.find(closer, start)
+        if close < 0:
+            raise _error(f"Forme de nœud non terminée : '{closer}' attendu.", lineno, pos)
+        text = line[start:close]
+        if trim and text and text[-1] in trim:
+            text = text[:-1]
+        return _clean_text(text), close + len(closer)
+
+    def _scan_link(self, line: str, pos: int, lineno: int) -> Tuple[Optional[str], LinkType, int]:
+        """Analyse un lien et son étiquette éventuelle ; retourne la position après les espaces qui suivent."""
+        m = _LINK_TEXT_START.match(line, pos)
+        if m is not None:
+            body, text_start = m.group(1), m.end()
+            if body == '-.':
+                close = line.find('.-', text_start)
+                cm = _DOTTED_LINK_CLOSE.match(line, close) if close >= 0 else None
+            else:
+                close = line.find(body, text_start)
+                cm = _LINK.match(line, close) if close >= 0 else None
+                if cm is not None and cm.end() - close < 3:
+                    cm = None
+            if cm is None:
+                raise _error("Lien non terminé après son texte.", lineno, pos)
+            label = _clean_text(line[text_start:close])
+            return label, _link_type(m.group() + cm.group()), _skip_ws(line, cm.end())
+
+        m = _LINK_WS.match(line, pos)
+        token = m.group(1) if m is not None else ''
+        if len(token) < 3 and not (token and token[-1] in '>xo'):
+            raise _error(f"Lien attendu, '{line[pos]}' trouvé.", lineno, pos)
+        pos = m.end()  # type: ignore[union-attr]
+
+        label = None
+        if pos < len(line) and line[pos] == '|':
+            close = line.find('|', pos + 1)
+            if close < 0:
+                raise _error("Étiquette de lien non terminée : '|' attendu.", lineno, pos)
+            label, pos = _clean_text(line[pos + 1:close]), _skip_ws(line, close + 1)
+        return label, _link_type(token), pos
+
+
+class ParsedNode(NamedTuple):
+    mermaid_id: str
+    title: Optional[str]
+    text_content: str
+    style_class_ref: Optional[str]
+
+
+class ParsedEdge(NamedTuple):
+    source: str
+    target: str
+    label: Optional[str]
+    link_type: LinkType
+
+
+_LINK_TYPES: Tuple[LinkType, ...] = tuple(LinkType)
+_LINK_TYPE_CODES: Dict[LinkType, int] = {link_type: code for code, link_type in enumerate(_LINK_TYPES)}
+
+
+class ParsedGraph:
+    """
+    Résultat de parse_flowchart, stocké en colonnes pour les gros graphes.
+
+    Les nœuds sont numérotés dans l'ordre d'apparition : node_ids[i] (interné), node_titles[i],
+    node_classes[i]. Les liens sont des tableaux parallèles d'indices de nœuds (edge_sources,
+    edge_targets) et de codes de LinkType (edge_link_types) ; seules les étiquettes présentes sont
+    stockées (edge_labels {indice du lien: étiquette}). Le texte d'un nœud est son titre, à défaut
+    son identifiant. ParsedNode / ParsedEdge ne sont construits qu'à l'itération.
+    Les subgraphs déclarés (ordre du texte) ont un titre (None si absent) et éventuellement une classe.
+    """
+
+    __slots__ = ('direction', 'classdefs', 'subgraphs', 'subgraph_titles', 'subgraph_classes', 'node_ids', 'node_index', 'node_titles', 'node_classes',
+                 'edge_sources', 'edge_targets', 'edge_link_types', 'edge_labels')
+
+    def __init__(self, direction: str = "TD"):
+        self.direction = direction
+        self.classdefs: Dict[str, str] = {}
+        self.subgraphs: Dict[str, List[str]] = {}  # {subgraph_mermaid_id: [node_mermaid_id, ...]}
+        self.subgraph_titles: Dict[str, Optional[str]] = {}
+        self.subgraph_classes: Dict[str, str] = {}
+        self.node_ids: List[str] = []
+        self.node_index: Dict[str, int] = {}
+        self.node_titles: List[Optional[str]] = []
+        self.node_classes: List[Optional[str]] = []
+        self.edge_sources = array('i')
+        self.edge_targets = array('i')
+        self.edge_link_types = bytearray()
+        self.edge_labels: Dict[int, str] = {}
+
+    @property
+    def node_count(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.edge_sources)
+
+    def add_node(self, mermaid_id: str) -> int:
+        """Retourne l'indice du nœud, en le créant (identifiant interné) s'il est nouveau."""
+        index = self.node_index.get(mermaid_id)
+        if index is None:
+            index = len(self.node_ids)
+            mermaid_id = sys.intern(mermaid_id)
+            self.node_index[mermaid_id] = index
+            self.node_ids.append(mermaid_id)
+            self.node_titles.append(None)
+            self.node_classes.append(None)
+        return index
+
+    def add_edge(self, source: int, target: int, label: Optional[str], link_type: LinkType) -> None:
+        if label is not None:
+            self.edge_labels[len(self.edge_sources)] = label
+        self.edge_sources.append(source)
+        self.edge_targets.append(target)
+        self.edge_link_types.append(_LINK_TYPE_CODES[link_type])
+
+    def text_content(self, index: int) -> str:
+        title = self.node_titles[index]
+        return title if title is not None else self.node_ids[index]
+
+    def node(self, mermaid_id: str) -> Optional[ParsedNode]:
+        index = self.node_index.get(mermaid_id)
+        if index is None:
+            return None
+        return ParsedNode(mermaid_id, self.node_titles[index], self.text_content(index), self.node_classes[index])
+
+    def iter_nodes(self) -> Iterator[ParsedNode]:
+        for index, mermaid_id in enumerate(self.node_ids):
+            yield ParsedNode(mermaid_id, self.node_titles[index], self.text_content(index), self.node_classes[index])
+
+    def edge_link_type(self, index: int) -> LinkType:
+        return _LINK_TYPES[self.edge_link_types[index]]
+
+    def iter_edges(self) -> Iterator[ParsedEdge]:
+        node_ids, labels = self.node_ids, self.edge_labels
+        for index, (source, target, code) in enumerate(zip(self.edge_sources, self.edge_targets, self.edge_link_types)):
+            yield ParsedEdge(node_ids[source], node_ids[target], labels.get(index), _LINK_TYPES[code])
+
+
+# Carte des sources : {'nodes': {mermaid_id: span}, 'edges': {clé: [span, ...]},
+# 'classdefs': {nom: span}, 'subgraphs': {mermaid_id: span}}, span = [ligne de début, ligne de fin]
+SourceMap = Dict[str, Dict[str, Any]]
+
+
+def new_source_map() -> SourceMap:
+    return {'nodes': {}, 'edges': {}, 'classdefs': {}, 'subgraphs': {}}
+
+
+def edge_source_key(source: str, target: str) -> str:
+    """Clé d'un lien dans la carte des sources (les identifiants Mermaid ne contiennent pas d'espace)."""
+    return f"{source} {target}"
+
+
+def _limited_lines(lines: Iterable[str], limits: ParseLimits) -> Iterator[str]:
+    """Applique les limites de longueur de ligne, de nombre de lignes et de durée en amont de l'analyse."""
+    max_line_length, max_lines, _, timeout = limits
+    deadline = time.monotonic() + timeout if timeout else None
+    unchecked_chars = 0
+    for lineno, line in enumerate(lines, start=1):
+        if max_lines and lineno > max_lines:
+            raise MermaidInputTooLarge(f"Le code Mermaid dépasse {max_lines} lignes.", line=lineno)
+        if max_line_length and len(line) > max_line_length and len(line.rstrip('\r\n')) > max_line_length:
+            raise MermaidInputTooLarge(
+                f"Ligne {lineno} : longueur supérieure à {max_line_length} caractères.", line=lineno
+            )
+        if deadline is not None:
+            unchecked_chars += len(line)
+            if lineno % DEADLINE_CHECK_INTERVAL == 0 or unchecked_chars >= DEADLINE_CHECK_CHARS:
+                unchecked_chars = 0
+                if time.monotonic() > deadline:
+                    raise MermaidInputTooLarge(
+                        f"Analyse interrompue ligne {lineno} : budget de {timeout} s dépassé.", line=lineno
+                    )
+        yield line
+
+
+def _limited_events(events: Iterator[tuple], max_entities: int) -> Iterator[tuple]:
+    """Interrompt l'analyse dès que le nombre de nœuds distincts + liens dépasse la limite."""
+    node_ids: set = set()
+    edges = 0
+    for event in events:
+        kind = event[0]
+        if kind == EVENT_NODE or kind == EVENT_NODE_CLASS:
+            node_ids.add(event[2])
+        elif kind == EVENT_EDGE:
+            edges += 1
+        else:
+            yield event
+            continue
+        if len(node_ids) + edges > max_entities:
+            raise MermaidInputTooLarge(
+                f"Ligne {event[1]} : le graphe dépasse {max_entities} entités (nœuds + liens).", line=event[1]
+            )
+        yield event
+
+
+def iter_flowchart_events(lines: Iterable[str], errors: Optional[List[MermaidParsingError]] = None,
+                          limits: Optional[ParseLimits] = None) -> Iterator[tuple]:
+    """
+    Analyse un flowchart Mermaid ligne par ligne et produit ses événements dans l'ordre du texte.
+    Le premier événement est toujours EVENT_DIRECTION. Lève MermaidParsingError à la première erreur.
+
+    Mode diagnostic : si une liste `errors` est fournie, les erreurs y sont ajoutées au lieu d'être
+    levées et l'analyse reprend à la ligne suivante (les événements de la ligne fautive sont ignorés).
+    Seule l'absence d'en-tête 'graph' interrompt l'analyse.
+
+    `limits` : dépasser un budget lève MermaidInputTooLarge (413), y compris en mode diagnostic.
+    """
+    if limits is None or not any(limits):
+        return _iter_events(lines, errors)
+    if limits.max_line_length or limits.max_lines or limits.timeout:
+        lines = _limited_lines(lines, limits)
+    events = _iter_events(lines, errors)
+    if limits.max_entities:
+        events = _limited_events(events, limits.max_entities)
+    return events
+
+
+def _iter_events(lines: Iterable[str], errors: Optional[List[MermaidParsingError]]) -> Iterator[tuple]:
+    def report(error: MermaidParsingError) -> None:
+        if errors is None:
+            raise error
+        errors.append(error)
+
+    scanner = _FlowchartScanner()
+    events: list = []
+    header_seen = False
+    in_frontmatter = False
+    lineno = 0
+
+    for lineno, line in enumerate(lines, start=1):
+        try:
+            if not header_seen:
+                stripped = line.strip()
+                if stripped == '---':
+                    in_frontmatter = not in_frontmatter
+                    continue
+                if in_frontmatter or not stripped or stripped.startswith('%%'):
+                    continue
+                match = GRAPH_TYPE_PATTERN.match(line)
+                if not match:
+                    report(MermaidParsingError(f"{HEADER_ERROR_MESSAGE} Ligne {lineno}: {stripped}", line=lineno, column=1,
+                                               reason=HEADER_ERROR_MESSAGE))
+                    return
+                header_seen = True
+                yield (EVENT_DIRECTION, lineno, match.group(1).upper())
+                if not line.startswith(';', match.end()):
+                    continue
+                scanner.scan_line(line, match.end(), lineno, events)
+            else:
+                scanner.scan_line(line, 0, lineno, events)
+        except MermaidParsingError as e:
+            events.clear()
+            report(e)
+            continue
+
+        if events:
+            yield from events
+            events.clear()
+
+    if not header_seen:
+        report(MermaidParsingError(f"{HEADER_ERROR_MESSAGE} Ligne 1: ", line=1, column=1, reason=HEADER_ERROR_MESSAGE))
+        return
+    for subgraph_id, start_line in reversed(scanner.stack):
+        report(MermaidParsingError(
+            f"Ligne {start_line}: subgraph '{subgraph_id}' non fermé ('end' manquant).", line=start_line, column=1,
+            reason=f"subgraph '{subgraph_id}' non fermé ('end' manquant)."
+        ))
+
+
+def parse_flowchart(lines: Iterable[str], errors: Optional[List[MermaidParsingError]] = None,
+                    limits: Optional[ParseLimits] = None, source_map: Optional[SourceMap] = None
+                    ) -> ParsedGraph:
+    """
+    Agrège les événements d'un flowchart dans le ParsedGraph consommé par la synchronisation
+    et le chargement en masse.
+
+    Un nœud appartient au premier subgraph dans lequel il apparaît ; son titre est le dernier donné
+    (de même pour le titre d'un subgraph rouvert).
+    `errors` active le mode diagnostic d'iter_flowchart_events (résultat partiel, erreurs collectées) ;
+    `limits` applique les budgets d'analyse.
+    `source_map` (voir new_source_map) est rempli avec la position de chaque entité : la ligne qui
+    donne son titre au nœud (à défaut sa première mention), chaque occurrence d'un lien dans l'ordre
+    des relations, la dernière définition d'une classe et le bloc subgraph ... end.
+    """
+    graph = ParsedGraph()
+    node_ids, node_index, titles, classes = graph.node_ids, graph.node_index, graph.node_titles, graph.node_classes
+    add_node, add_edge = graph.add_node, graph.add_edge
+    in_subgraph: set = set()
+    if source_map is not None:
+        node_spans, edge_spans = source_map['nodes'], source_map['edges']
+        classdef_spans, subgraph_spans = source_map['classdefs'], source_map['subgraphs']
+
+    for event in iter_flowchart_events(lines, errors, limits):
+        kind = event[0]
+        if kind == EVENT_NODE:
+            _, lineno, mermaid_id, title, subgraph_id = event
+            index = node_index.get(mermaid_id)
+            if source_map is not None and (index is None or (title is not None and titles[index] is None)):
+                node_spans[mermaid_id] = [lineno, lineno]
+            if index is None:
+                index = add_node(mermaid_id)
+            if title is not None:
+                titles[index] = title
+            if subgraph_id is not None and index not in in_subgraph:
+                in_subgraph.add(index)
+                graph.subgraphs.setdefault(subgraph_id, []).append(node_ids[index])
+        elif kind == EVENT_EDGE:
+            _, lineno, source, target, label, link_type = event
+            add_edge(add_node(source), add_node(target), label, link_type)
+            if source_map is not None:
+                edge_spans.setdefault(edge_source_key(source, target), []).append([lineno, lineno])
+        elif kind == EVENT_NODE_CLASS:
+            _, lineno, mermaid_id, class_name = event
+            if source_map is not None and mermaid_id not in node_index:
+                node_spans[mermaid_id] = [lineno, lineno]
+            classes[add_node(mermaid_id)] = sys.intern(class_name)
+        elif kind == EVENT_SUBGRAPH_START:
+            graph.subgraphs.setdefault(event[2], [])
+            if event[3] is not None or event[2] not in graph.subgraph_titles:
+                graph.subgraph_titles[event[2]] = event[3]
+            if source_map is not None and event[2] not in subgraph_spans:
+                subgraph_spans[event[2]] = [event[1], event[1]]
+        elif kind == EVENT_SUBGRAPH_END:
+            if source_map is not None and event[2] in subgraph_spans:
+                subgraph_spans[event[2]][1] = event[1]
+        elif kind == EVENT_SUBGRAPH_CLASS:
+            graph.subgraph_classes[event[2]] = sys.intern(event[3])
+        elif kind == EVENT_CLASSDEF:
+            graph.classdefs[event[2]] = event[3]
+            if source_map is not None:
+                classdef_spans[event[2]] = [event[1], event[1]]
+        elif kind == EVENT_DIRECTION:
+            graph.direction = event[2]
+
+    return graph
@@ -0,0 +1,525 @@
+# backend/app/services/mermaid_layout.py
+# Version 1.2
+"""
+Layout automatique en couches (de type Sugiyama) d'un SubProject, calculé côté serveur.
+
+Étapes : suppression des cycles (arcs retour d'un parcours en profondeur, inversés), affectation des
+couches (plus long chemin, nœuds rapprochés de leurs successeurs), nœuds fictifs sur les liens
+longs (bornés en écart de couches), réduction des croisements (balayages par barycentre, nœuds d'un
+même subgraph contigus dans chaque couche) et placement des coordonnées (régression isotone avec
+espacement minimal). Le résultat respecte graph_direction (TD/TB, BT, LR, RL).
+
+Le calcul tourne dans un processus dédié (LayoutWorker) ; le résultat est enregistré dans la colonne
+SubProject.auto_layout par une mise à jour ciblée, qui ne touche ni visual_layout (layout manuel de
+l'utilisateur) ni la version du SubProject (ETags et exports restent valables). Il porte deux
+empreintes : 'structure_tag', l'empreinte structurelle du SubProject (structure_hash) au moment du
+calcul, vérifiée sans relire le graphe, et 'key', l'empreinte de la seule structure mise en page
+(nœuds, subgraphs, liens, direction). Quand structure_hash a changé sans que la structure mise en
+page change (titre, contenu, classe), le layout est ré-étiqueté sans être recalculé.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from flask import current_app
+from sqlalchemy import update
+from werkzeug.exceptions import NotFound
+
+from app import db
+from app.models import Node, Relationship, SubProject
+from app.services.mermaid_exporters import load_subproject_graph
+from app.services.mermaid_parser import get_structure_hash
+
+# À incrémenter quand l'algorithme change : les layouts enregistrés sont alors recalculés
+LAYOUT_ALGORITHM_VERSION = 1
+
+NODE_WIDTH = 150
+NODE_HEIGHT = 50
+NODE_SPACING = 40
+EDGE_SPACING = 15
+RANK_SPACING = 60
+CLUSTER_PADDING = 20
+MARGIN = 20
+ORDERING_SWEEPS = 8
+# Au-delà de cet écart de couches, un lien n'a pas de nœuds fictifs (tracé direct, hors réduction des croisements) :
+# le nombre de nœuds fictifs reste borné par liens x LONG_EDGE_MAX_SPAN
+LONG_EDGE_MAX_SPAN = 24
+COORDINATE_PASSES = 4
+
+
+class LayoutInput(NamedTuple):
+    """Structure d'un SubProject réduite au layout (valeurs simples, transmissibles à un autre processus)."""
+    direction: str
+    node_ids: List[str]
+    node_subgraphs: List[Optional[int]]  # Indice dans subgraph_ids, ou None
+    subgraph_ids: List[str]
+    edges: List[Tuple[int, int]]  # Indices dans node_ids, dans l'ordre des relations
+
+
+def load_layout_input(subproject_id: int) -> LayoutInput:
+    """Lit la structure d'un SubProject (identifiants seulement, sans titres ni contenus) ; NotFound s'il n'existe pas."""
+    graph = load_subproject_graph(subproject_id)
+    subgraphs = graph.subgraphs()
+    subgraph_indexes = {row[0]: index for index, row in enumerate(subgraphs)}
+    subgraph_ids = [row[1] for row in subgraphs]
+
+    node_indexes: Dict[int, int] = {}
+    node_ids: List[str] = []
+    node_subgraphs: List[Optional[int]] = []
+    for node_id, mermaid_id, subgraph_id in db.session.execute(
+        db.select(Node.id, Node.mermaid_id, Node.subgraph_id).where(Node.subproject_id == subproject_id).order_by(Node.id)
+    ):
+        node_indexes[node_id] = len(node_ids)
+        node_ids.append(mermaid_id)
+        node_subgraphs.append(subgraph_indexes.get(subgraph_id))
+
+    edges = [
+        (node_indexes[source], node_indexes[target])
+        for source, target in db.session.execute(
+            db.select(Relationship.source_node_id, Relationship.target_node_id)
+            .where(Relationship.subproject_id == subproject_id).order_by(Relationship.id)
+        )
+        if source in node_indexes and target in node_indexes
+    ]
+    return LayoutInput(graph.graph_direction, node_ids, node_subgraphs, subgraph_ids, edges)
+
+
+def layout_key(layout_input: LayoutInput) -> str:
+    """Empreinte de la structure mise en page (et de la version de l'algorithme)."""
+    payload = json.dumps([LAYOUT_ALGORITHM_VERSION, *layout_input], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def structure_tag(structure_hash: Optional[str]) -> Optional[str]:
+    """Étiquette d'un layout pour une empreinte structurelle (None si elle est inconnue)."""
+    return f"{LAYOUT_ALGORITHM_VERSION}:{structure_hash}" if structure_hash else None
+
+
+# --- Algorithme ---
+
+def _reversed_edges(node_count: int, edges: Sequence[Tuple[int, int]]) -> Set[int]:
+    """
+    Indices des liens à inverser pour rendre le graphe acyclique : arcs retour d'un parcours en
+    profondeur lancé depuis les sources, puis depuis les nœuds ayant le plus de liens sortants que
+    d'entrants (critère de l'heuristique gloutonne d'Eades), de sorte que le lien qui ferme un cycle
+    soit celui qui remonte.
+    """
+    outgoing: List[List[Tuple[int, int]]] = [[] for _ in range(node_count)]
+    has_predecessor = [False] * node_count
+    balance = [0] * node_count  # Entrants - sortants
+    for index, (source, target) in enumerate(edges):
+        if source != target:
+            outgoing[source].append((target, index))
+            has_predecessor[target] = True
+            balance[target] += 1
+            balance[source] -= 1
+
+    state = [0] * node_count  # 0 : non visité, 1 : sur la pile, 2 : terminé
+    reversed_edges: Set[int] = set()
+    for root in sorted(range(node_count), key=lambda vertex: (has_predecessor[vertex], balance[vertex], vertex)):
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, iter(outgoing[root]))]
+        while stack:
+            vertex, successors = stack[-1]
+            for target, index in successors:
+                if state[target] == 1:
+                    reversed_edges.add(index)
+                elif state[target] == 0:
+                    state[target] = 1
+                    stack.append((target, iter(outgoing[target])))
+                    break
+            else:
+                state[vertex] = 2
+                stack.pop()
+    return reversed_edges
+
+
+def _assign_layers(node_count: int, dag_edges: Sequence[Tuple[int, int]]) -> List[int]:
+    """
+    Couche de chaque nœud : plus long chemin depuis les sources, puis, en ordre topologique inverse,
+    chaque nœud qui a au moins autant de liens sortants qu'entrants est descendu juste avant son
+    successeur le plus proche (la longueur totale des liens ne peut que diminuer).
+    """
+    successors: List[List[int]] = [[] for _ in range(node_count)]
+    indegree = [0] * node_count
+    for source, target in dag_edges:
+        successors[source].append(target)
+        indegree[target] += 1
+    predecessor_count = list(indegree)
+
+    layer = [0] * node_count
+    order = [vertex for vertex in range(node_count) if indegree[vertex] == 0]
+    for vertex in order:  # Ordre topologique (Kahn), la liste grandit pendant le parcours
+        for target in successors[vertex]:
+            layer[target] = max(layer[target], layer[vertex] + 1)
+            indegree[target] -= 1
+            if indegree[target] == 0:
+                order.append(target)
+
+    for vertex in reversed(order):
+        if successors[vertex] and len(successors[vertex]) >= predecessor_count[vertex]:
+            layer[vertex] = min(layer[target] for target in successors[vertex]) - 1
+    return layer
+
+
+def _order_layer(vertices: List[int], neighbours: List[List[int]], position: List[int],
+                 clusters: List[Optional[int]]) -> None:
+    """Trie une couche par barycentre des voisins ; les nœuds d'un même subgraph restent contigus."""
+    barycenter: Dict[int, float] = {}
+    cluster_sum: Dict[int, float] = defaultdict(float)
+    cluster_count: Dict[int, int] = defaultdict(int)
+    for vertex in vertices:
+        adjacent = neighbours[vertex]
+        value = sum(position[u] for u in adjacent) / len(adjacent) if adjacent else float(position[vertex])
+        barycenter[vertex] = value
+        if clusters[vertex] is not None:
+            cluster_sum[clusters[vertex]] += value
+            cluster_count[clusters[vertex]] += 1
+
+    def sort_key(vertex: int):
+        cluster = clusters[vertex]
+        if cluster is None:
+            return barycenter[vertex], 1, vertex, 0.0, position[vertex]
+        return cluster_sum[cluster] / cluster_count[cluster], 0, cluster, barycenter[vertex], position[vertex]
+
+    vertices.sort(key=sort_key)
+    for index, vertex in enumerate(vertices):
+        position[vertex] = index
+
+
+def _count_crossings(layers: List[List[int]], down: List[List[int]], position: List[int]) -> int:
+    """Croisements entre couches consécutives (inversions comptées par arbre de Fenwick)."""
+    total = 0
+    for upper, lower in zip(layers, layers[1:]):
+        size = len(lower)
+        tree = [0] * (size + 1)
+        seen = 0
+        for vertex in upper:
+            for target in sorted(position[w] for w in down[vertex]):
+                index, not_greater = target + 1, 0
+                while index > 0:
+                    not_greater += tree[index]
+                    index -= index & -index
+                total += seen - not_greater
+                index = target + 1
+                while index <= size:
+                    tree[index] += 1
+                    index += index & -index
+                seen += 1
+    return total
+
+
+def _place_layer(desired: List[float], separations: List[float]) -> List[float]:
+    """
+    Positions au plus près de `desired` (moindres carrés) avec au moins separations[i] entre les
+    éléments i et i + 1 : régression isotone (pool adjacent violators) sur desired - décalages cumulés.
+    """
+    offsets = [0.0]
+    for separation in separations:
+        offsets.append(offsets[-1] + separation)
+    values: List[float] = []
+    weights: List[int] = []
+    for wanted, offset in zip(desired, offsets):
+        values.append(wanted - offset)
+        weights.append(1)
+        while len(values) > 1 and values[-2] > values[-1]:
+            weight = weights[-2] + weights[-1]
+            values[-2:] = [(values[-2] * weights[-2] + values[-1] * weights[-1]) / weight]
+            weights[-2:] = [weight]
+    placed: List[float] = []
+    for value, weight in zip(values, weights):
+        start = len(placed)
+        placed.extend(value + offset for offset in offsets[start:start + weight])
+    return placed
+
+
+def compute_layered_layout(layout_input: LayoutInput) -> Dict[str, Any]:
+    """
+    Layout en couches : centre de chaque nœud, boîte [x, y, largeur, hauteur] de chaque subgraph et
+    points intermédiaires de chaque lien (liens longs), en pixels, le nœud faisant NODE_WIDTH x NODE_HEIGHT.
+    Fonction pure, exécutée dans un processus de LayoutWorker.
+    """
+    direction, node_ids, node_subgraphs, subgraph_ids, edges = layout_input
+    node_count = len(node_ids)
+    horizontal = direction in ('LR', 'RL')
+    breadth, depth = (NODE_HEIGHT, NODE_WIDTH) if horizontal else (NODE_WIDTH, NODE_HEIGHT)
+
+    # 1. Cycles et couches
+    reversed_edges = _reversed_edges(node_count, edges)
+    dag_edges = [
+        (target, source) if index in reversed_edges else (source, target)
+        for index, (source, target) in enumerate(edges) if source != target
+    ]
+    vertex_layer = _assign_layers(node_count, dag_edges)
+
+    # 2. Nœuds fictifs : un par couche traversée par un lien long
+    clusters: List[Optional[int]] = list(node_subgraphs)
+    up: List[List[int]] = [[] for _ in range(node_count)]
+    down: List[List[int]] = [[] for _ in range(node_count)]
+    chains: List[List[int]] = [[] for _ in edges]
+    for index, (source, target) in enumerate(edges):
+        if source == target:
+            continue
+        upper, lower = (target, source) if index in reversed_edges else (source, target)
+        if vertex_layer[lower] - vertex_layer[upper] > LONG_EDGE_MAX_SPAN:
+            continue
+        cluster = clusters[upper] if clusters[upper] == clusters[lower] else None
+        previous = upper
+        for layer in range(vertex_layer[upper] + 1, vertex_layer[lower]):
+            dummy = len(vertex_layer)
+            vertex_layer.append(layer)
+            clusters.append(cluster)
+            up.append([previous])
+            down.append([])
+            down[previous].append(dummy)
+            chains[index].append(dummy)
+            previous = dummy
+        down[previous].append(lower)
+        up[lower].append(previous)
+        if index in reversed_edges:
+            chains[index].reverse()
+
+    vertex_count = len(vertex_layer)
+    layers: List[List[int]] = [[] for _ in range(max(vertex_layer, default=-1) + 1)]
+    for vertex in range(vertex_count):
+        layers[vertex_layer[vertex]].append(vertex)
+    position = [0] * vertex_count
+    for vertices in layers:
+        for index, vertex in enumerate(vertices):
+            position[vertex] = index
+    for vertices in layers:  # Ordre initial : barycentre des prédécesseurs, subgraphs regroupés
+        _order_layer(vertices, up, position, clusters)
+
+    # 3. Réduction des croisements : balayages descendants puis montants, meilleur ordre conservé
+    best_crossings = _count_crossings(layers, down, position)
+    best_layers = [list(vertices) for vertices in layers]
+    for _ in range(ORDERING_SWEEPS):
+        if best_crossings == 0:
+            break
+        for vertices in layers[1:]:
+            _order_layer(vertices, up, position, clusters)
+        for vertices in reversed(layers[:-1]):
+            _order_layer(vertices, down, position, clusters)
+        crossings = _count_crossings(layers, down, position)
+        if crossings < best_crossings:
+            best_crossings, best_layers = crossings, [list(vertices) for vertices in layers]
+    layers = best_layers
+    for vertices in layers:
+        for index, vertex in enumerate(vertices):
+            position[vertex] = index
+
+    # 4. Coordonnées dans la couche : compactes au départ, puis rapprochées des voisins
+    half = [breadth / 2 if vertex < node_count else 0.0 for vertex in range(vertex_count)]
+
+    def separation(left: int, right: int) -> float:
+        gap = NODE_SPACING if left < node_count and right < node_count else EDGE_SPACING
+        if clusters[left] != clusters[right]:
+            gap += 2 * CLUSTER_PADDING
+        return half[left] + half[right] + gap
+
+    separations = [[separation(a, b) for a, b in zip(vertices, vertices[1:])] for vertices in layers]
+    coordinate = [0.0] * vertex_count
+    for vertices, gaps in zip(layers, separations):
+        for vertex, x in zip(vertices, _place_layer([0.0] * len(vertices), gaps)):
+            coordinate[vertex] = x
+
+    for _ in range(COORDINATE_PASSES):
+        for neighbours, sweep in ((up, range(1, len(layers))), (down, range(len(layers) - 2, -1, -1))):
+            for layer in sweep:
+                vertices = layers[layer]
+                desired = [
+                    sum(coordinate[u] for u in neighbours[v]) / len(neighbours[v]) if neighbours[v] else coordinate[v]
+                    for v in vertices
+                ]
+                for vertex, x in zip(vertices, _place_layer(desired, separations[layer])):
+                    coordinate[vertex] = x
+
+    shift = MARGIN - min((coordinate[v] - half[v] for v in range(vertex_count)), default=0.0)
+    total_breadth = max((coordinate[v] + half[v] + shift for v in range(vertex_count)), default=0.0) + MARGIN
+    total_depth = 2 * MARGIN + len(layers) * depth + max(len(layers) - 1, 0) * RANK_SPACING
+
+    def screen(vertex: int) -> List[int]:
+        along = coordinate[vertex] + shift
+        rank = MARGIN + vertex_layer[vertex] * (depth + RANK_SPACING) + depth / 2
+        if direction in ('BT', 'RL'):
+            rank = total_depth - rank
+        return [round(rank), round(along)] if horizontal else [round(along), round(rank)]
+
+    nodes = {node_ids[vertex]: screen(vertex) for vertex in range(node_count)}
+    boxes: Dict[str, List[float]] = {}
+    for vertex in range(node_count):
+        if node_subgraphs[vertex] is None:
+            continue
+        x, y = nodes[node_ids[vertex]]
+        box = boxes.setdefault(subgraph_ids[node_subgraphs[vertex]], [x, y, x, y])
+        box[:] = [min(box[0], x), min(box[1], y), max(box[2], x), max(box[3], y)]
+    subgraphs = {
+        subgraph_id: [
+            round(x0 - NODE_WIDTH / 2 - CLUSTER_PADDING), round(y0 - NODE_HEIGHT / 2 - CLUSTER_PADDING),
+            round(x1 - x0 + NODE_WIDTH + 2 * CLUSTER_PADDING), round(y1 - y0 + NODE_HEIGHT + 2 * CLUSTER_PADDING),
+        ]
+        for subgraph_id, (x0, y0, x1, y1) in boxes.items()
+    }
+
+    width, height = (total_depth, total_breadth) if horizontal else (total_breadth, total_depth)
+    return {
+        'engine': 'layered',
+        'direction': direction,
+        'width': round(width) if node_count else 0,
+        'height': round(height) if node_count else 0,
+        'node_size': [NODE_WIDTH, NODE_HEIGHT],
+        'crossings': best_crossings,
+        'nodes': nodes,
+        'subgraphs': subgraphs,
+        'edges': [
+            [node_ids[source], node_ids[target], [screen(dummy) for dummy in chains[index]]]
+            for index, (source, target) in enumerate(edges)
+        ],
+    }
+
+
+def _compute_keyed_layout(layout_input: LayoutInput, key: str, tag: Optional[str] = None) -> Dict[str, Any]:
+    layout = compute_layered_layout(layout_input)
+    layout['key'] = key
+    layout['structure_tag'] = tag
+    return layout
+
+
+# --- Enregistrement et calcul en arrière-plan ---
+
+def store_auto_layout(subproject_id: int, layout: Dict[str, Any]) -> None:
+    """
+    Enregistre le layout dans SubProject.auto_layout par un UPDATE ciblé : les événements ORM de la
+    ligne (incrément de version) ne sont pas déclenchés et visual_layout n'est pas réécrit, même si
+    un PUT concurrent le modifie (commit à la charge de l'appelant).
+    """
+    db.session.execute(
+        update(SubProject).where(SubProject.id == subproject_id).values(auto_layout=layout),
+        execution_options={'synchronize_session': False},
+    )
+
+
+class LayoutWorker:
+    """
+    Calcule les layouts dans un pool de processus et les enregistre à la fin du calcul ; synchrone sans
+    processus. Le pool est créé au premier calcul dans chaque processus de l'application (un pool hérité
+    d'un fork n'est pas réutilisé) et arrêté à la sortie de l'interpréteur ou à la reconfiguration.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._pending: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._shutdown_registered = False
+
+    def init_app(self, app) -> None:
+        """Applique le nombre de processus de la configuration (0 : calcul dans la requête)."""
+        self.shutdown()
+        self.workers = app.config.get('MERMAID_LAYOUT_WORKERS', 1)
+        if not self._shutdown_registered:
+            atexit.register(self.shutdown)
+            self._shutdown_registered = True
+
+    def shutdown(self) -> None:
+        """Arrête le pool de ce processus ; les calculs non commencés sont abandonnés."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            owned = self._executor_pid == os.getpid()
+            self._pending.clear()
+        if executor is not None and owned:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def background(self) -> bool:
+        return self.workers > 0
+
+    def is_pending(self, subproject_id: int, key: str) -> bool:
+        with self._lock:
+            return self._pending.get(subproject_id) == key
+
+    def submit(self, subproject_id: int, layout_input: LayoutInput, key: str, tag: Optional[str] = None) -> None:
+        """Lance le calcul en arrière-plan, sauf s'il est déjà en cours pour cette structure."""
+        app = current_app._get_current_object()
+        with self._lock:
+            if self._pending.get(subproject_id) == key:
+                return
+            self._pending[subproject_id] = key
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._executor_pid = os.getpid()
+            future = self._executor.submit(_compute_keyed_layout, layout_input, key, tag)
+        future.add_done_callback(partial(self._store, app, subproject_id, key))
+
+    def _store(self, app, subproject_id: int, key: str, future: Future) -> None:
+        try:
+            if future.cancelled():
+                return
+            layout = future.result()
+            with app.app_context():
+                store_auto_layout(subproject_id, layout)
+                db.session.commit()
+        except Exception:
+            app.logger.exception("Layout automatique du SubProject %s non enregistré", subproject_id)
+        finally:
+            with self._lock:
+                if self._pending.get(subproject_id) == key:
+                    del self._pending[subproject_id]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'workers': self.workers, 'pending': len(self._pending)}
+
+
+# Instance partagée, configurée par create_app()
+layout_worker = LayoutWorker()
+
+
+def get_auto_layout(subproject_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Layout automatique de la structure courante d'un SubProject. Un layout enregistré pour l'empreinte
+    structurelle courante est servi sans relire le graphe (empreinte recalculée d'abord si elle a été
+    effacée par une régénération). Sinon la structure mise en page est relue :
+    inchangée, le layout est ré-étiqueté ; changée, le calcul est lancé en arrière-plan et None est
+    retourné (calculé et enregistré tout de suite si le worker n'a pas de processus).
+    Lève NotFound si le SubProject n'existe pas.
+    """
+    row = db.session.execute(
+        db.select(SubProject.structure_hash, SubProject.auto_layout).where(SubProject.id == subproject_id)
+    ).one_or_none()
+    if row is None:
+        raise NotFound(f"SubProject ID {subproject_id} non trouvé.")
+    structure_hash, stored = row
+    if structure_hash is None:
+        # Définition régénérée au commit : l'empreinte est recalculée une fois, puis enregistrée
+        structure_hash = get_structure_hash(db.session.get(SubProject, subproject_id))
+        db.session.commit()
+    tag = structure_tag(structure_hash)
+    if stored and tag is not None and stored.get('structure_tag') == tag:
+        return stored
+
+    layout_input = load_layout_input(subproject_id)
+    key = layout_key(layout_input)
+    if stored and stored.get('key') == key:
+        stored = dict(stored, structure_tag=tag)
+        store_auto_layout(subproject_id, stored)
+        db.session.commit()
+        return stored
+
+    if layout_worker.background:
+        layout_worker.submit(subproject_id, layout_input, key, tag)
+        return None
+    layout = _compute_keyed_layout(layout_input, key, tag)
+    store_auto_layout(subproject_id, layout)
+    db.session.commit()
+    return layout
@@ -0,0 +1,141 @@
+# backend/app/services/mermaid_parse_cache.py
+# Version 1.3
+"""
+Cache LRU borné des résultats d'analyse Mermaid, adressé par le contenu.
+
+La clé est l'empreinte SHA-256 de la définition normalisée (fins de ligne unifiées,
+espaces de début et de fin de ligne retirés, lignes vides finales ignorées). Le
+découpage en lignes est conservé pour que les numéros de ligne restent valables. Une variante
+(les budgets d'analyse en vigueur) complète la clé : un résultat obtenu sous des budgets plus
+larges n'est pas servi à un appelant soumis à des budgets plus stricts.
+Les résultats en cache sont partagés : les appelants ne doivent pas les modifier.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, Union
+
+from app.services.mermaid_grammar import ParsedGraph
+
+DEFAULT_MAX_ENTRIES = 64
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Coûts forfaitaires (octets) des entrées d'un ParsedGraph, mesurés avec tracemalloc
+# (benchmarks/bench_parsed_graph_memory.py)
+_NODE_OVERHEAD = 150      # identifiant + entrée d'index + emplacements titre/classe
+_STRING_OVERHEAD = 50     # en-tête d'une chaîne (titre)
+_EDGE_OVERHEAD = 9        # deux indices int32 + code de LinkType
+_LABEL_OVERHEAD = 120     # chaîne + entrée du dictionnaire creux des étiquettes
+_SMALL_ENTRY_OVERHEAD = 120
+
+
+def normalize_definition(mermaid_code: str) -> str:
+    """Normalise une définition sans changer la numérotation de ses lignes."""
+    return '\n'.join(line.strip() for line in mermaid_code.split('\n')).rstrip('\n')
+
+
+def _estimate_size(result: Union[ParsedGraph, Tuple]) -> int:
+    """
+    Estime l'empreinte mémoire d'un ParsedGraph, ou d'un couple (ParsedGraph, carte des sources)
+    tel que mémorisé par le service d'import.
+    """
+    if isinstance(result, tuple):
+        parsed, source_map = result
+        spans = sum(len(entries) for entries in source_map.values())
+        return _estimate_size(parsed) + _SMALL_ENTRY_OVERHEAD * spans
+    size = result.edge_count * _EDGE_OVERHEAD
+    for mermaid_id in result.node_ids:
+        size += _NODE_OVERHEAD + len(mermaid_id)
+    for title in result.node_titles:
+        if title is not None:
+            size += _STRING_OVERHEAD + len(title)
+    for label in result.edge_labels.values():
+        size += _LABEL_OVERHEAD + len(label)
+    for name, definition in result.classdefs.items():
+        size += _SMALL_ENTRY_OVERHEAD + len(name) + len(definition)
+    for node_ids in result.subgraphs.values():
+        size += _SMALL_ENTRY_OVERHEAD + 8 * len(node_ids)
+    return size
+
+
+class MermaidParseCache:
+    """Cache LRU thread-safe, borné en nombre d'entrées et en octets estimés."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app) -> None:
+        """Applique les limites définies dans la configuration de l'application."""
+        self.max_entries = app.config.get('MERMAID_PARSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+        self.max_bytes = app.config.get('MERMAID_PARSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        self.clear()
+
+    def get_or_parse(self, mermaid_code: str, parse: Callable[[str], Tuple],
+                     variant: Optional[Hashable] = None) -> Tuple:
+        """
+        Retourne le résultat en cache pour cette définition (et cette variante), ou l'analyse avec
+        `parse` et le mémorise.
+        Le texte d'origine est analysé (colonnes des erreurs exactes) ; les erreurs ne sont pas mises en cache.
+        """
+        if self.max_entries <= 0 or self.max_bytes <= 0:
+            return parse(mermaid_code)
+
+        normalized = normalize_definition(mermaid_code)
+        if variant is not None:
+            normalized = f"{variant!r}\0{normalized}"
+        key = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        result = parse(mermaid_code)
+        size = _estimate_size(result)
+        if size > self.max_bytes:
+            return result
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (result, size)
+                self._bytes += size
+                while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self._bytes -= evicted_size
+                    self.evictions += 1
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Compteurs exposés pour dimensionner le cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Instance partagée, configurée par create_app()
+parse_cache = MermaidParseCache()
@@ -1,46 +1,29 @@
 # backend/app/services/mermaid_parser.py
-# Version 2.3
-
-import re
-from typing import Dict, List, Tuple, Optional
-from sqlalchemy import update
+# Version 3.9
+
+import hashlib
+import json
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+from flask import current_app, has_app_context
+from sqlalchemy import Integer, case, cast, column, delete, insert, update, values
 from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import BadRequest, NotFound
 
 from app import db
-from app.models import Project, SubProject, Node, Relationship, ClassDef, Subgraph, LinkType
-
-# --- Exceptions et Helpers ---
-
-class MermaidParsingError(BadRequest):
-    """Erreur spécifique de syntaxe Mermaid."""
-    pass
-
-# --- REGEX PATTERNS ---
-GRAPH_TYPE_PATTERN = re.compile(r'^\s*graph\s+(\w+)\s*', re.IGNORECASE)
-CLASSDEF_PATTERN = re.compile(r'^\s*classDef\s+(\w+)\s+(.+?)\s*$', re.IGNORECASE)
-# Handles both A["..."] and S{{"..."}} syntax
-NODE_DEFINITION_PATTERN = re.compile(r'^\s*(\w+)\s*(?:\[(.*?)\]|\{\{(.*?)\}\})\s*$', re.IGNORECASE)
-# Handles optional semicolon at the end: class A style;
-NODE_CLASS_PATTERN = re.compile(r'^\s*class\s+(\w+)\s+(\w+)\s*;?\s*$', re.IGNORECASE)
-# Relation : Source --> Target : Label | Source --- Target : Label
-RELATIONSHIP_PATTERN = re.compile(r'^\s*(\w+)\s*--\s*(?:\|(.*?)\|)?\s*>\s*(\w+)\s*$|^\s*(\w+)\s*---\s*(?:\|(.*?)\|)?\s*(\w+)\s*$', re.IGNORECASE)
-# Subgraph: subgraph cluster_A[Title]
-SUBGRAPH_START_PATTERN = re.compile(r'^\s*subgraph\s+(\w+)(?:\[(.*?)\])?\s*$', re.IGNORECASE)
-SUBGRAPH_END_PATTERN = re.compile(r'^\s*end\s*$', re.IGNORECASE)
-
-
-def _get_link_type(match_groups: tuple) -> Tuple[LinkType, str, str, str]:
-    """Détermine le LinkType et extrait les composants de la relation à partir des groupes de la regex."""
-    # Match pour "-->"
-    if match_groups[0] is not None:
-        source, label, target = match_groups[0:3]
-        return LinkType.VISIBLE, source, label, target
-    # Match pour "---"
-    else:
-        source, label, target = match_groups[3:6]
-        return LinkType.INVISIBLE, source, label, target
+from app.models import Project, SubProject, Node, Relationship, ClassDef, Subgraph
+from app.services.mermaid_grammar import (
+    MermaidParsingError, ParseLimits, ParsedGraph, SourceMap, new_source_map, parse_flowchart, iter_flowchart_events,
+    EVENT_DIRECTION, EVENT_NODE, EVENT_NODE_CLASS, EVENT_EDGE, EVENT_CLASSDEF,
+    EVENT_SUBGRAPH_START, EVENT_SUBGRAPH_CLASS,
+)
+from app.services.mermaid_fragment_cache import mark_definition_current, mark_stale
+from app.services.mermaid_parse_cache import parse_cache
+from app.services.mermaid_bulk_loader import should_bulk_load, bulk_load_new_subproject
+
+DEFAULT_IMPORT_BATCH_SIZE = 1000
 
 def _ensure_project(title: str) -> Project:
     """Récupère un projet existant ou en crée un nouveau."""
@@ -68,192 +51,485 @@ def _find_or_create_subproject(project: Project, mermaid_code: str) -> SubProjec
 
     return subproject
 
-def _parse_mermaid_elements(mermaid_code: str) -> Tuple[str, Dict, Dict, List, Dict[str, List[str]]]:
+def _parse_mermaid_document(mermaid_code: str, limits: Optional[ParseLimits] = None) -> Tuple[ParsedGraph, SourceMap]:
     """
-    Analyse le code Mermaid pour extraire la direction, les nœuds, relations, classdefs et groupements de subgraphs.
-    Retourne la direction du graphe et les dictionnaires/listes des éléments extraits.
+    Analyse le code Mermaid et retourne (ParsedGraph, carte des sources).
+    L'analyse est faite en une seule passe linéaire par app.services.mermaid_grammar ; le couple
+    est mémorisé dans le cache d'analyse et partagé entre appelants (lecture seule). La normalisation
+    du cache conservant la numérotation des lignes, la carte reste exacte pour tout texte équivalent.
+    Lève MermaidInputTooLarge (413) si le code dépasse les budgets `limits` (par défaut ceux de la
+    configuration, voir parse_limits) ; les budgets font partie de la clé du cache.
     """
-    lines = mermaid_code.strip().split('\n')
-    graph_direction = "TD"  # Valeur par défaut robuste
+    if limits is None:
+        limits = parse_limits()
 
-    if not lines:
-        raise MermaidParsingError("Le code Mermaid ne peut être vide.")
+    def parse(code: str) -> Tuple[ParsedGraph, SourceMap]:
+        source_map = new_source_map()
+        return parse_flowchart(code.split('\n'), limits=limits, source_map=source_map), source_map
 
-    match = GRAPH_TYPE_PATTERN.match(lines[0])
-    if not match:
-        raise MermaidParsingError(f"Le code Mermaid doit commencer par 'graph TD', 'graph LR', etc. Ligne 1: {lines[0]}")
+    return parse_cache.get_or_parse(mermaid_code, parse, variant=limits)
 
-    graph_direction = match.group(1).upper()
 
-    nodes_data: Dict[str, Dict] = {}  # {mermaid_id: {title, text_content, style_class_ref}}
-    relationships_data = [] # List[{source, target, label, link_type}]
-    classdefs_data = {} # {name: definition_raw}
-    subgraphs_grouping: Dict[str, List[str]] = {} # {subgraph_mermaid_id: [node_mermaid_id, ...]}
-    current_subgraph_mermaid_id: Optional[str] = None
+def _parse_mermaid_elements(mermaid_code: str, limits: Optional[ParseLimits] = None) -> ParsedGraph:
+    """
+    Analyse le code Mermaid pour extraire la direction, les nœuds, relations, classdefs et groupements de subgraphs
+    (voir _parse_mermaid_document).
+    """
+    return _parse_mermaid_document(mermaid_code, limits)[0]
 
-    # Parsing ligne par ligne
-    for line in lines[1:]: # Ignorer la première ligne (graph type)
-        line = line.strip()
-        if not line:
-            continue
 
-        # 0. Subgraph start
-        match = SUBGRAPH_START_PATTERN.match(line)
-        if match:
-            current_subgraph_mermaid_id, _ = match.groups()
-            current_subgraph_mermaid_id = current_subgraph_mermaid_id.strip()
-            subgraphs_grouping[current_subgraph_mermaid_id] = []
-            continue
+def _store_definition_metadata(subproject: SubProject, **values) -> None:
+    """
+    Enregistre des métadonnées recalculées de la définition (empreinte, carte des sources) par une
+    mise à jour ciblée : elles ne décrivent rien de neuf, la version du SubProject ne change pas.
+    """
+    db.session.execute(
+        update(SubProject).where(SubProject.id == subproject.id).values(**values),
+        execution_options={'synchronize_session': False},
+    )
+    for key, value in values.items():
+        set_committed_value(subproject, key, value)
 
-        # 0. Subgraph end
-        match = SUBGRAPH_END_PATTERN.match(line)
-        if match:
-            current_subgraph_mermaid_id = None
-            continue
 
-        # A. ClassDefs
-        match = CLASSDEF_PATTERN.match(line)
-        if match:
-            name, definition = match.groups()
-            classdefs_data[name.strip()] = definition.strip()
-            continue
+def get_source_map(subproject: SubProject) -> SourceMap:
+    """
+    Carte des sources de la définition d'un SubProject (entité -> intervalle de lignes).
+    Si elle n'est pas stockée (définition régénérée au commit, ou antérieure à la fonctionnalité),
+    elle est recalculée depuis le texte et enregistrée sans changer la version ; l'appelant décide du commit.
+    """
+    if subproject.source_map is None:
+        if not (subproject.mermaid_definition or '').strip():
+            return new_source_map()
+        _store_definition_metadata(subproject, source_map=_parse_mermaid_document(subproject.mermaid_definition)[1])
+    return subproject.source_map
+
+
+def get_structure_hash(subproject: SubProject) -> Optional[str]:
+    """
+    Empreinte structurelle de la définition d'un SubProject (None si la définition est vide).
+    Si elle n'est pas stockée (définition régénérée au commit, voir mermaid_generator), elle est
+    recalculée depuis le texte et enregistrée sans changer la version ; l'appelant décide du commit.
+    """
+    if subproject.structure_hash is None and (subproject.mermaid_definition or '').strip():
+        _store_definition_metadata(
+            subproject, structure_hash=_structure_hash(_parse_mermaid_elements(subproject.mermaid_definition)),
+        )
+    return subproject.structure_hash
+
+
+def _structure_hash(parsed: ParsedGraph) -> str:
+    """
+    Empreinte SHA-256 canonique d'un résultat d'analyse : indépendante de l'ordre des lignes,
+    des espaces et des commentaires, elle ne change que si le graphe synchronisé en base change.
+    """
+    canonical = {
+        'direction': parsed.direction,
+        'classdefs': sorted(parsed.classdefs.items()),
+        'nodes': sorted(list(node) for node in parsed.iter_nodes()),
+        # Multiensemble : les relations en double restent comptées
+        'relationships': sorted(
+            json.dumps([edge.source, edge.target, edge.label, edge.link_type.value])
+            for edge in parsed.iter_edges()
+        ),
+        'subgraphs': sorted(
+            [sg_id, parsed.subgraph_titles.get(sg_id), parsed.subgraph_classes.get(sg_id), sorted(node_ids)]
+            for sg_id, node_ids in parsed.subgraphs.items()
+        ),
+    }
+    payload = json.dumps(canonical, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def compute_structure_hash(mermaid_code: str, limits: Optional[ParseLimits] = None) -> str:
+    """Analyse le code Mermaid (via le cache d'analyse) et retourne son empreinte structurelle."""
+    return _structure_hash(_parse_mermaid_elements(mermaid_code, limits))
+
+
+def parse_limits() -> ParseLimits:
+    """
+    Budgets d'analyse configurés pour l'application courante (MERMAID_MAX_*, MERMAID_PARSE_TIMEOUT) ;
+    hors contexte d'application (scripts, processus de calcul), aucun budget.
+    """
+    if not has_app_context():
+        return ParseLimits()
+    return ParseLimits.from_config(current_app.config)
+
+
+def _import_batch_size() -> int:
+    """Taille des lots d'écriture configurée pour l'application courante."""
+    return current_app.config.get('MERMAID_IMPORT_BATCH_SIZE', DEFAULT_IMPORT_BATCH_SIZE)
+
+
+def _supports_bulk_returning() -> bool:
+    """Indique si le dialecte courant accepte RETURNING sur un INSERT à lignes multiples."""
+    return db.session.get_bind().dialect.insert_executemany_returning
 
-        # B. Nodes definition
-        match = NODE_DEFINITION_PATTERN.match(line)
-        if match:
-            mermaid_id, title_from_brackets, title_from_braces = match.groups()
-            title_raw = title_from_brackets if title_from_brackets is not None else title_from_braces
-            mermaid_id = mermaid_id.strip()
-            title = title_raw.strip().strip('"') if title_raw else None
-
-            if mermaid_id not in nodes_data:
-                nodes_data[mermaid_id] = {'title': title, 'text_content': title, 'style_class_ref': None}
-            else:
-                nodes_data[mermaid_id]['title'] = title
-                nodes_data[mermaid_id]['text_content'] = title
-
-            if current_subgraph_mermaid_id:
-                subgraphs_grouping[current_subgraph_mermaid_id].append(mermaid_id)
-            continue
 
-        # C. Nodes class
-        match = NODE_CLASS_PATTERN.match(line)
-        if match:
-            mermaid_id, class_ref = match.groups()
-            mermaid_id = mermaid_id.strip()
-            class_ref = class_ref.strip()
-
-            if mermaid_id not in nodes_data:
-                nodes_data[mermaid_id] = {'title': None, 'text_content': mermaid_id, 'style_class_ref': class_ref}
-            else:
-                nodes_data[mermaid_id]['style_class_ref'] = class_ref
+def _insert_returning_ids(model, rows: List[Dict], batch_size: int) -> Dict[str, int]:
+    """
+    Insère des lignes d'un même SubProject (Node ou Subgraph) par lots et retourne la correspondance
+    mermaid_id -> id.
+
+    Avec un dialecte qui sait renvoyer les lignes d'un INSERT multiple (PostgreSQL, SQLite >= 3.35),
+    chaque lot est un unique `INSERT ... RETURNING id, mermaid_id`. Sinon, le lot est inséré sans
+    RETURNING puis ses identifiants sont relus par (subproject_id, mermaid_id), clé unique de l'entité.
+    Les lignes passent par le Core : aucun objet n'est ajouté à la session.
+    """
+    id_map: Dict[str, int] = {}
+    supports_returning = _supports_bulk_returning()
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        if supports_returning:
+            result = db.session.execute(insert(model).returning(model.id, model.mermaid_id), batch)
+        else:
+            db.session.execute(insert(model), batch)
+            result = db.session.execute(
+                db.select(model.id, model.mermaid_id).where(
+                    model.subproject_id == batch[0]['subproject_id'],
+                    model.mermaid_id.in_([row['mermaid_id'] for row in batch])
+                )
+            )
+        id_map.update((mermaid_id, entity_id) for entity_id, mermaid_id in result)
+    return id_map
+
+
+def _insert_nodes_returning_ids(rows: List[Dict], batch_size: int) -> Dict[str, int]:
+    """Insère des nœuds par lots (voir _insert_returning_ids) et retourne mermaid_id -> id."""
+    return _insert_returning_ids(Node, rows, batch_size)
+
+
+def _empty_change_summary() -> Dict[str, int]:
+    return {'inserted': 0, 'updated': 0, 'deleted': 0}
+
+
+def _delete_by_ids(model, ids: List[int], batch_size: int) -> None:
+    """Supprime des lignes par clé primaire, par lots pour borner la taille des clauses IN."""
+    for start in range(0, len(ids), batch_size):
+        db.session.execute(delete(model).where(model.id.in_(ids[start:start + batch_size])))
+
+
+def _sync_classdefs(subproject_id: int, classdefs_data: Dict[str, str], batch_size: int) -> Dict[str, int]:
+    """Diff des ClassDefs par nom : seules les définitions ajoutées, modifiées ou retirées sont écrites."""
+    summary = _empty_change_summary()
+    existing = {
+        name: (classdef_id, definition_raw)
+        for classdef_id, name, definition_raw in db.session.execute(
+            db.select(ClassDef.id, ClassDef.name, ClassDef.definition_raw).where(ClassDef.subproject_id == subproject_id)
+        )
+    }
+
+    deleted_ids = [classdef_id for name, (classdef_id, _) in existing.items() if name not in classdefs_data]
+    updated_rows = [
+        {'id': existing[name][0], 'definition_raw': definition_raw}
+        for name, definition_raw in classdefs_data.items()
+        if name in existing and existing[name][1] != definition_raw
+    ]
+    inserted_rows = [
+        {'subproject_id': subproject_id, 'name': name, 'definition_raw': definition_raw}
+        for name, definition_raw in classdefs_data.items() if name not in existing
+    ]
+
+    if deleted_ids:
+        _delete_by_ids(ClassDef, deleted_ids, batch_size)
+    if updated_rows:
+        db.session.execute(update(ClassDef), updated_rows)
+    if inserted_rows:
+        db.session.execute(insert(ClassDef), inserted_rows)
+
+    summary.update(inserted=len(inserted_rows), updated=len(updated_rows), deleted=len(deleted_ids))
+    return summary
+
+
+def _sync_subgraphs(subproject_id: int, parsed: ParsedGraph,
+                    batch_size: int) -> Tuple[Dict[str, int], Dict[str, int], List[int]]:
+    """
+    Upsert des Subgraphs déclarés par les blocs `subgraph ... end`, par identifiant Mermaid :
+    les nouveaux sont insérés par lots (INSERT ... RETURNING), ceux dont le titre ou la classe
+    change sont mis à jour en une instruction groupée. Un nouveau subgraph sans titre prend son identifiant.
+
+    Retourne (résumé, {mermaid_id: id} des subgraphs du code, ids des subgraphs retirés du code).
+    Les subgraphs retirés, déjà comptés dans le résumé, sont supprimés par l'appelant une fois
+    leurs nœuds réaffectés.
+    """
+    summary = _empty_change_summary()
+    existing = {
+        mermaid_id: (subgraph_id, title, style_class_ref)
+        for subgraph_id, mermaid_id, title, style_class_ref in db.session.execute(
+            db.select(Subgraph.id, Subgraph.mermaid_id, Subgraph.title, Subgraph.style_class_ref)
+            .where(Subgraph.subproject_id == subproject_id)
+        )
+    }
+
+    subgraph_id_map: Dict[str, int] = {}
+    inserted_rows: List[Dict] = []
+    updated_rows: List[Dict] = []
+    for mermaid_id in parsed.subgraphs:
+        title = parsed.subgraph_titles.get(mermaid_id)
+        style_class_ref = parsed.subgraph_classes.get(mermaid_id)
+        current = existing.get(mermaid_id)
+        if current is None:
+            inserted_rows.append({
+                'subproject_id': subproject_id,
+                'mermaid_id': mermaid_id,
+                'title': title or mermaid_id,
+                'style_class_ref': style_class_ref,
+            })
             continue
+        subgraph_id_map[mermaid_id] = current[0]
+        if title is None:
+            title = current[1]  # Comme pour les nœuds, seul un titre explicite remplace le titre existant
+        if (title, style_class_ref) != current[1:]:
+            updated_rows.append({'id': current[0], 'title': title, 'style_class_ref': style_class_ref})
+
+    if inserted_rows:
+        subgraph_id_map.update(_insert_returning_ids(Subgraph, inserted_rows, batch_size))
+    if updated_rows:
+        db.session.execute(update(Subgraph), updated_rows)
+    removed_ids = [subgraph_id for mermaid_id, (subgraph_id, _, _) in existing.items() if mermaid_id not in parsed.subgraphs]
+
+    summary.update(inserted=len(inserted_rows), updated=len(updated_rows), deleted=len(removed_ids))
+    return summary, subgraph_id_map, removed_ids
+
+
+def _node_subgraph_ids(parsed: ParsedGraph, subgraph_id_map: Dict[str, int]) -> Dict[str, int]:
+    """Subgraph cible (id en base) de chaque nœud placé dans un bloc `subgraph ... end`."""
+    return {
+        node_mermaid_id: subgraph_id_map[subgraph_mermaid_id]
+        for subgraph_mermaid_id, node_mermaid_ids in parsed.subgraphs.items()
+        for node_mermaid_id in node_mermaid_ids
+    }
 
-        # D. Relationships
-        match = RELATIONSHIP_PATTERN.match(line)
-        if match:
-            link_type, source, label_raw, target = _get_link_type(match.groups())
-            label = label_raw.strip() if label_raw else None
 
-            relationships_data.append({
-                'source': source.strip(),
-                'target': target.strip(),
+def _sync_relationships(subproject_id: int, parsed: ParsedGraph, node_id_map: Dict[str, int],
+                        batch_size: int) -> Dict[str, int]:
+    """
+    Diff des relations, vues comme un multiensemble de clés (source, cible, link_type, label).
+
+    Une relation existante dont la clé figure encore dans le code est conservée telle quelle (id et
+    couleur compris). Parmi les relations restantes, celles qui relient la même paire de nœuds qu'une
+    relation à créer sont mises à jour en place (label / link_type) ; les autres sont supprimées.
+    """
+    summary = _empty_change_summary()
+    existing: Dict[Tuple, List[int]] = defaultdict(list)
+    for rel_id, source_id, target_id, link_type, label in db.session.execute(
+        db.select(Relationship.id, Relationship.source_node_id, Relationship.target_node_id,
+                  Relationship.link_type, Relationship.label)
+        .where(Relationship.subproject_id == subproject_id)
+        .order_by(Relationship.id.desc())
+    ):
+        existing[(source_id, target_id, link_type, label)].append(rel_id)
+
+    # 1. Appariement exact des clés (les liens du ParsedGraph référencent les nœuds par indice)
+    node_db_ids: List[Optional[int]] = [node_id_map.get(mermaid_id) for mermaid_id in parsed.node_ids]
+    labels = parsed.edge_labels
+    missing_keys: List[Tuple] = []
+    for index, (source, target) in enumerate(zip(parsed.edge_sources, parsed.edge_targets)):
+        source_node_db_id = node_db_ids[source]
+        target_node_db_id = node_db_ids[target]
+        if source_node_db_id is None or target_node_db_id is None:
+            raise NotFound(f"Erreur interne: Nœud source ({parsed.node_ids[source]}) ou cible ({parsed.node_ids[target]}) manquant.")
+        key = (source_node_db_id, target_node_db_id, parsed.edge_link_type(index), labels.get(index))
+        matching_ids = existing.get(key)
+        if matching_ids:
+            matching_ids.pop()  # Conserve en priorité les relations les plus anciennes
+        else:
+            missing_keys.append(key)
+
+    # 2. Relations restantes, regroupées par paire de nœuds
+    leftovers_by_pair: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+    for (source_id, target_id, _, _), rel_ids in existing.items():
+        leftovers_by_pair[(source_id, target_id)].extend(rel_ids)
+
+    # 3. Mise à jour en place si possible, insertion sinon
+    updated_rows: List[Dict] = []
+    inserted_rows: List[Dict] = []
+    for source_id, target_id, link_type, label in missing_keys:
+        reusable_ids = leftovers_by_pair.get((source_id, target_id))
+        if reusable_ids:
+            updated_rows.append({'id': reusable_ids.pop(), 'link_type': link_type, 'label': label})
+        else:
+            inserted_rows.append({
+                'subproject_id': subproject_id,
+                'source_node_id': source_id,
+                'target_node_id': target_id,
                 'label': label,
-                'link_type': link_type
+                'link_type': link_type,
+                'color': None,
             })
-            for node_id in [source.strip(), target.strip()]:
-                if node_id not in nodes_data:
-                    nodes_data[node_id] = {'title': None, 'text_content': node_id, 'style_class_ref': None}
-            continue
+    deleted_ids = [rel_id for rel_ids in leftovers_by_pair.values() for rel_id in rel_ids]
 
-    return graph_direction, classdefs_data, nodes_data, relationships_data, subgraphs_grouping
+    if deleted_ids:
+        _delete_by_ids(Relationship, deleted_ids, batch_size)
+    if updated_rows:
+        db.session.execute(update(Relationship), updated_rows)
+    if inserted_rows:
+        db.session.execute(insert(Relationship), inserted_rows)
 
+    summary.update(inserted=len(inserted_rows), updated=len(updated_rows), deleted=len(deleted_ids))
+    return summary
 
-def synchronize_subproject_entities(subproject: SubProject, mermaid_code: str) -> None:
+
+def _apply_subgraph_moves(moves: Dict[int, Optional[int]], batch_size: int) -> None:
+    """
+    Applique les changements d'affectation {node.id: subgraph.id | None} en une instruction par lot.
+
+    PostgreSQL : `UPDATE node SET subgraph_id = v.subgraph_id FROM (VALUES ...) AS v WHERE node.id = v.id`.
+    Autres dialectes : `UPDATE node SET subgraph_id = CASE id WHEN ... END WHERE id IN (...)`.
+    """
+    use_values = db.session.get_bind().dialect.name == 'postgresql'
+    items = list(moves.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        if use_values:
+            moved = values(column('id', Integer), column('subgraph_id', Integer), name='moved_nodes').data(batch)
+            statement = (
+                update(Node)
+                .where(Node.id == moved.c.id)
+                # Le cast type la colonne quand le lot ne contient que des NULL (désaffectations)
+                .values(subgraph_id=cast(moved.c.subgraph_id, Integer))
+            )
+        else:
+            statement = (
+                update(Node)
+                .where(Node.id.in_([node_id for node_id, _ in batch]))
+                .values(subgraph_id=case(dict(batch), value=Node.id))
+            )
+        db.session.execute(statement, execution_options={'synchronize_session': 'fetch'})
+
+
+def synchronize_subproject_entities(subproject: SubProject, mermaid_code: str, parsed: Optional[ParsedGraph] = None,
+                                    source_map: Optional[SourceMap] = None) -> Dict[str, Dict[str, int]]:
     """
     Synchronise les entités structurelles d'un SubProject avec le code Mermaid parsé.
     Cette fonction opère dans la transaction de l'appelant (pas de commit/rollback).
+    L'empreinte structurelle et la carte des sources du SubProject sont mises à jour : la définition
+    doit donc déjà être assignée.
+
+    Seules les entités qui changent sont écrites. Les Subgraphs suivent les blocs `subgraph ... end`
+    (créés, renommés, stylés ou supprimés). Retourne le résumé des changements :
+    {'nodes' | 'relationships' | 'classdefs' | 'subgraphs': {'inserted': n, 'updated': n, 'deleted': n}}.
+    `parsed` (et `source_map`) permettent de fournir une analyse déjà calculée pour `mermaid_code`
+    (import en masse) ; sans carte, elle sera recalculée à la première lecture.
     """
     subproject_id = subproject.id
+    batch_size = _import_batch_size()
+    summary = {'nodes': _empty_change_summary()}
 
     # 1. Parsing
-    graph_direction, classdefs_data, nodes_data_raw, relationships_data_raw, subgraphs_grouping = _parse_mermaid_elements(mermaid_code)
-    subproject.graph_direction = graph_direction
+    if parsed is None:
+        parsed, source_map = _parse_mermaid_document(mermaid_code)
+    subproject.graph_direction = parsed.direction
+    subproject.structure_hash = _structure_hash(parsed)
+    subproject.source_map = source_map
 
-    # 2. Suppression des entités non-éditables
-    db.session.query(Relationship).filter_by(subproject_id=subproject_id).delete(synchronize_session='fetch')
-    db.session.query(ClassDef).filter_by(subproject_id=subproject_id).delete(synchronize_session='fetch')
-    db.session.flush()
+    # 2. Diff des ClassDefs
+    summary['classdefs'] = _sync_classdefs(subproject_id, parsed.classdefs, batch_size)
 
-    # 3. Récupération des entités existantes
+    # 3. Upsert des Subgraphs, puis récupération des nœuds existants
+    summary['subgraphs'], subgraph_id_map, removed_subgraph_ids = _sync_subgraphs(subproject_id, parsed, batch_size)
     existing_nodes = {node.mermaid_id: node for node in db.session.scalars(db.select(Node).filter_by(subproject_id=subproject_id))}
-    existing_subgraphs = {sg.mermaid_id: sg for sg in db.session.scalars(db.select(Subgraph).filter_by(subproject_id=subproject_id))}
 
     node_id_map: Dict[str, int] = {}
 
-    # 4. Ré-insertion ClassDefs
-    for name, definition_raw in classdefs_data.items():
-        db.session.add(ClassDef(subproject_id=subproject_id, name=name, definition_raw=definition_raw))
+    # Subgraph cible de chaque nœud
+    target_subgraph_ids = _node_subgraph_ids(parsed, subgraph_id_map)
 
-    # 5. Update-or-Create Nœuds
-    parsed_mermaid_ids = set(nodes_data_raw.keys())
-    for mermaid_id, data in nodes_data_raw.items():
+    # 4. Update-or-Create Nœuds (les nouveaux nœuds sont insérés par lots, sans flush par nœud)
+    new_node_rows: List[Dict] = []
+    subgraph_moves: Dict[int, Optional[int]] = {}
+    for mermaid_id, title, text_content, style_class_ref in parsed.iter_nodes():
         node = existing_nodes.get(mermaid_id)
         if node:
-            if data['title'] is not None: node.title = data['title']
-            if data['text_content'] and data['text_content'] != node.text_content and data['text_content'] not in [mermaid_id, data['title']]:
-                node.text_content = data['text_content']
-            node.style_class_ref = data['style_class_ref']
+            # text_content dérive du titre : seul un titre explicite met à jour le nœud
+            changed = False
+            if title is not None and title != node.title:
+                node.title = title
+                changed = True
+            if style_class_ref != node.style_class_ref:
+                node.style_class_ref = style_class_ref
+                changed = True
+            target_subgraph_id = target_subgraph_ids.get(mermaid_id)
+            if node.subgraph_id != target_subgraph_id:
+                subgraph_moves[node.id] = target_subgraph_id
+                changed = True
+            if changed:
+                summary['nodes']['updated'] += 1
             node_id_map[mermaid_id] = node.id
         else:
-            node = Node(
-                subproject_id=subproject_id,
-                mermaid_id=mermaid_id,
-                title=data['title'],
-                text_content=data['text_content'] or mermaid_id,
-                style_class_ref=data['style_class_ref']
-            )
-            db.session.add(node)
-            db.session.flush()
-            node_id_map[mermaid_id] = node.id
+            new_node_rows.append({
+                'subproject_id': subproject_id,
+                'subgraph_id': target_subgraph_ids.get(mermaid_id),
+                'mermaid_id': mermaid_id,
+                'title': title,
+                'text_content': text_content,
+                'style_class_ref': style_class_ref,
+            })
+    if new_node_rows:
+        node_id_map.update(_insert_nodes_returning_ids(new_node_rows, batch_size))
+    summary['nodes']['inserted'] = len(new_node_rows)
+
+    # 5. Diff des Relations (avant la suppression des nœuds : celles qui les touchent disparaissent ici)
+    summary['relationships'] = _sync_relationships(subproject_id, parsed, node_id_map, batch_size)
 
     # 6. Suppression des nœuds obsolètes
     for mermaid_id, node in existing_nodes.items():
-        if mermaid_id not in parsed_mermaid_ids:
+        if mermaid_id not in parsed.node_index:
             db.session.delete(node)
+            summary['nodes']['deleted'] += 1
     db.session.flush()
 
-    # 7. Synchronisation des Subgraphs (affectation des nœuds)
-    # 7.1. Désaffecter tous les nœuds du projet en premier
-    db.session.execute(update(Node).where(Node.subproject_id == subproject_id).values(subgraph_id=None))
-
-    # 7.2. Ré-affecter les nœuds aux subgraphs existants
-    for subgraph_mermaid_id, node_mermaid_ids in subgraphs_grouping.items():
-        if subgraph_mermaid_id in existing_subgraphs and node_mermaid_ids:
-            subgraph_db_id = existing_subgraphs[subgraph_mermaid_id].id
-            node_db_ids_to_assign = [node_id_map[nid] for nid in node_mermaid_ids if nid in node_id_map]
-
-            if node_db_ids_to_assign:
-                db.session.execute(
-                    update(Node)
-                    .where(Node.id.in_(node_db_ids_to_assign))
-                    .values(subgraph_id=subgraph_db_id)
-                )
+    # 7. Affectation aux Subgraphs : seuls les nœuds existants qui changent de subgraph sont écrits
+    # (les nouveaux nœuds ont été insérés directement dans leur subgraph)
+    if subgraph_moves:
+        _apply_subgraph_moves(subgraph_moves, batch_size)
 
-    # 8. Ré-insertion des Relations
-    for rel_data in relationships_data_raw:
-        source_node_db_id = node_id_map.get(rel_data['source'])
-        target_node_db_id = node_id_map.get(rel_data['target'])
-        if source_node_db_id is None or target_node_db_id is None:
-            raise NotFound(f"Erreur interne: Nœud source ({rel_data['source']}) ou cible ({rel_data['target']}) manquant.")
-        db.session.add(Relationship(
-            subproject_id=subproject_id,
-            source_node_id=source_node_db_id,
-            target_node_id=target_node_db_id,
-            label=rel_data['label'],
-            link_type=rel_data['link_type'],
-            color=None
-        ))
+    # 8. Suppression des Subgraphs retirés du code (plus aucun nœud ne les référence)
+    if removed_subgraph_ids:
+        _delete_by_ids(Subgraph, removed_subgraph_ids, batch_size)
+
+    # Les entités suivent le texte : la définition assignée par l'appelant ne doit pas être régénérée
+    mark_definition_current(subproject_id)
+    return summary
+
+def populate_new_subproject(subproject: SubProject, mermaid_code: str, parsed: Optional[ParsedGraph] = None,
+                            source_map: Optional[SourceMap] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Peuple un SubProject qui vient d'être créé (aucune entité en base) à partir du code Mermaid.
+    Sur PostgreSQL, les gros graphes passent par COPY (mermaid_bulk_loader) après création des
+    Subgraphs ; sinon, ou si COPY n'est pas disponible, par synchronize_subproject_entities.
+    Retourne le résumé des changements.
+    """
+    if parsed is None:
+        parsed, source_map = _parse_mermaid_document(mermaid_code)
+    if not should_bulk_load(parsed.node_count + parsed.edge_count):
+        return synchronize_subproject_entities(subproject, mermaid_code, parsed, source_map)
+
+    subgraph_summary, subgraph_id_map, _ = _sync_subgraphs(subproject.id, parsed, _import_batch_size())
+    summary = bulk_load_new_subproject(subproject.id, parsed, _node_subgraph_ids(parsed, subgraph_id_map))
+    if summary is not None:
+        subproject.graph_direction = parsed.direction
+        subproject.structure_hash = _structure_hash(parsed)
+        subproject.source_map = source_map
+    else:
+        summary = synchronize_subproject_entities(subproject, mermaid_code, parsed, source_map)
+    # Les Subgraphs ont été créés avant le choix du chemin d'écriture
+    summary['subgraphs'] = subgraph_summary
+    return summary
+
+def _handle_import_error(e: Exception) -> None:
+    """Annule la transaction d'import et convertit l'erreur en réponse HTTP appropriée."""
+    db.session.rollback()
+    if isinstance(e, MermaidParsingError): raise BadRequest(description=str(e))
+    elif isinstance(e, IntegrityError): raise BadRequest("Erreur d'intégrité de la DB (unicité/clé étrangère).")
+    else: raise e
+
+def _get_project_with_subprojects(project_id: int) -> Project:
+    """Recharge un projet avec ses SubProjects publiés pour la réponse d'import."""
+    return db.session.execute(
+        db.select(Project)
+        .options(selectinload(Project.subprojects.and_(SubProject.import_checkpoint.is_(None)))) # type: ignore[arg-type]
+        .where(Project.id == project_id)
+    ).scalar_one()
 
 def parse_and_save_mermaid(mermaid_code: str, project_title: str = "Graphe Importé") -> Project:
     """
@@ -264,21 +540,185 @@ def parse_and_save_mermaid(mermaid_code: str, project_title: str = "Graphe Impor
     try:
         project = _ensure_project(project_title)
         subproject = _find_or_create_subproject(project, mermaid_code)
-        synchronize_subproject_entities(subproject, mermaid_code)
+        populate_new_subproject(subproject, mermaid_code)
         db.session.commit()
     except (IntegrityError, MermaidParsingError, NotFound, BadRequest) as e:
-        db.session.rollback()
-        if isinstance(e, MermaidParsingError): raise BadRequest(description=str(e))
-        elif isinstance(e, IntegrityError): raise BadRequest("Erreur d'intégrité de la DB (unicité/clé étrangère).")
-        else: raise e
+        _handle_import_error(e)
     except Exception as e:
         db.session.rollback()
         raise e
 
-    project_read = db.session.execute(
-        db.select(Project)
-        .options(selectinload(Project.subprojects)) # type: ignore[arg-type]
-        .where(Project.id == project.id)
-    ).scalar_one()
+    return _get_project_with_subprojects(project.id)
+
+
+class _StreamingImporter:
+    """
+    Peuple un SubProject neuf au fil des événements de l'analyseur.
+
+    Les nœuds, mises à jour de nœuds et relations sont accumulés par lots de `batch_size`
+    puis envoyés à la base ; seuls les correspondances mermaid_id -> id et les lots en cours
+    restent en mémoire, quelle que soit la taille du texte importé. Les subgraphs en attente
+    sont insérés juste avant le lot de nœuds qui les référence.
+    """
+
+    def __init__(self, subproject: SubProject, batch_size: int):
+        self.subproject = subproject
+        self.batch_size = batch_size
+        self.node_id_map: Dict[str, int] = {}
+        self.pending_nodes: Dict[str, Dict] = {}
+        self.pending_updates: Dict[str, Dict] = {}
+        self.pending_relationships: List[Dict] = []
+        self.classdefs_data: Dict[str, str] = {}
+        self.subgraph_id_map: Dict[str, int] = {}
+        self.pending_subgraphs: Dict[str, Dict] = {}
+        self.subgraph_updates: Dict[str, Dict] = {}
+        self.grouped_nodes: set = set()  # Nœuds déjà placés dans leur (premier) subgraph
+
+    def consume(self, lines: Iterable[str]) -> None:
+        for event in iter_flowchart_events(lines, limits=parse_limits()):
+            kind = event[0]
+            if kind == EVENT_NODE:
+                self._on_node(event[2], title=event[3], subgraph=event[4])
+            elif kind == EVENT_EDGE:
+                _, _, source, target, label, link_type = event
+                self.pending_relationships.append({
+                    'source': source, 'target': target, 'label': label, 'link_type': link_type
+                })
+                if len(self.pending_relationships) >= self.batch_size:
+                    self._flush_relationships()
+            elif kind == EVENT_NODE_CLASS:
+                self._on_node(event[2], style_class_ref=event[3])
+            elif kind == EVENT_SUBGRAPH_START:
+                self._on_subgraph(event[2], title=event[3])
+            elif kind == EVENT_SUBGRAPH_CLASS:
+                self._on_subgraph(event[2], style_class_ref=event[3])
+            elif kind == EVENT_CLASSDEF:
+                self.classdefs_data[event[2]] = event[3]
+            elif kind == EVENT_DIRECTION:
+                self.subproject.graph_direction = event[2]
+
+        self._flush_relationships()
+        self._flush_subgraphs()
+        self._flush_updates()
+        if self.subgraph_updates:
+            db.session.execute(update(Subgraph), list(self.subgraph_updates.values()))
+        for name, definition_raw in self.classdefs_data.items():
+            db.session.add(ClassDef(subproject_id=self.subproject.id, name=name, definition_raw=definition_raw))
+        db.session.flush()
+
+    def _on_subgraph(self, mermaid_id: str, title: Optional[str] = None, style_class_ref: Optional[str] = None) -> None:
+        if mermaid_id in self.subgraph_id_map:
+            data = self.subgraph_updates.setdefault(mermaid_id, {'id': self.subgraph_id_map[mermaid_id]})
+        else:
+            data = self.pending_subgraphs.setdefault(mermaid_id, {
+                'subproject_id': self.subproject.id, 'mermaid_id': mermaid_id, 'title': mermaid_id, 'style_class_ref': None,
+            })
+        if title is not None:
+            data['title'] = title
+        if style_class_ref is not None:
+            data['style_class_ref'] = style_class_ref
+
+    def _on_node(self, mermaid_id: str, title: Optional[str] = None, style_class_ref: Optional[str] = None,
+                 subgraph: Optional[str] = None) -> None:
+        if subgraph is not None and mermaid_id in self.grouped_nodes:
+            subgraph = None
+        if mermaid_id in self.node_id_map:
+            # Nœud déjà inséré : la modification est appliquée par lot
+            if title is None and style_class_ref is None and subgraph is None:
+                return
+            data = self.pending_updates.setdefault(mermaid_id, {'id': self.node_id_map[mermaid_id]})
+            if len(self.pending_updates) >= self.batch_size:
+                self._flush_updates()
+                data = self.pending_updates.setdefault(mermaid_id, {'id': self.node_id_map[mermaid_id]})
+        else:
+            data = self.pending_nodes.get(mermaid_id)
+            if data is None:
+                data = {'subproject_id': self.subproject.id, 'mermaid_id': mermaid_id, 'title': None,
+                        'text_content': mermaid_id, 'style_class_ref': None, 'subgraph_id': None}
+                self.pending_nodes[mermaid_id] = data
+                if len(self.pending_nodes) >= self.batch_size:
+                    self._flush_nodes()
+                    return self._on_node(mermaid_id, title, style_class_ref, subgraph)
+
+        if title is not None:
+            data['title'] = title
+            data['text_content'] = title
+        if style_class_ref is not None:
+            data['style_class_ref'] = style_class_ref
+        if subgraph is not None:
+            # Identifiant Mermaid du subgraph, résolu en id au moment de l'écriture
+            data['subgraph_id'] = subgraph
+            self.grouped_nodes.add(mermaid_id)
+
+    def _flush_subgraphs(self) -> None:
+        if not self.pending_subgraphs:
+            return
+        self.subgraph_id_map.update(_insert_returning_ids(Subgraph, list(self.pending_subgraphs.values()), self.batch_size))
+        self.pending_subgraphs.clear()
+
+    def _resolve_subgraph(self, rows: List[Dict]) -> List[Dict]:
+        self._flush_subgraphs()
+        for row in rows:
+            if row.get('subgraph_id') is not None:
+                row['subgraph_id'] = self.subgraph_id_map[row['subgraph_id']]
+        return rows
+
+    def _flush_nodes(self) -> None:
+        if not self.pending_nodes:
+            return
+        rows = self._resolve_subgraph(list(self.pending_nodes.values()))
+        self.node_id_map.update(_insert_nodes_returning_ids(rows, self.batch_size))
+        self.pending_nodes.clear()
+
+    def _flush_updates(self) -> None:
+        if not self.pending_updates:
+            return
+        db.session.execute(update(Node), self._resolve_subgraph(list(self.pending_updates.values())))
+        self.pending_updates.clear()
+
+    def _flush_relationships(self) -> None:
+        # Toutes les extrémités ont été vues avant la relation : on insère d'abord les nœuds en attente.
+        self._flush_nodes()
+        if not self.pending_relationships:
+            return
+        rows = [{
+            'subproject_id': self.subproject.id,
+            'source_node_id': self.node_id_map[rel['source']],
+            'target_node_id': self.node_id_map[rel['target']],
+            'label': rel['label'],
+            'link_type': rel['link_type'],
+            'color': None,
+        } for rel in self.pending_relationships]
+        db.session.execute(insert(Relationship), rows)
+        self.pending_relationships.clear()
+
+
+def import_mermaid_stream(lines: Iterable[str], project_title: str = "Graphe Importé", batch_size: Optional[int] = None) -> Project:
+    """
+    Importe un flowchart Mermaid lu ligne par ligne (corps de requête, fichier...) dans un nouveau SubProject.
+
+    Contrairement à parse_and_save_mermaid, le texte n'est jamais conservé en entier : les entités sont
+    écrites par lots au fur et à mesure de l'analyse, et la définition stockée est régénérée depuis
+    la base en fin d'import (les commentaires et la mise en forme d'origine ne sont donc pas conservés).
+    """
+    if batch_size is None:
+        batch_size = _import_batch_size()
+
+    try:
+        project = _ensure_project(project_title)
+        subproject = _find_or_create_subproject(project, "")
+        _StreamingImporter(subproject, batch_size).consume(lines)
+        # Écritures par le Core : la définition est régénérée depuis la base au commit
+        mark_stale(subproject.id)
+        db.session.commit()
+    except (IntegrityError, MermaidParsingError, NotFound, BadRequest) as e:
+        _handle_import_error(e)
+    except (UnicodeDecodeError, EOFError, OSError):
+        # Flux illisible : encodage invalide ou archive gzip corrompue/tronquée
+        db.session.rollback()
+        raise BadRequest("Flux Mermaid illisible : texte UTF-8, éventuellement compressé en gzip, attendu.")
+    except Exception as e:
+        db.session.rollback()
+        raise e
 
-    return project_read
\ No newline at end of file
+    return _get_project_with_subprojects(project.id)
@@ -0,0 +1,85 @@
+# backend/app/services/mermaid_render.py
+# Version 1.1
+"""
+Briques de rendu du code Mermaid partagées par le générateur, le cache de fragments, les exports
+et les fenêtres : mise en forme d'une ligne de nœud, d'un en-tête de subgraph et d'un lien, lecture
+de lignes par lots d'ids ou en flux par curseur côté serveur, regroupement des lignes en morceaux.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app import db
+from app.models import LinkType
+
+# Lectures par lots d'ids (clause IN bornée)
+ID_BATCH_SIZE = 1000
+# Export en flux : lignes lues par curseur côté serveur par lots de EXPORT_YIELD_PER,
+# envoyées par morceaux d'environ EXPORT_CHUNK_SIZE caractères
+EXPORT_YIELD_PER = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+RELATIONSHIP_LINK_MAP = {
+    LinkType.VISIBLE: "-->",
+    LinkType.INVISIBLE: "---",
+}
+
+
+def sanitize_title(title: str, default_id: str) -> str:
+    """Nettoie le titre pour l'affichage dans un nœud Mermaid (met entre guillemets si nécessaire)."""
+    if not title:
+        return default_id
+
+    # Échapper les guillemets internes si le titre est long
+    safe_title = title.replace('"', '#quot;')
+
+    # Si le titre contient des espaces ou des caractères spéciaux, le mettre entre guillemets
+    # Le titre d'un subgraph peut contenir des crochets, il faut les autoriser
+    if ' ' in title:
+        return f'"{safe_title}"'
+
+    return safe_title
+
+
+def node_line(mermaid_id: str, label: Optional[str]) -> str:
+    return f"    {mermaid_id}[{sanitize_title(label, mermaid_id)}]"
+
+
+def subgraph_header(mermaid_id: str, title: Optional[str]) -> str:
+    return f"subgraph {mermaid_id}[{sanitize_title(title, mermaid_id)}]"
+
+
+def relationship_line(source_id: str, target_id: str, link_type: LinkType, label: Optional[str]) -> str:
+    connector = RELATIONSHIP_LINK_MAP.get(link_type, "---")
+    label_part = f"|{label.replace('|', '/')}|" if label else ""
+    return f"{source_id}{connector}{label_part}{target_id}"
+
+
+def rows_by_id(statement, id_column, ids: Iterable[int], session=None) -> Dict[int, Tuple]:
+    """Exécute `statement` par lots d'ids (dans `session`, à défaut db.session) ; retourne {id: reste de la ligne}."""
+    session = session or db.session
+    ids = list(ids)
+    rows: Dict[int, Tuple] = {}
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        for row in session.execute(statement.where(id_column.in_(ids[start:start + ID_BATCH_SIZE]))):
+            rows[row[0]] = tuple(row[1:])
+    return rows
+
+
+def stream_rows(statement) -> Iterator:
+    """Exécute `statement` avec un curseur côté serveur : les lignes arrivent par lots de EXPORT_YIELD_PER."""
+    return iter(db.session.execute(statement, execution_options={'yield_per': EXPORT_YIELD_PER}))
+
+
+def join_chunks(lines: Iterable[str], chunk_size: int) -> Iterator[str]:
+    """Regroupe les lignes en morceaux d'environ `chunk_size` caractères (texte identique à '\\n'.join)."""
+    buffer: List[str] = []
+    size = 0
+    separator = ""
+    for line in lines:
+        buffer.append(line)
+        size += len(line) + 1
+        if size >= chunk_size:
+            yield separator + "\n".join(buffer)
+            separator, buffer, size = "\n", [], 0
+    if buffer:
+        yield separator + "\n".join(buffer)
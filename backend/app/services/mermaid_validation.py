@@ -0,0 +1,79 @@
+# backend/app/services/mermaid_validation.py
+# Version 1.1
+"""
+Validation « à blanc » d'un flowchart Mermaid : analyse seule, sans session ni connexion à la base,
+et sans passer par le cache d'analyse (chaque frappe de l'éditeur produit un texte différent).
+"""
+
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.services.mermaid_grammar import (
+    MermaidParsingError, ParseLimits, iter_flowchart_events,
+    EVENT_DIRECTION, EVENT_NODE, EVENT_NODE_CLASS, EVENT_EDGE, EVENT_CLASSDEF,
+    EVENT_SUBGRAPH_START, EVENT_SUBGRAPH_CLASS,
+)
+
+SEVERITY_ERROR = 'error'
+SEVERITY_WARNING = 'warning'
+
+
+def _diagnostic(severity: str, message: str, line: int, column: int) -> Dict[str, Any]:
+    return {'severity': severity, 'message': message, 'line': line, 'column': column}
+
+
+def validate_mermaid(mermaid_code: str, limits: Optional[ParseLimits] = None) -> Dict[str, Any]:
+    """
+    Analyse le code en mode diagnostic et retourne :
+    {valid, direction, diagnostics [{severity, message, line, column}], counts {...}, parse_ms}.
+    Toutes les erreurs de syntaxe sont rapportées (l'analyse reprend à la ligne suivante) ;
+    les classes appliquées sans classDef correspondant sont signalées en avertissement.
+    Un dépassement des budgets `limits` n'est pas un diagnostic : MermaidInputTooLarge est levée.
+    """
+    errors: List[MermaidParsingError] = []
+    direction = None
+    node_ids: Set[str] = set()
+    classdef_names: Set[str] = set()
+    subgraph_ids: Set[str] = set()
+    relationship_count = 0
+    class_applications: List[Tuple[int, str, str]] = []  # (ligne, cible, classe)
+
+    start = time.perf_counter()
+    for event in iter_flowchart_events(mermaid_code.split('\n'), errors, limits):
+        kind = event[0]
+        if kind == EVENT_NODE:
+            node_ids.add(event[2])
+        elif kind == EVENT_EDGE:
+            relationship_count += 1
+        elif kind == EVENT_NODE_CLASS:
+            node_ids.add(event[2])
+            class_applications.append((event[1], event[2], event[3]))
+        elif kind == EVENT_SUBGRAPH_CLASS:
+            class_applications.append((event[1], event[2], event[3]))
+        elif kind == EVENT_SUBGRAPH_START:
+            subgraph_ids.add(event[2])
+        elif kind == EVENT_CLASSDEF:
+            classdef_names.add(event[2])
+        elif kind == EVENT_DIRECTION:
+            direction = event[2]
+    parse_ms = (time.perf_counter() - start) * 1000
+
+    diagnostics = [_diagnostic(SEVERITY_ERROR, e.reason, e.line, e.column) for e in errors]
+    diagnostics.extend(
+        _diagnostic(SEVERITY_WARNING, f"Classe '{class_name}' appliquée à '{target}' sans classDef correspondant.", lineno, 1)
+        for lineno, target, class_name in class_applications if class_name not in classdef_names
+    )
+    diagnostics.sort(key=lambda d: (d['line'], d['column']))
+
+    return {
+        'valid': not errors,
+        'direction': direction,
+        'diagnostics': diagnostics,
+        'counts': {
+            'nodes': len(node_ids),
+            'relationships': relationship_count,
+            'classdefs': len(classdef_names),
+            'subgraphs': len(subgraph_ids),
+        },
+        'parse_ms': round(parse_ms, 3),
+    }
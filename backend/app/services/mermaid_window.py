@@ -0,0 +1,211 @@
+# backend/app/services/mermaid_window.py
+# Version 1.2
+"""
+Fenêtre Mermaid d'un SubProject : le sous-graphe induit autour d'un point de départ (nœuds nommés,
+membres d'un subgraph, nœuds d'une classe de style), étendu à `depth` liens dans les deux sens.
+
+Le voisinage est parcouru en largeur, couche par couche, par des requêtes sur les index de
+relationship (source_node_id, target_node_id) limitées à la frontière : le coût dépend de la taille
+de la fenêtre, pas de celle du graphe. Le code émis a la forme de celui du générateur ; chaque nœud
+extérieur relié à la fenêtre y apparaît comme un nœud d'amorce (classe STUB_CLASS_NAME) qui porte
+les liens sortants.
+
+La profondeur est bornée par MERMAID_WINDOW_MAX_DEPTH (côté route) et la taille de la fenêtre par
+MERMAID_WINDOW_MAX_NODES : une couche qui dépasserait ce budget n'est pas ajoutée, ses nœuds restent
+des amorces et le code porte la marque WINDOW_TRUNCATED_COMMENT.
+"""
+
+import hashlib
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from flask import current_app
+from sqlalchemy import func, or_
+from werkzeug.exceptions import BadRequest, NotFound
+
+from app import db
+from app.models import ClassDef, Node, Relationship, SubProject, Subgraph
+from app.services.mermaid_render import (
+    ID_BATCH_SIZE, node_line, relationship_line, rows_by_id, subgraph_header,
+)
+
+STUB_CLASS_NAME = 'windowStub'
+STUB_CLASS_DEFINITION = 'fill:#fff,stroke:#999,stroke-dasharray:4 4,color:#999'
+STUB_ID_PREFIX = 'stub_'
+WINDOW_TRUNCATED_COMMENT = "%% Window truncated"
+
+DEFAULT_WINDOW_MAX_DEPTH = 5
+DEFAULT_WINDOW_MAX_NODES = 5000
+
+
+class MermaidWindow(NamedTuple):
+    """Point de départ (au moins un critère) et profondeur d'une fenêtre."""
+    focus: Tuple[str, ...] = ()
+    depth: int = 1
+    subgraph: Optional[str] = None
+    style_class: Optional[str] = None
+
+    @property
+    def digest(self) -> str:
+        """Empreinte courte des paramètres (variante d'ETag)."""
+        return hashlib.sha256(repr(tuple(self)).encode('utf-8')).hexdigest()[:16]
+
+
+def stub_id(node_id: int, taken: Set[str]) -> str:
+    """Id Mermaid de l'amorce d'un nœud extérieur : dérivé de son id en base, distinct des ids `taken`."""
+    candidate = f"{STUB_ID_PREFIX}{node_id}"
+    while candidate in taken:
+        candidate = f"_{candidate}"
+    return candidate
+
+
+def window_max_nodes() -> int:
+    """Budget de nœuds d'une fenêtre configuré pour l'application courante (0 = illimité)."""
+    return current_app.config.get('MERMAID_WINDOW_MAX_NODES', DEFAULT_WINDOW_MAX_NODES)
+
+
+def _seed_node_ids(subproject_id: int, window: MermaidWindow) -> Set[int]:
+    """Nœuds de départ ; NotFound pour un nœud ou un subgraph inconnu."""
+    seeds: Set[int] = set()
+    if window.focus:
+        found = dict(db.session.execute(
+            db.select(Node.mermaid_id, Node.id)
+            .where(Node.subproject_id == subproject_id, Node.mermaid_id.in_(window.focus))
+        ).all())
+        missing = [mermaid_id for mermaid_id in window.focus if mermaid_id not in found]
+        if missing:
+            raise NotFound(f"Nœud(s) {', '.join(missing)} non trouvé(s) dans le SubProject ID {subproject_id}.")
+        seeds.update(found.values())
+    if window.subgraph is not None:
+        subgraph_id = db.session.scalar(
+            db.select(Subgraph.id).where(Subgraph.subproject_id == subproject_id, Subgraph.mermaid_id == window.subgraph)
+        )
+        if subgraph_id is None:
+            raise NotFound(f"Subgraph '{window.subgraph}' non trouvé dans le SubProject ID {subproject_id}.")
+        seeds.update(db.session.scalars(db.select(Node.id).where(Node.subgraph_id == subgraph_id)))
+    if window.style_class is not None:
+        seeds.update(db.session.scalars(
+            db.select(Node.id).where(Node.subproject_id == subproject_id, Node.style_class_ref == window.style_class)
+        ))
+    return seeds
+
+
+def _edges_touching(subproject_id: int, node_ids: List[int]) -> List[Tuple]:
+    """Liens (id, source, cible, type, libellé) dont une extrémité est dans `node_ids`, par lots d'ids."""
+    rows: List[Tuple] = []
+    for start in range(0, len(node_ids), ID_BATCH_SIZE):
+        batch = node_ids[start:start + ID_BATCH_SIZE]
+        rows.extend(db.session.execute(
+            db.select(Relationship.id, Relationship.source_node_id, Relationship.target_node_id,
+                      Relationship.link_type, Relationship.label)
+            .where(Relationship.subproject_id == subproject_id,
+                   or_(Relationship.source_node_id.in_(batch), Relationship.target_node_id.in_(batch)))
+        ).all())
+    return rows
+
+
+def collect_window(subproject_id: int, window: MermaidWindow,
+                   max_nodes: int = 0) -> Tuple[Set[int], Dict[int, Tuple], bool]:
+    """
+    Parcours en largeur depuis les nœuds de départ : retourne les nœuds de la fenêtre, les liens
+    (par id) dont au moins une extrémité est dans la fenêtre, et si le parcours a été tronqué. Les
+    liens de chaque nœud ne sont lus qu'une fois. Une couche qui porterait la fenêtre au-delà de
+    `max_nodes` (0 = illimité) n'est pas ajoutée ; BadRequest si les nœuds de départ le dépassent déjà.
+    """
+    window_ids = _seed_node_ids(subproject_id, window)
+    if max_nodes and len(window_ids) > max_nodes:
+        raise BadRequest(f"Requête invalide : la fenêtre part de {len(window_ids)} nœuds (maximum {max_nodes}).")
+    edges: Dict[int, Tuple] = {}
+    frontier = sorted(window_ids)
+    for hop in range(window.depth + 1):
+        if not frontier:
+            break
+        # Dernier tour : seuls les liens de la frontière sont lus (liens internes ou amorces)
+        neighbours: Set[int] = set()
+        for edge in _edges_touching(subproject_id, frontier):
+            edges[edge[0]] = edge[1:]
+            neighbours.update(edge[1:3])
+        if hop == window.depth:
+            break
+        frontier = sorted(neighbours - window_ids)
+        if max_nodes and len(window_ids) + len(frontier) > max_nodes:
+            return window_ids, edges, True
+        window_ids.update(frontier)
+    return window_ids, edges, False
+
+
+def generate_mermaid_window(subproject_id: int, window: MermaidWindow) -> str:
+    """
+    Code Mermaid de la fenêtre : nœuds et subgraphs de la fenêtre, classDefs utilisées, liens internes,
+    et liens vers l'extérieur rattachés à un nœud d'amorce par nœud extérieur. Lève NotFound si le
+    SubProject, un nœud de départ ou le subgraph n'existe pas.
+    """
+    graph_direction = db.session.scalar(db.select(SubProject.graph_direction).where(SubProject.id == subproject_id))
+    if graph_direction is None:
+        raise NotFound(f"SubProject ID {subproject_id} non trouvé.")
+
+    max_nodes = window_max_nodes()
+    window_ids, edges, truncated = collect_window(subproject_id, window, max_nodes)
+    nodes = rows_by_id(
+        db.select(Node.id, Node.mermaid_id, func.coalesce(Node.title, Node.text_content), Node.subgraph_id, Node.style_class_ref),
+        Node.id, window_ids,
+    )
+    outside_ids = {node_id for source, target, _, _ in edges.values() for node_id in (source, target)} - window_ids
+    outside = rows_by_id(db.select(Node.id, Node.mermaid_id), Node.id, outside_ids)
+    subgraphs = rows_by_id(
+        db.select(Subgraph.id, Subgraph.mermaid_id, Subgraph.title, Subgraph.style_class_ref),
+        Subgraph.id, {subgraph_id for _, _, subgraph_id, _ in nodes.values() if subgraph_id is not None},
+    )
+    class_names = {class_ref for *_, class_ref in list(nodes.values()) + list(subgraphs.values()) if class_ref}
+    class_defs = db.session.execute(
+        db.select(ClassDef.name, ClassDef.definition_raw)
+        .where(ClassDef.subproject_id == subproject_id, ClassDef.name.in_(class_names)).order_by(ClassDef.id)
+    ).all() if class_names else []
+
+    mermaid_ids = {node_id: row[0] for node_id, row in nodes.items()}
+    taken = set(mermaid_ids.values()) | {row[0] for row in subgraphs.values()}
+    stub_ids = {node_id: stub_id(node_id, taken) for node_id in outside}
+    mermaid_ids.update(stub_ids)
+
+    parts: List[str] = [f"graph {graph_direction}", ""]
+    if truncated:
+        parts.extend([f"{WINDOW_TRUNCATED_COMMENT} (max {max_nodes} nodes)", ""])
+    if class_defs or outside:
+        parts.append("%% Class Definitions")
+        parts.extend(f"classDef {name} {definition_raw}" for name, definition_raw in class_defs)
+        if outside:
+            parts.append(f"classDef {STUB_CLASS_NAME} {STUB_CLASS_DEFINITION}")
+        parts.append("")
+
+    parts.append("%% Nodes & Subgraphs Definitions")
+    nodes_by_subgraph: Dict[Optional[int], List[Tuple[str, Optional[str]]]] = defaultdict(list)
+    for node_id in sorted(nodes):
+        mermaid_id, label, subgraph_id, _ = nodes[node_id]
+        nodes_by_subgraph[subgraph_id].append((mermaid_id, label))
+    parts.extend(node_line(mermaid_id, label) for mermaid_id, label in nodes_by_subgraph.get(None, ()))
+    for subgraph_id in sorted(subgraphs):
+        mermaid_id, title, _ = subgraphs[subgraph_id]
+        parts.append(subgraph_header(mermaid_id, title))
+        parts.extend(node_line(node_mermaid_id, label) for node_mermaid_id, label in nodes_by_subgraph[subgraph_id])
+        parts.extend(["end", ""])
+    parts.append("")
+
+    if outside:
+        parts.append("%% Window Stubs")
+        for node_id in sorted(outside):
+            parts.append(node_line(stub_ids[node_id], f"{outside[node_id][0]} …"))
+        parts.append("")
+
+    parts.append("%% Class Applications")
+    parts.extend(f"class {nodes[node_id][0]} {nodes[node_id][3]}" for node_id in sorted(nodes) if nodes[node_id][3])
+    parts.extend(f"class {subgraphs[subgraph_id][0]} {subgraphs[subgraph_id][2]}"
+                 for subgraph_id in sorted(subgraphs) if subgraphs[subgraph_id][2])
+    parts.extend(f"class {stub_ids[node_id]} {STUB_CLASS_NAME}" for node_id in sorted(outside))
+    parts.append("")
+
+    parts.append("%% Relationships")
+    for edge_id in sorted(edges):
+        source, target, link_type, label = edges[edge_id]
+        if source in mermaid_ids and target in mermaid_ids:
+            parts.append(relationship_line(mermaid_ids[source], mermaid_ids[target], link_type, label))
+    return "\n".join(parts)
@@ -1,5 +1,5 @@
 # backend/app/services/nodes.py
-# Version 1.3
+# Version 1.5
 
 from typing import List, Optional, Dict, Any
 from werkzeug.exceptions import NotFound, BadRequest
@@ -9,7 +9,6 @@ from sqlalchemy import update
 from app import db
 from app.models import Node, SubProject, Relationship, ClassDef
 from app.schemas import NodeCreate, RelationshipCreate
-from app.services.mermaid_generator import generate_mermaid_from_subproject
 
 
 # --- Services pour Node ---
@@ -31,7 +30,7 @@ def get_node_by_id(node_id: int) -> Node:
 
 
 def create_node(data: NodeCreate) -> Node:
-    """Crée un nouveau nœud et met à jour la définition Mermaid du subproject."""
+    """Crée un nouveau nœud ; la définition Mermaid du subproject est régénérée au commit."""
     subproject = db.session.get(SubProject, data.subproject_id)
     if subproject is None:
         raise NotFound(f"SubProject with ID {data.subproject_id} not found.")
@@ -49,12 +48,6 @@ def create_node(data: NodeCreate) -> Node:
 
     try:
         db.session.add(node)
-        # Flush pour que le nouveau nœud soit visible par le générateur
-        db.session.flush()
-
-        # Régénérer et mettre à jour la définition Mermaid du subproject
-        subproject.mermaid_definition = generate_mermaid_from_subproject(subproject.id)
-
         db.session.commit()
         db.session.refresh(node)
     except IntegrityError:
@@ -65,9 +58,11 @@ def create_node(data: NodeCreate) -> Node:
 
 
 def update_node(node_id: int, data: NodeCreate) -> Node:
-    """Met à jour un nœud existant et met à jour la définition Mermaid du subproject."""
+    """
+    Met à jour un nœud existant. La définition Mermaid du subproject (et de l'ancien, si le nœud
+    a été déplacé) est régénérée une seule fois au commit.
+    """
     node = get_node_by_id(node_id)
-    original_subproject_id = node.subproject_id
 
     if data.subproject_id != node.subproject_id:
         new_subproject = db.session.get(SubProject, data.subproject_id)
@@ -84,21 +79,6 @@ def update_node(node_id: int, data: NodeCreate) -> Node:
     node.style_class_ref = data.style_class_ref
 
     try:
-        # Flush pour que les modifications du nœud soient visibles par le générateur
-        db.session.flush()
-
-        # Régénérer la définition pour le subproject concerné
-        subproject = db.session.get(SubProject, original_subproject_id)
-        if subproject:
-            subproject.mermaid_definition = generate_mermaid_from_subproject(subproject.id)
-
-        # Si le nœud a été déplacé, l'ancien subproject doit aussi être mis à jour
-        if data.subproject_id != original_subproject_id:
-            old_subproject = db.session.get(SubProject, original_subproject_id)
-            if old_subproject:
-                old_subproject.mermaid_definition = generate_mermaid_from_subproject(old_subproject.id)
-
-
         db.session.commit()
         db.session.refresh(node)
     except IntegrityError:
@@ -111,7 +91,7 @@ def update_node(node_id: int, data: NodeCreate) -> Node:
 def update_node_style(node_id: int, style_name: Optional[str]) -> Node:
     """
     Applique ou retire une référence de style (ClassDef) à un nœud.
-    Déclenche la régénération Mermaid (AC 2.7).
+    La régénération Mermaid (AC 2.7) a lieu au commit.
     """
     node = get_node_by_id(node_id)
     subproject_id = node.subproject_id # ID du subproject parent
@@ -130,13 +110,7 @@ def update_node_style(node_id: int, style_name: Optional[str]) -> Node:
     node.style_class_ref = style_name
 
     try:
-        # 3. Cohérence (AC 2.7) : Régénération Mermaid
-        db.session.flush() # Assure que la modification du nœud est visible
-
-        subproject = db.session.get(SubProject, subproject_id)
-        if subproject:
-            subproject.mermaid_definition = generate_mermaid_from_subproject(subproject_id)
-
+        # 3. Cohérence (AC 2.7) : la définition Mermaid est régénérée au commit
         db.session.commit()
         db.session.refresh(node)
     except IntegrityError:
@@ -149,22 +123,14 @@ def update_node_style(node_id: int, style_name: Optional[str]) -> Node:
 def delete_node(node_id: int) -> bool:
     """Supprime un nœud par ID. Lève 404 si non trouvé."""
     node = get_node_by_id(node_id)
-    subproject_id = node.subproject_id # Garder l'ID avant la suppression
-
     db.session.delete(node)
-
-    # Régénération après la suppression
-    subproject = db.session.get(SubProject, subproject_id)
-    if subproject:
-        subproject.mermaid_definition = generate_mermaid_from_subproject(subproject_id)
-
     db.session.commit()
     return True
 
 def import_node_content(subproject_id: int, content_map: Dict[str, str]) -> Dict[str, Any]:
     """
     Importe en masse le contenu textuel pour les nœuds d'un subproject.
-    Cette opération est transactionnelle et met à jour la définition Mermaid.
+    Cette opération est transactionnelle ; la définition Mermaid est régénérée au commit.
 
     Accepte les clés du content_map soit comme IDs numériques (ex: "1136")
     soit comme mermaid_id (ex: "A001").
@@ -228,12 +194,6 @@ def import_node_content(subproject_id: int, content_map: Dict[str, str]) -> Dict
 
         ignored_ids = list(set(content_map.keys()) - updated_keys)
 
-        # Mettre à jour la définition Mermaid du SubProject
-        # `flush` s'assure que les modifications sont envoyées à la BD avant la génération
-        db.session.flush()
-        new_mermaid_def = generate_mermaid_from_subproject(subproject_id)
-        subproject.mermaid_definition = new_mermaid_def
-
         db.session.commit()
 
         return {
@@ -1,17 +1,20 @@
 # backend/app/services/projects.py
-# Version 1.0
+# Version 1.1
 
 from typing import List
 from sqlalchemy.orm import selectinload
 from werkzeug.exceptions import NotFound, BadRequest
 from app import db
-from app.models import Project
+from app.models import Project, SubProject
 from app.schemas import ProjectCreate, ProjectRead
 
+# Les SubProjects en cours d'import par tranches (non publiés) ne sont pas listés
+_PUBLISHED_SUBPROJECTS = selectinload(Project.subprojects.and_(SubProject.import_checkpoint.is_(None)))
+
 def get_all_projects() -> List[Project]:
     """Récupère tous les projets de la base de données."""
     projects = db.session.execute(
-        db.select(Project).options(selectinload(Project.subprojects))
+        db.select(Project).options(_PUBLISHED_SUBPROJECTS)
     ).scalars().all()
     return list(projects)
 
@@ -19,7 +22,7 @@ def get_project_by_id(project_id: int) -> Project:
     """Récupère un projet spécifique par son ID."""
     project = db.session.execute(
         db.select(Project)
-        .options(selectinload(Project.subprojects))
+        .options(_PUBLISHED_SUBPROJECTS)
         .filter_by(id=project_id)
     ).scalar_one_or_none()
 
@@ -66,7 +69,10 @@ def update_project(project_id: int, project_data: ProjectCreate) -> Project:
 
 def delete_project(project_id: int) -> None:
     """Supprime un projet existant."""
-    project = get_project_by_id(project_id)
+    # Sans le filtre de get_project_by_id : la cascade doit aussi supprimer les imports non publiés
+    project = db.session.get(Project, project_id)
+    if project is None:
+        raise NotFound(f"Project ID {project_id} not found.")
 
     db.session.delete(project)
     db.session.commit()
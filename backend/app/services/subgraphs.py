@@ -1,5 +1,5 @@
 # backend/app/services/subgraphs.py
-# Version 1.0
+# Version 1.3
 
 import secrets
 import string
@@ -12,7 +12,7 @@ from sqlalchemy.exc import IntegrityError
 from app import db
 from app.models import Subgraph, SubProject, Node, ClassDef
 from app.schemas import SubgraphCreatePayload, SubgraphUpdatePayload
-from app.services.mermaid_generator import generate_mermaid_from_subproject
+from app.services.mermaid_fragment_cache import mark_stale
 
 def _generate_unique_mermaid_id(subproject_id: int) -> str:
     """Génère un ID Mermaid unique pour un Subgraph au sein d'un SubProject."""
@@ -50,6 +50,7 @@ def _bulk_assign_nodes(subproject_id: int, subgraph_id: int, node_ids: List[int]
         .where(Node.id.in_(node_ids))
         .values(subgraph_id=subgraph_id)
     )
+    mark_stale(subproject_id, nodes=node_ids)
 
 def _bulk_unassign_nodes(subproject_id: int, node_ids: List[int]) -> None:
     """Met à jour en masse le subgraph_id à NULL pour une liste de nœuds."""
@@ -72,6 +73,7 @@ def _bulk_unassign_nodes(subproject_id: int, node_ids: List[int]) -> None:
         .where(Node.id.in_(node_ids))
         .values(subgraph_id=None)
     )
+    mark_stale(subproject_id, nodes=node_ids)
 
 def get_subgraph_by_id(subgraph_id: int) -> Subgraph:
     """Récupère un subgraph par ID avec ses nœuds."""
@@ -83,7 +85,7 @@ def get_subgraph_by_id(subgraph_id: int) -> Subgraph:
     return subgraph
 
 def create_subgraph(data: SubgraphCreatePayload) -> Subgraph:
-    """Crée un Subgraph, lui assigne des nœuds, et régénère le Mermaid."""
+    """Crée un Subgraph et lui assigne des nœuds ; le Mermaid est régénéré au commit."""
     subproject = db.session.get(SubProject, data.subproject_id)
     if not subproject:
         raise NotFound(f"SubProject with ID {data.subproject_id} not found.")
@@ -110,7 +112,6 @@ def create_subgraph(data: SubgraphCreatePayload) -> Subgraph:
         if data.node_ids:
             _bulk_assign_nodes(data.subproject_id, new_subgraph.id, data.node_ids)
 
-        subproject.mermaid_definition = generate_mermaid_from_subproject(data.subproject_id)
         db.session.commit()
         db.session.refresh(new_subgraph)
         return get_subgraph_by_id(new_subgraph.id)
@@ -119,7 +120,7 @@ def create_subgraph(data: SubgraphCreatePayload) -> Subgraph:
         raise BadRequest(f"Failed to create subgraph: {e}")
 
 def update_subgraph(subgraph_id: int, data: SubgraphUpdatePayload) -> Subgraph:
-    """Met à jour les métadonnées d'un Subgraph et régénère le Mermaid."""
+    """Met à jour les métadonnées d'un Subgraph ; le Mermaid est régénéré au commit."""
     subgraph = get_subgraph_by_id(subgraph_id)
     subproject_id = subgraph.subproject_id
 
@@ -134,9 +135,6 @@ def update_subgraph(subgraph_id: int, data: SubgraphUpdatePayload) -> Subgraph:
     subgraph.style_class_ref = data.style_class_ref
 
     try:
-        subproject = db.session.get(SubProject, subproject_id)
-        if subproject:
-             subproject.mermaid_definition = generate_mermaid_from_subproject(subproject_id)
         db.session.commit()
         return get_subgraph_by_id(subgraph_id)
     except Exception as e:
@@ -149,9 +147,6 @@ def assign_nodes_to_subgraph(subgraph_id: int, node_ids: List[int]) -> Subgraph:
     subproject_id = subgraph.subproject_id
     try:
         _bulk_assign_nodes(subproject_id, subgraph_id, node_ids)
-        subproject = db.session.get(SubProject, subproject_id)
-        if subproject:
-             subproject.mermaid_definition = generate_mermaid_from_subproject(subproject_id)
         db.session.commit()
         return get_subgraph_by_id(subgraph_id)
     except Exception as e:
@@ -173,9 +168,6 @@ def unassign_nodes_from_subgraph(subgraph_id: int, node_ids: List[int]) -> Subgr
 
     try:
         _bulk_unassign_nodes(subproject_id, node_ids)
-        subproject = db.session.get(SubProject, subproject_id)
-        if subproject:
-            subproject.mermaid_definition = generate_mermaid_from_subproject(subproject_id)
         db.session.commit()
         return get_subgraph_by_id(subgraph_id)
     except Exception as e:
@@ -185,7 +177,6 @@ def unassign_nodes_from_subgraph(subgraph_id: int, node_ids: List[int]) -> Subgr
 def delete_subgraph(subgraph_id: int) -> None:
     """Supprime un subgraph après avoir désassigné tous ses nœuds."""
     subgraph = get_subgraph_by_id(subgraph_id)
-    subproject_id = subgraph.subproject_id
 
     try:
         # Désassigner tous les nœuds du subgraph
@@ -196,11 +187,6 @@ def delete_subgraph(subgraph_id: int) -> None:
         )
 
         db.session.delete(subgraph)
-
-        subproject = db.session.get(SubProject, subproject_id)
-        if subproject:
-            subproject.mermaid_definition = generate_mermaid_from_subproject(subproject_id)
-
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -1,14 +1,17 @@
 # backend/app/services/subprojects.py
-# Version 2.1
+# Version 2.10
 
 from typing import List, Optional
+from flask import current_app
 from sqlalchemy.orm import selectinload
-from werkzeug.exceptions import NotFound, BadRequest
+from werkzeug.exceptions import NotFound, BadRequest, RequestEntityTooLarge
 
 from app import db
 from app.models import SubProject, Project, Subgraph
 from app.schemas import SubProjectCreate, SubProjectMetadataUpdate
-from app.services.mermaid_parser import synchronize_subproject_entities
+from app.services.mermaid_parser import (
+    synchronize_subproject_entities, populate_new_subproject, compute_structure_hash, get_source_map, get_structure_hash,
+)
 
 def _get_project_or_404(project_id: int) -> Project:
     """Vérifie l'existence d'un projet et le retourne, sinon lève une exception NotFound."""
@@ -17,6 +20,40 @@ def _get_project_or_404(project_id: int) -> Project:
         raise NotFound(f"Project with ID {project_id} not found.")
     return project
 
+def _check_title_available(subproject: SubProject, title: str) -> None:
+    """Vérifie l'unicité du titre dans le projet si celui-ci change, sinon lève BadRequest."""
+    if subproject.title == title:
+        return
+    existing_subproject = db.session.execute(
+        db.select(SubProject).filter(
+            SubProject.id != subproject.id,
+            SubProject.project_id == subproject.project_id,
+            SubProject.title == title
+        )
+    ).scalar_one_or_none()
+    if existing_subproject:
+        raise BadRequest(f"A subproject with title '{title}' already exists in this project.")
+
+def get_subproject_version(subproject_id: int) -> int:
+    """
+    Version d'un SubProject publié : une seule ligne est lue, sans toucher aux nœuds ni aux relations.
+    Lève NotFound si le SubProject n'existe pas.
+    """
+    version = db.session.scalar(
+        db.select(SubProject.version).where(SubProject.id == subproject_id, SubProject.import_checkpoint.is_(None))
+    )
+    if version is None:
+        raise NotFound(f"SubProject with ID {subproject_id} not found.")
+    return version
+
+def subproject_etag(subproject_id: int, version: int, variant: Optional[str] = None) -> str:
+    """ETag fort d'une version de SubProject ; `variant` distingue les représentations (format d'export)."""
+    return f"sp{subproject_id}-v{version}" + (f".{variant}" if variant else "")
+
+def get_subproject_etag(subproject_id: int) -> str:
+    """ETag fort de la version courante d'un SubProject publié (NotFound sinon)."""
+    return subproject_etag(subproject_id, get_subproject_version(subproject_id))
+
 def get_all_subprojects(project_id: Optional[int] = None) -> List[SubProject]:
     """Récupère tous les sous-projets, optionnellement filtrés par project_id."""
     query = db.select(SubProject).options(
@@ -24,7 +61,7 @@ def get_all_subprojects(project_id: Optional[int] = None) -> List[SubProject]:
         selectinload(SubProject.relationships), # type: ignore[arg-type]
         selectinload(SubProject.class_defs), # type: ignore[arg-type]
         selectinload(SubProject.subgraphs).options(selectinload(Subgraph.nodes)) # type: ignore[arg-type]
-    ).order_by(SubProject.id)
+    ).where(SubProject.import_checkpoint.is_(None)).order_by(SubProject.id) # Imports par tranches non publiés exclus
 
     if project_id:
         query = query.filter_by(project_id=project_id)
@@ -40,7 +77,7 @@ def get_subproject_by_id(subproject_id: int) -> SubProject:
             selectinload(SubProject.relationships), # type: ignore[arg-type]
             selectinload(SubProject.class_defs), # type: ignore[arg-type]
             selectinload(SubProject.subgraphs).options(selectinload(Subgraph.nodes)) # type: ignore[arg-type]
-        ).filter_by(id=subproject_id)
+        ).filter_by(id=subproject_id, import_checkpoint=None)
     ).scalar_one_or_none()
 
     if subproject is None:
@@ -70,7 +107,10 @@ def create_subproject(subproject_data: SubProjectCreate) -> SubProject:
     db.session.flush()
 
     try:
-        synchronize_subproject_entities(new_subproject, new_subproject.mermaid_definition)
+        populate_new_subproject(new_subproject, new_subproject.mermaid_definition)
+    except RequestEntityTooLarge:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         raise BadRequest(f"Failed to parse and synchronize Mermaid definition on create: {e}")
@@ -83,27 +123,53 @@ def update_subproject_structure(subproject_id: int, data: SubProjectCreate) -> S
     """Met à jour UNIQUEMENT la structure Mermaid (recrée les nœuds/relations)."""
     subproject = get_subproject_by_id(subproject_id)
 
-    # Vérifier l'unicité du titre si changé
-    if subproject.title != data.title:
-        existing_subproject = db.session.execute(
-            db.select(SubProject).filter(
-                SubProject.id != subproject_id,
-                SubProject.project_id == subproject.project_id,
-                SubProject.title == data.title
-            )
-        ).scalar_one_or_none()
-        if existing_subproject:
-            raise BadRequest(f"A subproject with title '{data.title}' already exists in this project.")
+    _check_title_available(subproject, data.title)
 
     subproject.title = data.title
     subproject.mermaid_definition = data.mermaid_definition
     subproject.visual_layout = data.visual_layout
 
     try:
-        synchronize_subproject_entities(subproject, subproject.mermaid_definition)
+        changes = synchronize_subproject_entities(subproject, subproject.mermaid_definition)
+    except RequestEntityTooLarge:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         raise BadRequest(f"Failed to synchronize Mermaid structure: {e}")
+    current_app.logger.debug("Synchronisation du SubProject %s : %s", subproject_id, changes)
+
+    db.session.commit()
+    return get_subproject_by_id(subproject_id)
+
+
+def is_structure_unchanged(subproject: SubProject, mermaid_definition: str) -> bool:
+    """
+    Indique si le nouveau texte Mermaid décrit exactement la structure déjà synchronisée
+    (seuls espaces, commentaires ou ordre des lignes diffèrent).
+    Lève MermaidParsingError si le nouveau texte est invalide.
+    """
+    structure_hash = get_structure_hash(subproject)
+    if structure_hash is None:
+        return False
+    return compute_structure_hash(mermaid_definition) == structure_hash
+
+def update_subproject_text(subproject_id: int, data: SubProjectCreate) -> SubProject:
+    """
+    Met à jour le texte Mermaid, le titre et le layout d'un sous-projet dont la structure est inchangée :
+    un seul UPDATE, sans resynchroniser les nœuds/relations.
+    """
+    subproject = get_subproject_by_id(subproject_id)
+    _check_title_available(subproject, data.title)
+
+    structure_hash = subproject.structure_hash
+    subproject.title = data.title
+    subproject.mermaid_definition = data.mermaid_definition
+    subproject.visual_layout = data.visual_layout
+    # L'assignation de la définition invalide l'empreinte : elle est restaurée puisque la structure est identique.
+    # Les lignes ont pu bouger : la carte des sources est recalculée (analyse déjà en cache).
+    subproject.structure_hash = structure_hash
+    get_source_map(subproject)
 
     db.session.commit()
     return get_subproject_by_id(subproject_id)
@@ -113,17 +179,7 @@ def update_subproject_metadata(subproject_id: int, data: SubProjectMetadataUpdat
     """Met à jour UNIQUEMENT les métadonnées (title + layout) sans toucher aux nœuds."""
     subproject = get_subproject_by_id(subproject_id)
 
-    # Vérifier l'unicité du titre si changé
-    if subproject.title != data.title:
-        existing_subproject = db.session.execute(
-            db.select(SubProject).filter(
-                SubProject.id != subproject_id,
-                SubProject.project_id == subproject.project_id,
-                SubProject.title == data.title
-            )
-        ).scalar_one_or_none()
-        if existing_subproject:
-            raise BadRequest(f"A subproject with title '{data.title}' already exists in this project.")
+    _check_title_available(subproject, data.title)
 
     subproject.title = data.title
     subproject.visual_layout = data.visual_layout
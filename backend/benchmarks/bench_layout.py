@@ -0,0 +1,65 @@
+# backend/benchmarks/bench_layout.py
+# Version 1.0
+"""
+Banc d'essai du layout automatique en couches (compute_layered_layout) sur des graphes de récit :
+un fil principal où chaque nœud mène à l'un des trois suivants, des embranchements vers l'avant,
+quelques retours en arrière (cycles), un nœud sur deux réparti dans des subgraphs de 50 nœuds.
+
+Pour chaque taille : temps de calcul, nombre de couches, croisements restants et dimensions du
+layout. Le calcul est une fonction pure : c'est le coût payé par un processus du LayoutWorker,
+hors requête, une seule fois par structure.
+
+Usage (depuis backend/) :
+    python benchmarks/bench_layout.py                             # 1k, 3k et 10k nœuds
+    python benchmarks/bench_layout.py --sizes 3000 --direction LR
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.mermaid_layout import LayoutInput, compute_layered_layout  # noqa: E402
+
+DEFAULT_SIZES = (1_000, 3_000, 10_000)
+
+
+def _story_graph(size: int, direction: str, seed: int) -> LayoutInput:
+    """Graphe de récit reproductible de `size` nœuds."""
+    rng = random.Random(seed)
+    edges = [(i, min(size - 1, i + rng.randint(1, 3))) for i in range(size - 1)]
+    edges.extend((i, min(size - 1, i + rng.randint(4, 60))) for i in rng.sample(range(size), size // 5))
+    edges.extend((i, max(0, i - rng.randint(1, 30))) for i in rng.sample(range(size), size // 20))
+    return LayoutInput(
+        direction,
+        [f"n{i}" for i in range(size)],
+        [i // 100 if i % 2 else None for i in range(size)],
+        [f"G{c}" for c in range(size // 100 + 1)],
+        edges,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--direction', default='TD', choices=['TD', 'TB', 'BT', 'LR', 'RL'])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'nœuds':>8} | {'liens':>7} | {'temps (s)':>9} | {'couches':>7} | {'croisements':>11} | {'taille (px)':>15}")
+    for size in args.sizes:
+        layout_input = _story_graph(size, args.direction, args.seed)
+        start = time.perf_counter()
+        layout = compute_layered_layout(layout_input)
+        seconds = time.perf_counter() - start
+        layers = len({tuple(position)[1 if args.direction in ('TD', 'TB', 'BT') else 0]
+                      for position in layout['nodes'].values()})
+        print(f"{size:>8} | {len(layout_input.edges):>7} | {seconds:>9.3f} | {layers:>7} | "
+              f"{layout['crossings']:>11} | {layout['width']:>7}x{layout['height']:<7}")
+
+
+if __name__ == '__main__':
+    main()
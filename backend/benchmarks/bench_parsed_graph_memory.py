@@ -0,0 +1,118 @@
+# backend/benchmarks/bench_parsed_graph_memory.py
+# Version 1.0
+"""
+Banc d'essai mémoire du résultat d'analyse Mermaid.
+
+Compare, avec tracemalloc, l'ancienne représentation (un dictionnaire par nœud et par relation,
+reconstruite ici à partir des mêmes événements de l'analyseur) au ParsedGraph en colonnes
+retourné par parse_flowchart : mémoire retenue par le résultat et pic pendant l'analyse.
+
+Usage (depuis backend/) :
+    python benchmarks/bench_parsed_graph_memory.py                  # 10k et 100k liens
+    python benchmarks/bench_parsed_graph_memory.py --sizes 100000 500000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.mermaid_grammar import (  # noqa: E402
+    EVENT_CLASSDEF, EVENT_DIRECTION, EVENT_EDGE, EVENT_NODE, EVENT_NODE_CLASS, EVENT_SUBGRAPH_START,
+    iter_flowchart_events, parse_flowchart,
+)
+
+DEFAULT_SIZES = (10_000, 100_000)
+
+
+def _parse_as_dicts(lines: List[str]) -> Tuple:
+    """Ancienne agrégation : {mermaid_id: {title, text_content, style_class_ref}} et une liste de dicts par lien."""
+    graph_direction = "TD"
+    classdefs_data: Dict[str, str] = {}
+    nodes_data: Dict[str, Dict] = {}
+    relationships_data: List[Dict] = []
+    subgraphs_grouping: Dict[str, List[str]] = {}
+    node_subgraph: Dict[str, str] = {}
+    for event in iter_flowchart_events(lines):
+        kind = event[0]
+        if kind == EVENT_NODE:
+            _, _, mermaid_id, title, subgraph_id = event
+            data = nodes_data.get(mermaid_id)
+            if data is None:
+                nodes_data[mermaid_id] = {
+                    'title': title,
+                    'text_content': title if title is not None else mermaid_id,
+                    'style_class_ref': None,
+                }
+            elif title is not None:
+                data['title'] = title
+                data['text_content'] = title
+            if subgraph_id is not None and mermaid_id not in node_subgraph:
+                node_subgraph[mermaid_id] = subgraph_id
+                subgraphs_grouping.setdefault(subgraph_id, []).append(mermaid_id)
+        elif kind == EVENT_EDGE:
+            _, _, source, target, label, link_type = event
+            relationships_data.append({'source': source, 'target': target, 'label': label, 'link_type': link_type})
+        elif kind == EVENT_NODE_CLASS:
+            _, _, mermaid_id, class_name = event
+            data = nodes_data.get(mermaid_id)
+            if data is None:
+                nodes_data[mermaid_id] = {'title': None, 'text_content': mermaid_id, 'style_class_ref': class_name}
+            else:
+                data['style_class_ref'] = class_name
+        elif kind == EVENT_SUBGRAPH_START:
+            subgraphs_grouping.setdefault(event[2], [])
+        elif kind == EVENT_CLASSDEF:
+            classdefs_data[event[2]] = event[3]
+        elif kind == EVENT_DIRECTION:
+            graph_direction = event[2]
+    return graph_direction, classdefs_data, nodes_data, relationships_data, subgraphs_grouping
+
+
+def _diagram(edges: int) -> List[str]:
+    """Graphe réaliste : un nœud sur deux titré, un lien sur cinq étiqueté, des classes appliquées."""
+    nodes = max(edges // 2, 2)
+    lines = ["graph TD", "classDef hot fill:#f00"]
+    lines.extend(f"n{i}[Étape {i}]" for i in range(0, nodes, 2))
+    for i in range(edges):
+        source, target = i % nodes, (i * 7 + 1) % nodes
+        lines.append(f"n{source} -->|lien {i}| n{target}" if i % 5 == 0 else f"n{source} --> n{target}")
+    lines.extend(f"class n{i} hot" for i in range(0, nodes, 10))
+    return lines
+
+
+def _measure(parse: Callable[[List[str]], object], lines: List[str]) -> Tuple[float, float, float]:
+    """Retourne (Mo retenus par le résultat, Mo au pic, secondes)."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = parse(lines)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained / 1e6, peak / 1e6, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    args = parser.parse_args()
+
+    print(f"{'liens':>8} | {'représentation':<14} | {'retenu (Mo)':>11} | {'pic (Mo)':>8} | {'temps (s)':>9}")
+    for size in args.sizes:
+        lines = _diagram(size)
+        dicts = _measure(_parse_as_dicts, lines)
+        columns = _measure(parse_flowchart, lines)
+        for name, (retained, peak, elapsed) in (('dictionnaires', dicts), ('ParsedGraph', columns)):
+            print(f"{size:>8} | {name:<14} | {retained:>11.1f} | {peak:>8.1f} | {elapsed:>9.2f}")
+        print(f"{'':>8} | {'gain':<14} | {dicts[0] / columns[0]:>10.1f}x | {dicts[1] / columns[1]:>7.1f}x |")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""Add auto_layout to subproject
+
+Revision ID: a7d3e9c5f2b8
+Revises: f2a6c8d4b7e1
+Create Date: 2026-10-18 21:14:09.402517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e9c5f2b8'
+down_revision = 'f2a6c8d4b7e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Les layouts automatiques sont recalculés à la demande : la colonne part vide.
+    with op.batch_alter_table('subproject', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('auto_layout', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('subproject', schema=None) as batch_op:
+        batch_op.drop_column('auto_layout')
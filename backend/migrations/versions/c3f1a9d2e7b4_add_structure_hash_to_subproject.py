@@ -0,0 +1,28 @@
+"""Add structure_hash to subproject
+
+Revision ID: c3f1a9d2e7b4
+Revises: 411342cce6d6
+Create Date: 2026-10-18 10:12:41.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a9d2e7b4'
+down_revision = '411342cce6d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Les sous-projets existants gardent une empreinte NULL : leur prochaine mise à jour
+    # structurelle passe par une synchronisation complète qui la renseigne.
+    with op.batch_alter_table('subproject', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('structure_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('subproject', schema=None) as batch_op:
+        batch_op.drop_column('structure_hash')
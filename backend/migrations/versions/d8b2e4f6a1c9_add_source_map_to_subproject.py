@@ -0,0 +1,27 @@
+"""Add source_map to subproject
+
+Revision ID: d8b2e4f6a1c9
+Revises: c3f1a9d2e7b4
+Create Date: 2026-10-18 14:03:27.518342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8b2e4f6a1c9'
+down_revision = 'c3f1a9d2e7b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NULL pour les sous-projets existants : la carte est recalculée depuis le texte à la première lecture.
+    with op.batch_alter_table('subproject', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('source_map', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('subproject', schema=None) as batch_op:
+        batch_op.drop_column('source_map')
@@ -0,0 +1,27 @@
+"""Add import_checkpoint to subproject
+
+Revision ID: e4c7a2f9b1d3
+Revises: d8b2e4f6a1c9
+Create Date: 2026-10-18 16:21:05.734120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4c7a2f9b1d3'
+down_revision = 'd8b2e4f6a1c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NULL pour les sous-projets existants : ils sont publiés.
+    with op.batch_alter_table('subproject', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('import_checkpoint', sa.JSON(none_as_null=True), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('subproject', schema=None) as batch_op:
+        batch_op.drop_column('import_checkpoint')
@@ -0,0 +1,27 @@
+"""Add version to subproject
+
+Revision ID: f2a6c8d4b7e1
+Revises: e4c7a2f9b1d3
+Create Date: 2026-10-18 19:02:41.518307
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a6c8d4b7e1'
+down_revision = 'e4c7a2f9b1d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Les sous-projets existants partent de la version 1.
+    with op.batch_alter_table('subproject', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('subproject', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -1,11 +1,22 @@
 # backend/tests/test_mermaid.py
 # Version 1.0
 
+import gzip
+import io
+import pickle
+import tarfile
 import pytest
 import json
-from app.models import Project, SubProject, Node, Relationship, ClassDef, LinkType
-from app.services.mermaid_parser import parse_and_save_mermaid # For setting up data manually if needed
-from app.services.mermaid_generator import generate_mermaid_from_subproject # For verifying generated output
+from app.models import Project, SubProject, Node, Relationship, ClassDef, LinkType, Subgraph
+from app.services.mermaid_parser import parse_and_save_mermaid, synchronize_subproject_entities, _parse_mermaid_elements, compute_structure_hash # For setting up data manually if needed
+from app.services.mermaid_grammar import (
+    MermaidInputTooLarge, MermaidParsingError, ParseLimits, new_source_map, parse_flowchart,
+)
+from app.services.mermaid_parse_cache import MermaidParseCache
+from app.services.mermaid_bulk_loader import encode_copy_rows
+from app.services.mermaid_bulk_import import bulk_import_mermaid
+from app.services.mermaid_validation import validate_mermaid
+from app.services.mermaid_generator import generate_mermaid_from_subproject, generate_mermaid_document # For verifying generated output
 
 # Base URL pour les endpoints Mermaid
 MERMAID_IMPORT_URL = '/api/mermaid/import'
@@ -146,6 +157,345 @@ def test_import_mermaid_invalid_start_line(client, db_session):
     assert 'error' in data
     assert "Le code Mermaid doit commencer par 'graph TD'" in data['error']
 
+def test_import_mermaid_text_stream(client, db_session):
+    """Teste l'importation en flux d'un corps text/plain compressé en gzip."""
+    mermaid_code = "graph LR\nA[Nœud A] --> B --> C\nclass C important\n"
+
+    response = client.post(
+        MERMAID_IMPORT_URL + "?project_title=Projet Flux",
+        data=gzip.compress(mermaid_code.encode('utf-8')),
+        content_type='text/plain; charset=utf-8',
+        headers={'Content-Encoding': 'gzip'}
+    )
+
+    assert response.status_code == 201
+    data = json.loads(response.get_data(as_text=True))
+    assert data['title'] == "Projet Flux"
+
+    created_sp = db_session.get(SubProject, data['subprojects'][0]['id'])
+    assert created_sp.graph_direction == "LR"
+    assert sorted(n.mermaid_id for n in created_sp.nodes) == ["A", "B", "C"]
+    assert len(created_sp.relationships) == 2
+    # La définition stockée est régénérée depuis la base
+    assert "A-->B" in created_sp.mermaid_definition
+    assert "class C important" in created_sp.mermaid_definition
+
+def test_import_mermaid_without_bulk_returning(client, db_session, monkeypatch):
+    """Teste l'insertion par lots des nœuds quand le dialecte ne supporte pas INSERT ... RETURNING multiple."""
+    import app.services.mermaid_parser as mermaid_parser
+    monkeypatch.setattr(mermaid_parser, '_supports_bulk_returning', lambda: False)
+    monkeypatch.setitem(client.application.config, 'MERMAID_IMPORT_BATCH_SIZE', 2)
+
+    mermaid_code = "graph TD\nA[Départ] --> B --> C\nC --> D\nD --> A"
+    response = client.post(MERMAID_IMPORT_URL, json={"code": mermaid_code})
+
+    assert response.status_code == 201
+    created_sp = db_session.get(SubProject, json.loads(response.get_data(as_text=True))['subprojects'][0]['id'])
+    nodes = {n.mermaid_id: n.id for n in created_sp.nodes}
+    assert sorted(nodes) == ["A", "B", "C", "D"]
+    assert sorted((r.source_node_id, r.target_node_id) for r in created_sp.relationships) == sorted([
+        (nodes["A"], nodes["B"]), (nodes["B"], nodes["C"]), (nodes["C"], nodes["D"]), (nodes["D"], nodes["A"])
+    ])
+
+def test_synchronize_only_writes_changed_entities(client, db_session):
+    """Teste que la synchronisation conserve les relations inchangées et résume les changements."""
+    project = parse_and_save_mermaid(
+        "graph TD\nclassDef a fill:#f00\nclassDef b fill:#0f0\nA --> B\nB -->|x| C\nC --- D\nclass A a",
+        project_title="Projet Diff"
+    )
+    subproject = db_session.get(SubProject, project.subprojects[0].id)
+    kept = db_session.query(Relationship).filter_by(subproject_id=subproject.id, label=None, link_type=LinkType.VISIBLE).one()
+    kept.color = "#123456"
+    relabelled_id = db_session.query(Relationship).filter_by(subproject_id=subproject.id, label="x").one().id
+    db_session.commit()
+
+    new_code = "graph TD\nclassDef a fill:#00f\nclassDef c fill:#fff\nA --> B\nB -->|y| C\nC --> E\nclass A a"
+    subproject.mermaid_definition = new_code
+    changes = synchronize_subproject_entities(subproject, new_code)
+    db_session.commit()
+
+    assert changes == {
+        'nodes': {'inserted': 1, 'updated': 0, 'deleted': 1},
+        'classdefs': {'inserted': 1, 'updated': 1, 'deleted': 1},
+        'relationships': {'inserted': 1, 'updated': 1, 'deleted': 1},
+        'subgraphs': {'inserted': 0, 'updated': 0, 'deleted': 0},
+    }
+    db_session.expire_all()
+    # La relation inchangée garde son id et sa couleur ; celle dont le label change est mise à jour en place
+    assert db_session.get(Relationship, kept.id).color == "#123456"
+    assert db_session.get(Relationship, relabelled_id).label == "y"
+    assert sorted((c.name, c.definition_raw) for c in db_session.query(ClassDef).filter_by(subproject_id=subproject.id)) == [
+        ("a", "fill:#00f"), ("c", "fill:#fff")
+    ]
+
+    # Une seconde synchronisation du même code n'écrit rien
+    assert synchronize_subproject_entities(subproject, new_code) == {
+        'nodes': {'inserted': 0, 'updated': 0, 'deleted': 0},
+        'classdefs': {'inserted': 0, 'updated': 0, 'deleted': 0},
+        'relationships': {'inserted': 0, 'updated': 0, 'deleted': 0},
+        'subgraphs': {'inserted': 0, 'updated': 0, 'deleted': 0},
+    }
+
+def test_synchronize_reassigns_only_moved_nodes(client, db_session):
+    """Teste que la réaffectation aux subgraphs n'écrit que les nœuds qui changent de subgraph."""
+    project = Project(title="Projet Subgraphs")
+    db_session.add(project)
+    db_session.flush()
+    subproject = SubProject(project_id=project.id, title="SP Subgraphs", mermaid_definition="")
+    db_session.add(subproject)
+    db_session.flush()
+    db_session.add_all([
+        Subgraph(subproject_id=subproject.id, mermaid_id="G1", title="Groupe 1"),
+        Subgraph(subproject_id=subproject.id, mermaid_id="G2", title="Groupe 2"),
+    ])
+    db_session.flush()
+
+    code = "graph TD\nsubgraph G1\nA\nB\nend\nsubgraph G2\nC\nend\nA --> D"
+    subproject.mermaid_definition = code
+    synchronize_subproject_entities(subproject, code)
+    db_session.commit()
+
+    def membership():
+        db_session.expire_all()
+        return {n.mermaid_id: n.subgraph.mermaid_id if n.subgraph else None
+                for n in db_session.query(Node).filter_by(subproject_id=subproject.id)}
+
+    assert membership() == {"A": "G1", "B": "G1", "C": "G2", "D": None}
+
+    # B passe de G1 à G2 : seul ce nœud est compté comme mis à jour
+    code = "graph TD\nsubgraph G1\nA\nend\nsubgraph G2\nC\nB\nend\nA --> D"
+    subproject.mermaid_definition = code
+    changes = synchronize_subproject_entities(subproject, code)
+    db_session.commit()
+
+    assert changes['nodes'] == {'inserted': 0, 'updated': 1, 'deleted': 0}
+    assert membership() == {"A": "G1", "B": "G2", "C": "G2", "D": None}
+
+def test_import_creates_subgraphs_from_blocks(client, db_session):
+    """Teste que l'import crée les Subgraphs des blocs 'subgraph ... end' et que la resynchronisation les suit."""
+    code = ("graph TD\nclassDef hot fill:#f00\nsubgraph G1[\"Groupe 1\"]\nA --> B\nend\n"
+            "subgraph G2\nC\nend\nsubgraph G3[Vide]\nend\nclass G2 hot\nB --> C")
+    for content_type in ('application/json', 'text/plain'):
+        if content_type == 'text/plain':
+            response = client.post('/api/mermaid/import', data=code, content_type=content_type)
+        else:
+            response = client.post('/api/mermaid/import', json={"code": code})
+        assert response.status_code == 201
+        subproject_id = json.loads(response.get_data(as_text=True))['subprojects'][0]['id']
+
+        subgraphs = {sg.mermaid_id: sg for sg in db_session.query(Subgraph).filter_by(subproject_id=subproject_id)}
+        assert {k: (sg.title, sg.style_class_ref) for k, sg in subgraphs.items()} == {
+            "G1": ("Groupe 1", None), "G2": ("G2", "hot"), "G3": ("Vide", None)
+        }
+        membership = {n.mermaid_id: n.subgraph_id for n in db_session.query(Node).filter_by(subproject_id=subproject_id)}
+        assert membership == {"A": subgraphs["G1"].id, "B": subgraphs["G1"].id, "C": subgraphs["G2"].id}
+
+    # G1 renommé, G3 retiré, G4 ajouté : les ids des subgraphs conservés ne changent pas
+    subproject = db_session.get(SubProject, subproject_id)
+    code = "graph TD\nsubgraph G1[Premier]\nA --> B\nend\nsubgraph G2\nC\nend\nsubgraph G4\nD\nend\nB --> C"
+    subproject.mermaid_definition = code
+    changes = synchronize_subproject_entities(subproject, code)
+    db_session.commit()
+
+    assert changes['subgraphs'] == {'inserted': 1, 'updated': 2, 'deleted': 1}
+    db_session.expire_all()
+    titles = {sg.mermaid_id: (sg.id, sg.title) for sg in db_session.query(Subgraph).filter_by(subproject_id=subproject_id)}
+    assert titles == {"G1": (subgraphs["G1"].id, "Premier"), "G2": (subgraphs["G2"].id, "G2"), "G4": (titles["G4"][0], "G4")}
+    assert db_session.query(Node).filter_by(subproject_id=subproject_id, mermaid_id="D").one().subgraph_id == titles["G4"][0]
+
+def test_chunked_import_resumes_after_failure(client, db_session, monkeypatch):
+    """Teste l'import par tranches : échec en cours d'écriture, SubProject non publié, reprise au point de reprise."""
+    import app.services.mermaid_chunked_import as chunked_import
+    monkeypatch.setitem(client.application.config, 'MERMAID_IMPORT_CHUNK_SIZE', 2)
+    phase_writer = chunked_import._phase_writer
+
+    def failing_phase_writer(phase, subproject_id, parsed):
+        model, total, make_rows = phase_writer(phase, subproject_id, parsed)
+
+        def rows(start, stop):
+            if phase == 'relationships' and start == 2:
+                raise RuntimeError("connexion perdue")
+            return make_rows(start, stop)
+        return model, total, rows
+
+    monkeypatch.setattr(chunked_import, '_phase_writer', failing_phase_writer)
+    mermaid_code = "graph LR\nclassDef hot fill:#f00\nsubgraph G[Groupe]\nA --> B\nend\nB --> C --> D\nD -->|retour| A\nclass C hot"
+    response = client.post(MERMAID_IMPORT_URL, json={"code": mermaid_code, "project_title": "Projet Tranches", "chunked": True})
+
+    assert response.status_code == 503
+    data = json.loads(response.get_data(as_text=True))
+    subproject_id = data['subproject_id']
+    assert data['checkpoint'] == {'phase': 'relationships', 'position': 2}
+    # Les tranches validées sont conservées, mais le SubProject reste invisible tant qu'il n'est pas publié
+    assert db_session.query(Node).filter_by(subproject_id=subproject_id).count() == 4
+    assert db_session.query(Relationship).filter_by(subproject_id=subproject_id).count() == 2
+    assert client.get(f'/api/subprojects/{subproject_id}').status_code == 404
+    assert json.loads(client.get(f'{MERMAID_IMPORT_URL}/{subproject_id}').get_data(as_text=True))['status'] == 'staging'
+
+    monkeypatch.setattr(chunked_import, '_phase_writer', phase_writer)
+    response = client.post(f'{MERMAID_IMPORT_URL}/{subproject_id}/resume')
+    assert response.status_code == 200
+    assert [sp['id'] for sp in json.loads(response.get_data(as_text=True))['subprojects']] == [subproject_id]
+
+    db_session.expire_all()
+    subproject = db_session.get(SubProject, subproject_id)
+    assert subproject.import_checkpoint is None
+    assert subproject.graph_direction == "LR"
+    assert subproject.structure_hash == compute_structure_hash(mermaid_code)
+    assert subproject.source_map['nodes']['A'] == [4, 4]
+    nodes = {n.mermaid_id: n for n in subproject.nodes}
+    assert {k: (n.subgraph.mermaid_id if n.subgraph else None, n.style_class_ref) for k, n in nodes.items()} == {
+        "A": ("G", None), "B": ("G", None), "C": (None, "hot"), "D": (None, None)
+    }
+    assert sorted((r.source_node.mermaid_id, r.target_node.mermaid_id, r.label) for r in subproject.relationships) == [
+        ("A", "B", None), ("B", "C", None), ("C", "D", None), ("D", "A", "retour")
+    ]
+    assert [cd.name for cd in subproject.class_defs] == ["hot"]
+
+
+def test_chunked_import_budget_and_concurrent_resume(client, db_session, monkeypatch):
+    """Teste les budgets propres à l'import par tranches, la reprise sous budget réduit et la reprise concurrente (409)."""
+    from sqlalchemy import update
+    import app.services.mermaid_chunked_import as chunked_import
+    config = client.application.config
+    monkeypatch.setitem(config, 'MERMAID_MAX_LINES', 3)
+    monkeypatch.setitem(config, 'MERMAID_IMPORT_CHUNK_SIZE', 1)
+    mermaid_code = "graph TD\nA --> B\nB --> C\nC --> D\nD --> A"
+    assert client.post(MERMAID_IMPORT_URL, json={"code": mermaid_code, "project_title": "Budget"}).status_code == 413
+    monkeypatch.setitem(config, 'MERMAID_CHUNKED_MAX_LINES', 4)
+    response = client.post(MERMAID_IMPORT_URL, json={"code": mermaid_code, "project_title": "Budget", "chunked": True})
+    assert response.status_code == 413
+    monkeypatch.setitem(config, 'MERMAID_CHUNKED_MAX_LINES', 5)
+
+    phase_writer = chunked_import._phase_writer
+
+    def failing_phase_writer(phase, subproject_id, parsed):
+        model, total, make_rows = phase_writer(phase, subproject_id, parsed)
+
+        def rows(start, stop):
+            if phase == 'relationships' and start == 1:
+                raise RuntimeError("connexion perdue")
+            return make_rows(start, stop)
+        return model, total, rows
+
+    monkeypatch.setattr(chunked_import, '_phase_writer', failing_phase_writer)
+    response = client.post(MERMAID_IMPORT_URL, json={"code": mermaid_code, "project_title": "Budget", "chunked": True})
+    assert response.status_code == 503
+    subproject_id = json.loads(response.get_data(as_text=True))['subproject_id']
+
+    # Une autre reprise valide la tranche suivante pendant celle-ci : le point de reprise a changé, 409
+    def racing_phase_writer(phase, subproject_id, parsed):
+        model, total, make_rows = phase_writer(phase, subproject_id, parsed)
+
+        def rows(start, stop):
+            db_session.execute(
+                update(SubProject).where(SubProject.id == subproject_id)
+                .values(import_checkpoint={'phase': phase, 'position': stop})
+            )
+            return make_rows(start, stop)
+        return model, total, rows
+
+    monkeypatch.setattr(chunked_import, '_phase_writer', racing_phase_writer)
+    assert client.post(f'{MERMAID_IMPORT_URL}/{subproject_id}/resume').status_code == 409
+    db_session.expire_all()
+    assert db_session.query(Relationship).filter_by(subproject_id=subproject_id).count() == 1
+    assert db_session.get(SubProject, subproject_id).import_checkpoint == {'phase': 'relationships', 'position': 1}
+
+    # Budget réduit depuis l'import : la définition stockée reste reprenable
+    monkeypatch.setattr(chunked_import, '_phase_writer', phase_writer)
+    monkeypatch.setitem(config, 'MERMAID_CHUNKED_MAX_LINES', 2)
+    assert client.post(f'{MERMAID_IMPORT_URL}/{subproject_id}/resume').status_code == 200
+    db_session.expire_all()
+    assert db_session.query(Relationship).filter_by(subproject_id=subproject_id).count() == 4
+    assert db_session.get(SubProject, subproject_id).import_checkpoint is None
+
+
+def _tar_archive(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, content in files.items():
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+def test_bulk_import_reports_per_file(client, db_session, monkeypatch):
+    """Teste l'import en masse (multipart avec archive tar) : rapport par fichier, échecs isolés, ré-import idempotent."""
+    monkeypatch.setitem(client.application.config, 'MERMAID_BULK_IMPORT_WORKERS', 1)
+    archive_files = {"saga/livre2.mmd": "graph LR\nX --> Y", "saga/casse.mmd": "graph TD\nA -->"}
+
+    def upload():
+        return client.post(
+            '/api/mermaid/bulk-import?project_title=Saga',
+            data={'files': [
+                (io.BytesIO("graph TD\nA[Début] --> B".encode('utf-8')), 'livre1.mmd'),
+                (_tar_archive(archive_files), 'saga.tar.gz'),
+            ]},
+            content_type='multipart/form-data'
+        )
+
+    response = upload()
+    assert response.status_code == 200
+    report = json.loads(response.get_data(as_text=True))
+    assert (report['imported'], report['failed']) == (2, 1)
+    by_name = {f['name']: f for f in report['files']}
+    assert by_name['livre1.mmd']['status'] == 'created'
+    assert by_name['saga/livre2.mmd']['status'] == 'created'
+    assert by_name['saga/casse.mmd']['status'] == 'failed'
+    assert "Ligne 2" in by_name['saga/casse.mmd']['error']
+    assert by_name['livre1.mmd']['parse_seconds'] >= 0 and by_name['livre1.mmd']['write_seconds'] >= 0
+
+    livre2 = db_session.get(SubProject, by_name['saga/livre2.mmd']['subproject_id'])
+    assert livre2.title == "livre2"
+    assert livre2.graph_direction == "LR"
+    assert sorted(n.mermaid_id for n in livre2.nodes) == ["X", "Y"]
+
+    # Ré-import identique : aucune resynchronisation
+    report = json.loads(upload().get_data(as_text=True))
+    assert [f['status'] for f in report['files']] == ['unchanged', 'unchanged', 'failed']
+
+    # Deux fichiers du lot qui donnent le même titre : le second est en échec, le premier n'est pas écrasé
+    response = client.post(
+        '/api/mermaid/bulk-import?project_title=Saga',
+        data={'files': [(_tar_archive({"a/livre3.mmd": "graph TD\nP --> Q", "b/livre3.mmd": "graph TD\nR --> S"}), 'doublons.tar')]},
+        content_type='multipart/form-data'
+    )
+    report = json.loads(response.get_data(as_text=True))
+    assert [(f['name'], f['status']) for f in report['files']] == [("a/livre3.mmd", 'created'), ("b/livre3.mmd", 'failed')]
+    assert "a/livre3.mmd" in report['files'][1]['error']
+    livre3 = db_session.get(SubProject, report['files'][0]['subproject_id'])
+    assert sorted(n.mermaid_id for n in livre3.nodes) == ["P", "Q"]
+
+
+def test_bulk_import_streams_sources_and_skips_staging(client, db_session):
+    """Teste que l'import en masse lit les sources au fil de l'eau et ignore un SubProject en cours d'import par tranches."""
+    project = Project(title="Saga")
+    db_session.add(project)
+    db_session.flush()
+    staging = SubProject(project_id=project.id, title="livre1", mermaid_definition="graph TD",
+                         visual_layout={}, import_checkpoint={'phase': 'nodes', 'position': 0})
+    db_session.add(staging)
+    db_session.commit()
+
+    published_before_read = []
+
+    def sources():
+        for name in ("livre1.mmd", "livre2.mmd"):
+            published_before_read.append(db_session.query(SubProject).filter(
+                SubProject.project_id == project.id, SubProject.import_checkpoint.is_(None)
+            ).count())
+            yield name, "graph TD\nA --> B"
+
+    with client.application.test_request_context():
+        report = bulk_import_mermaid(sources(), "Saga", workers=1)
+
+    assert published_before_read == [0, 1]  # livre1 écrit avant la lecture de livre2
+    assert [f['status'] for f in report['files']] == ['created', 'created']
+    assert report['files'][0]['subproject_id'] != staging.id
+    assert db_session.get(SubProject, staging.id).import_checkpoint is not None
+
 # --- Tests pour l'exportation Mermaid (GET /api/mermaid/export/<subproject_id>) ---
 
 def test_export_mermaid_success(client, db_session):
@@ -203,6 +553,401 @@ def test_export_mermaid_success(client, db_session):
     # ... refaire le test ...
     # assert "classDef my_style fill:red" in generated_code
 
+def test_export_groups_nodes_by_subgraph(client, db_session):
+    """Teste que l'export place chaque nœud dans son subgraph, dans l'ordre, les nœuds libres en premier."""
+    code = "graph TD\nsubgraph G1[Premier]\nA\nC\nend\nsubgraph G2\nB\nend\nsubgraph G3\nend\nD --> A"
+    subproject_id = parse_and_save_mermaid(code, "Projet Export Subgraphs").subprojects[0].id
+    db_session.expire_all()
+
+    generated_code, source_map = generate_mermaid_document(subproject_id)
+    lines = generated_code.split('\n')
+    nodes_section = lines[lines.index("%% Nodes & Subgraphs Definitions") + 1:lines.index("%% Class Applications")]
+    assert [line for line in nodes_section if line] == [
+        "    D[D]",
+        "subgraph G1[Premier]", "    A[A]", "    C[C]", "end",
+        "subgraph G2[G2]", "    B[B]", "end",
+        "subgraph G3[G3]", "end",
+    ]
+    assert source_map['subgraphs']['G1'] == [lines.index("subgraph G1[Premier]") + 1, lines.index("    C[C]") + 2]
+
+def test_export_streams_same_text_as_generator(client, db_session, monkeypatch):
+    """Teste que l'export en flux, découpé en plusieurs morceaux, produit exactement le texte du générateur."""
+    import app.services.mermaid_generator as mermaid_generator
+    import app.services.mermaid_render as mermaid_render
+    monkeypatch.setattr(mermaid_render, 'EXPORT_YIELD_PER', 2)
+    code = ("graph LR\nclassDef hot fill:#f00\nclassDef cold fill:#00f\nsubgraph G1[Premier groupe]\nA[Nœud A] --> B\nend\n"
+            "subgraph G2\nend\nsubgraph G3\nC\nend\nB -->|oui| C\nC --- D\nD --> A\nclass A hot\nclass G3 cold")
+    subproject_id = parse_and_save_mermaid(code, "Projet Export Flux").subprojects[0].id
+    db_session.expire_all()
+    expected = generate_mermaid_from_subproject(subproject_id)
+
+    chunks = list(mermaid_generator.iter_mermaid_export(subproject_id, chunk_size=16))
+    assert len(chunks) > 1
+    assert "".join(chunks) == expected
+
+    response = client.get(MERMAID_EXPORT_URL_TEMPLATE.format(subproject_id))
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.get_data(as_text=True) == expected
+
+def test_fragment_cache_rerenders_only_edited_entities(client, db_session):
+    """Teste que la régénération après édition réutilise les fragments en cache et reste identique au générateur."""
+    from app.schemas import NodeCreate
+    from app.services.classdefs import delete_classdef
+    from app.services.mermaid_fragment_cache import fragment_cache
+    from app.services.nodes import update_node
+    code = ("graph TD\nclassDef hot fill:#f00\nsubgraph G1[Groupe]\nA[Nœud A] --> B\nend\n"
+            "C --> A\nclass A hot\nclass G1 hot")
+    subproject_id = parse_and_save_mermaid(code, "Projet Fragments").subprojects[0].id
+    fragment_cache.clear()
+    node_ids = {node.mermaid_id: node.id for node in db_session.query(Node).filter_by(subproject_id=subproject_id)}
+
+    update_node(node_ids['B'], NodeCreate(subproject_id=subproject_id, mermaid_id='B', title='Bee', text_content=''))
+    update_node(node_ids['A'], NodeCreate(subproject_id=subproject_id, mermaid_id='A2', title='Nouveau titre', text_content='', style_class_ref='hot'))
+    assert fragment_cache.stats()['full_builds'] == 1
+    assert fragment_cache.stats()['incremental_renders'] == 1
+    subproject = db_session.get(SubProject, subproject_id)
+    assert subproject.mermaid_definition == generate_mermaid_from_subproject(subproject_id)
+    assert 'A2["Nouveau titre"]' in subproject.mermaid_definition and "C-->A2" in subproject.mermaid_definition
+
+    # Mise à jour en masse par le Core (classe retirée des nœuds) : les nœuds touchés sont relus
+    delete_classdef(db_session.query(ClassDef).filter_by(subproject_id=subproject_id).one().id)
+    assert fragment_cache.stats()['full_builds'] == 1
+    assert "class A2" not in subproject.mermaid_definition
+    assert subproject.mermaid_definition == generate_mermaid_from_subproject(subproject_id)
+
+def test_fragment_cache_keyed_on_version(client, db_session):
+    """Teste qu'une entrée du cache n'est plus réutilisée après une écriture ailleurs, même à texte identique."""
+    from sqlalchemy import delete, insert, update
+    from app.services.mermaid_fragment_cache import fragment_cache
+    subproject_id = parse_and_save_mermaid("graph TD\nA --> B", "Projet Version").subprojects[0].id
+    fragment_cache.clear()
+    nodes = {node.mermaid_id: node for node in db_session.query(Node).filter_by(subproject_id=subproject_id)}
+    nodes['A'].title = "Premier"
+    db_session.commit()
+    assert fragment_cache.stats()['full_builds'] == 1
+
+    # Autre processus : B et son lien supprimés puis recréés (nouveaux ids, même texte), nouvelle version
+    db_session.execute(delete(Relationship).where(Relationship.subproject_id == subproject_id))
+    db_session.execute(delete(Node).where(Node.id == nodes['B'].id))
+    new_b = db_session.execute(insert(Node).values(
+        subproject_id=subproject_id, mermaid_id='B', title='B', text_content='B').returning(Node.id)).scalar_one()
+    db_session.execute(insert(Relationship).values(
+        subproject_id=subproject_id, source_node_id=nodes['A'].id, target_node_id=new_b, link_type=LinkType.VISIBLE))
+    db_session.execute(update(SubProject).where(SubProject.id == subproject_id).values(version=SubProject.version + 1))
+    db_session.commit()
+    db_session.expunge_all()
+
+    db_session.get(Node, new_b).title = "Bee"
+    db_session.commit()
+    assert fragment_cache.stats() == dict(fragment_cache.stats(), full_builds=2, incremental_renders=0)
+    subproject = db_session.get(SubProject, subproject_id)
+    assert subproject.mermaid_definition == generate_mermaid_from_subproject(subproject_id)
+    assert subproject.mermaid_definition.count("    B[Bee]") == 1
+
+    # Rendu validé pour sa version : l'édition suivante est incrémentale
+    db_session.get(Node, new_b).title = "Abeille"
+    db_session.commit()
+    assert fragment_cache.stats()['incremental_renders'] == 1
+    assert db_session.get(SubProject, subproject_id).mermaid_definition == generate_mermaid_from_subproject(subproject_id)
+
+def test_regeneration_is_deferred_to_commit(client, db_session):
+    """Teste que plusieurs modifications d'une transaction régénèrent la définition une seule fois, au commit."""
+    from app.services.mermaid_fragment_cache import fragment_cache
+    code = "graph TD\nA[Début] --> B\nsubgraph G1[Groupe]\nC\nend"
+    subproject_id = parse_and_save_mermaid(code, "Projet Différé").subprojects[0].id
+    subproject = db_session.get(SubProject, subproject_id)
+    assert subproject.mermaid_definition == code  # Le texte importé n'est pas régénéré
+    fragment_cache.clear()
+
+    nodes = {node.mermaid_id: node for node in db_session.query(Node).filter_by(subproject_id=subproject_id)}
+    nodes['A'].title = "Premier"
+    nodes['C'].subgraph_id = None
+    db_session.add(Relationship(subproject_id=subproject_id, source_node_id=nodes['B'].id,
+                                target_node_id=nodes['C'].id, link_type=LinkType.INVISIBLE))
+    db_session.flush()
+    assert subproject.mermaid_definition == code
+    db_session.commit()
+
+    stats = fragment_cache.stats()
+    assert stats['full_builds'] + stats['incremental_renders'] == 1
+    assert subproject.mermaid_definition == generate_mermaid_from_subproject(subproject_id)
+    assert "B---C" in subproject.mermaid_definition
+
+    # Le texte régénéré n'est pas ré-analysé au commit : empreinte et carte des sources à la première lecture
+    from app.services.mermaid_parser import get_source_map, get_structure_hash
+    from app.services.subprojects import is_structure_unchanged
+    assert subproject.structure_hash is None and subproject.source_map is None
+    version = subproject.version
+    assert is_structure_unchanged(subproject, "%% reformaté\n" + subproject.mermaid_definition)
+    assert get_structure_hash(subproject) == compute_structure_hash(subproject.mermaid_definition)
+    assert get_source_map(subproject)['nodes']['A'] is not None
+    db_session.commit()
+    db_session.expire_all()
+    assert subproject.structure_hash == compute_structure_hash(subproject.mermaid_definition)
+    assert subproject.version == version  # Enregistrement ciblé, sans nouvelle version
+
+def test_generator_reads_projected_columns(client, db_session):
+    """Teste que le générateur lit les colonnes utiles en quatre requêtes (texte des nœuds sans titre seulement)."""
+    from sqlalchemy import event
+    code = "graph LR\nclassDef hot fill:#f00\nsubgraph G1[Groupe]\nA[Titre A]\nend\nA --> B\nclass A hot"
+    subproject_id = parse_and_save_mermaid(code, "Projet Colonnes").subprojects[0].id
+    node_b = db_session.query(Node).filter_by(subproject_id=subproject_id, mermaid_id='B').one()
+    node_b.title, node_b.text_content = None, "Paragraphe long"
+    db_session.commit()
+
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        generated_code, _ = generate_mermaid_document(subproject_id)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert len(statements) <= 4
+    assert all("node.text_content" not in statement or "coalesce(node.title, node.text_content)" in statement
+               for statement in statements)
+    assert '    B["Paragraphe long"]' in generated_code and '    A["Titre A"]' in generated_code
+
+def test_export_and_detail_answer_304_for_current_version(client, db_session):
+    """Teste les ETags versionnés : 304 tant que le SubProject ne change pas, nouvelle version après une écriture."""
+    subproject_id = parse_and_save_mermaid("graph TD\nA --> B", "Projet ETag").subprojects[0].id
+    export_url = MERMAID_EXPORT_URL_TEMPLATE.format(subproject_id)
+    detail_url = f'/api/subprojects/{subproject_id}'
+
+    export_response = client.get(export_url)
+    detail_response = client.get(detail_url)
+    etag = export_response.headers['ETag']
+    assert export_response.status_code == 200 and export_response.get_data(as_text=True).startswith("graph TD")
+    assert detail_response.headers['ETag'] == etag
+    assert client.get(export_url, headers={'If-None-Match': etag}).status_code == 304
+    not_modified = client.get(detail_url, headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304 and not_modified.headers['ETag'] == etag
+
+    # Contenu d'un nœud titré : texte inchangé, mais la version avance
+    subproject = db_session.get(SubProject, subproject_id)
+    version = subproject.version
+    db_session.query(Node).filter_by(subproject_id=subproject_id, mermaid_id='A').one().text_content = "Nouveau"
+    db_session.commit()
+    assert subproject.version > version
+    assert client.get(detail_url, headers={'If-None-Match': etag}).status_code == 200
+
+    # Métadonnées seules
+    version = subproject.version
+    subproject.visual_layout = {'zoom': 2}
+    db_session.commit()
+    assert subproject.version == version + 1
+    response = client.get(export_url, headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert response.get_data(as_text=True).startswith("graph TD")
+
+def test_export_served_from_artifact_cache(client, db_session, monkeypatch, tmp_path):
+    """Teste que l'export de chaque version est écrit une fois sur disque puis servi depuis le fichier."""
+    import os
+    from app.services.mermaid_artifact_cache import artifact_cache
+    monkeypatch.setattr(artifact_cache, 'directory', str(tmp_path))
+    subproject_id = parse_and_save_mermaid("graph TD\nA[Début] --> B", "Projet Artefact").subprojects[0].id
+    subproject = db_session.get(SubProject, subproject_id)
+    export_url = MERMAID_EXPORT_URL_TEMPLATE.format(subproject_id)
+
+    first = client.get(export_url)
+    assert first.get_data(as_text=True) == generate_mermaid_from_subproject(subproject_id)
+    assert os.listdir(tmp_path) == [f"sp{subproject_id}-v{subproject.version}.mmd"]
+    assert os.stat(tmp_path / os.listdir(tmp_path)[0]).st_mode & 0o777 == 0o644  # Lisible par le serveur frontal
+    second = client.get(export_url)
+    artifact_size = os.path.getsize(tmp_path / os.listdir(tmp_path)[0])
+    assert second.content_length == artifact_size  # Fichier transmis tel quel (send_file)
+    assert second.get_data() == first.get_data() and second.headers['ETag'] == first.headers['ETag']
+
+    # Une nouvelle version remplace l'artefact précédent
+    db_session.query(Node).filter_by(subproject_id=subproject_id, mermaid_id='A').one().title = "Modifié"
+    db_session.commit()
+    assert "Modifié" in client.get(export_url).get_data(as_text=True)
+    assert os.listdir(tmp_path) == [f"sp{subproject_id}-v{subproject.version}.mmd"]
+
+    # Artefact évincé par un autre processus entre sa recherche et son envoi : reconstruit
+    get_or_build, built = artifact_cache.get_or_build, []
+
+    def evicting_get_or_build(*args):
+        path = get_or_build(*args)
+        if not built:
+            os.remove(path)
+        built.append(path)
+        return path
+
+    monkeypatch.setattr(artifact_cache, 'get_or_build', evicting_get_or_build)
+    response = client.get(export_url)
+    assert response.status_code == 200 and "Modifié" in response.get_data(as_text=True)
+    assert len(built) == 2 and os.path.exists(built[1])
+    monkeypatch.setattr(artifact_cache, 'get_or_build', get_or_build)
+
+    # Version validée pendant l'écriture : l'artefact n'est pas enregistré sous l'ancienne version
+    import app.routes.mermaid as mermaid_routes
+    iter_export = mermaid_routes.iter_export
+
+    def racing_export(subproject_id, format_name):
+        chunks = list(iter_export(subproject_id, format_name))
+        monkeypatch.setattr(mermaid_routes, 'iter_export', iter_export)
+        db_session.query(Node).filter_by(subproject_id=subproject_id, mermaid_id='A').one().title = "Concurrent"
+        db_session.commit()
+        return iter(chunks)
+
+    db_session.query(Node).filter_by(subproject_id=subproject_id, mermaid_id='B').one().title = "Bis"
+    db_session.commit()
+    raced_version = subproject.version
+    monkeypatch.setattr(mermaid_routes, 'iter_export', racing_export)
+    response = client.get(export_url)
+    assert response.status_code == 200 and "Concurrent" in response.get_data(as_text=True)
+    assert subproject.version == raced_version + 1 and response.headers['ETag'] == f'"sp{subproject_id}-v{subproject.version}"'
+    assert f"sp{subproject_id}-v{raced_version}.mmd" not in os.listdir(tmp_path)
+
+    # Délégation au serveur frontal
+    monkeypatch.setattr(artifact_cache, 'accel_redirect_prefix', '/_exports/')
+    delegated = client.get(export_url)
+    assert delegated.headers['X-Accel-Redirect'] == f"/_exports/sp{subproject_id}-v{subproject.version}.mmd"
+    assert delegated.get_data() == b""
+
+def test_export_formats_from_single_loader(client, db_session):
+    """Teste les exports JSON, GraphML, DOT et MessagePack : mêmes nœuds, liens et subgraphs que le code Mermaid."""
+    import xml.etree.ElementTree as ElementTree
+    from app.services.mermaid_exporters import msgpack
+    code = ('graph LR\nclassDef hot fill:#f00\nsubgraph G1[Premier groupe]\nA[Nœud "A"] --> B\nend\n'
+            'B -->|oui| C\nC --- D\nclass A hot')
+    subproject_id = parse_and_save_mermaid(code, "Projet Formats").subprojects[0].id
+    export_url = MERMAID_EXPORT_URL_TEMPLATE.format(subproject_id)
+
+    graph = json.loads(client.get(export_url + '?format=json').get_data(as_text=True))['graph']
+    assert graph['metadata']['graph_direction'] == 'LR' and graph['metadata']['class_defs'] == {'hot': 'fill:#f00'}
+    assert set(graph['nodes']) == {'A', 'B', 'C', 'D'}
+    assert graph['nodes']['A'] == {'label': 'Nœud "A"', 'metadata': {'subgraph': 'G1', 'class_ref': 'hot'}}
+    assert [(e['source'], e['target'], e['relation'], e.get('label')) for e in graph['edges']] == [
+        ('A', 'B', 'VISIBLE', None), ('B', 'C', 'VISIBLE', 'oui'), ('C', 'D', 'INVISIBLE', None)]
+
+    graphml = client.get(export_url + '?format=graphml')
+    assert graphml.mimetype == 'application/graphml+xml'
+    namespace = {'g': 'http://graphml.graphdrawing.org/xmlns'}
+    root = ElementTree.fromstring(graphml.get_data())
+    assert [node.get('id') for node in root.iterfind('.//g:node', namespace)] == ['A', 'B', 'C', 'D']
+    assert len(root.findall('.//g:edge', namespace)) == 3
+
+    dot = client.get(export_url + '?format=dot').get_data(as_text=True)
+    assert 'rankdir=LR;' in dot and 'subgraph "cluster_G1"' in dot
+    assert '"A" [label="Nœud \\"A\\"", class="hot"];' in dot
+    assert '"C" -> "D" [arrowhead="none"];' in dot
+
+    # ETag propre à chaque format
+    assert client.get(export_url + '?format=dot').headers['ETag'] != client.get(export_url).headers['ETag']
+    assert client.get(export_url + '?format=svg').status_code == 400
+
+    response = client.get(export_url + '?format=msgpack')
+    if msgpack is None:
+        assert response.status_code == 501 and response.get_json()['status_code'] == 501
+    else:
+        snapshot = msgpack.unpackb(response.get_data())
+        assert [node[0] for node in snapshot['nodes']] == ['A', 'B', 'C', 'D']
+        assert snapshot['nodes'][0][2] == 0 and snapshot['subgraphs'] == [['G1', 'Premier groupe', None]]
+        assert [edge[:3] for edge in snapshot['edges']] == [[0, 1, 0], [1, 2, 0], [2, 3, 1]]
+
+def test_layered_layout_cached_per_structure(client, db_session, monkeypatch):
+    """Teste le layout en couches : direction, subgraphs, cycles, et recalcul seulement si la structure change."""
+    import app.services.mermaid_layout as mermaid_layout
+    code = "graph TD\nsubgraph G1[Groupe]\nB\nC\nend\nA --> B\nA --> C\nB --> D\nC --> D\nD --> A"
+    subproject_id = parse_and_save_mermaid(code, "Projet Layout").subprojects[0].id
+    subproject = db_session.get(SubProject, subproject_id)
+    subproject.visual_layout = {'zoom': 2}
+    db_session.commit()
+    version = subproject.version
+    layout_url = f'/api/mermaid/layout/{subproject_id}'
+
+    response = client.get(layout_url)
+    assert response.status_code == 200 and response.get_json()['status'] == 'ready'
+    layout = response.get_json()['layout']
+    nodes = layout['nodes']
+    assert nodes['A'][1] < nodes['B'][1] == nodes['C'][1] < nodes['D'][1]  # Une couche par niveau, de haut en bas
+    x, y, width, height = layout['subgraphs']['G1']
+    assert all(x < nodes[n][0] < x + width and y < nodes[n][1] < y + height for n in ('B', 'C'))
+    assert [edge[:2] for edge in layout['edges']][-1] == ['D', 'A'] and len(layout['edges'][-1][2]) == 1  # Lien retour
+    db_session.expire_all()
+    # Enregistré à part : layout manuel et version (ETags) intacts
+    assert subproject.visual_layout == {'zoom': 2} and subproject.version == version
+    assert subproject.auto_layout['key'] == layout['key']
+
+    # Édition d'un titre : le layout enregistré reste valable
+    def fail(*args):
+        raise AssertionError("layout recalculé")
+    monkeypatch.setattr(mermaid_layout, 'compute_layered_layout', fail)
+    db_session.query(Node).filter_by(subproject_id=subproject_id, mermaid_id='A').one().title = "Début"
+    db_session.commit()
+    retagged = client.get(layout_url).get_json()['layout']
+    assert retagged['nodes'] == layout['nodes'] and retagged['structure_tag'] != layout['structure_tag']
+    # Étiquette à jour : servi sans relire le graphe
+    monkeypatch.setattr(mermaid_layout, 'load_layout_input', fail)
+    assert client.get(layout_url).get_json()['layout'] == retagged
+
+    # Changement de structure : recalcul, en arrière-plan si le worker a des processus
+    monkeypatch.undo()
+    subproject.mermaid_definition = code.replace("graph TD", "graph LR")
+    synchronize_subproject_entities(subproject, subproject.mermaid_definition)
+    db_session.commit()
+    submitted = []
+    monkeypatch.setattr(mermaid_layout.layout_worker, 'workers', 1)
+    monkeypatch.setattr(mermaid_layout.layout_worker, 'submit', lambda *args: submitted.append(args))
+    response = client.get(layout_url)
+    assert response.status_code == 202 and response.get_json()['status'] == 'pending'
+    layout_input, key = submitted[0][1:3]
+    assert key != layout['key']
+    horizontal = mermaid_layout.compute_layered_layout(layout_input)['nodes']
+    assert horizontal['A'][0] < horizontal['B'][0] < horizontal['D'][0]
+    assert client.get('/api/mermaid/layout/9999').status_code == 404
+
+def test_export_window_around_focus(client, db_session, monkeypatch):
+    """Teste l'export d'une fenêtre : voisinage à k liens, subgraph ou classe, amorces pour les liens sortants, bornes."""
+    code = ("graph TD\nclassDef hot fill:#f00\nclassDef cold fill:#00f\nA --> B\nsubgraph G1[Groupe]\nC[Nœud C]\nD\nend\n"
+            "B -->|oui| C --> D --> E\nE --- A\nclass B hot\nclass E cold")
+    subproject_id = parse_and_save_mermaid(code, "Projet Fenêtre").subprojects[0].id
+    export_url = MERMAID_EXPORT_URL_TEMPLATE.format(subproject_id)
+    nodes = {node.mermaid_id: node for node in db_session.query(Node).filter_by(subproject_id=subproject_id)}
+    stub = {mermaid_id: f"stub_{node.id}" for mermaid_id, node in nodes.items()}
+
+    window = client.get(export_url + '?focus=C&depth=1').get_data(as_text=True)
+    assert 'subgraph G1[Groupe]\n    C["Nœud C"]\n    D[D]\nend' in window and '    B[B]' in window
+    assert 'classDef cold' not in window and 'class B hot' in window
+    assert window.endswith(f"%% Relationships\n{stub['A']}-->B\nB-->|oui|C\nC-->D\nD-->{stub['E']}")
+    assert f'    {stub["A"]}["A …"]' in window and f'class {stub["E"]} windowStub' in window
+    assert {node.mermaid_id for node in parse_flowchart(window.split('\n')).iter_nodes()} == {stub['A'], 'B', 'C', 'D', stub['E']}
+
+    subgraph_window = client.get(export_url + '?subgraph=G1&depth=0').get_data(as_text=True)
+    assert subgraph_window.endswith(f"{stub['B']}-->|oui|C\nC-->D\nD-->{stub['E']}")
+    assert client.get(export_url + '?class=cold&depth=0').get_data(as_text=True).endswith(f"{stub['D']}-->E\nE---{stub['A']}")
+
+    # Fenêtre couvrant tout le graphe : même texte que l'export complet
+    full = client.get(export_url + '?focus=C&depth=5')
+    assert full.get_data(as_text=True) == generate_mermaid_from_subproject(subproject_id)
+    assert full.headers['ETag'] != client.get(export_url).headers['ETag']
+
+    # Un nœud nommé comme une amorce ne se confond pas avec elle
+    nodes['B'].mermaid_id = stub['A']
+    db_session.commit()
+    window = client.get(export_url + f"?focus={stub['A']}&depth=0").get_data(as_text=True)
+    assert f"_{stub['A']}-->{stub['A']}" in window and f"class _{stub['A']} windowStub" in window
+    nodes['B'].mermaid_id = 'B'
+    db_session.commit()
+
+    # Profondeur ramenée au maximum configuré ; couche au-delà du budget de nœuds non ajoutée
+    monkeypatch.setitem(client.application.config, 'MERMAID_WINDOW_MAX_DEPTH', 1)
+    assert client.get(export_url + '?focus=C&depth=5').headers['ETag'] == client.get(export_url + '?focus=C&depth=1').headers['ETag']
+    monkeypatch.setitem(client.application.config, 'MERMAID_WINDOW_MAX_NODES', 2)
+    truncated = client.get(export_url + '?focus=C&depth=1').get_data(as_text=True)
+    assert "%% Window truncated (max 2 nodes)" in truncated
+    assert truncated.endswith(f"{stub['B']}-->|oui|C\nC-->{stub['D']}")
+    assert client.get(export_url + '?subgraph=G1&depth=1').status_code == 200
+    assert client.get(export_url + '?focus=A,B,C').status_code == 400
+
+    assert client.get(export_url + '?focus=Z').status_code == 404
+    assert client.get(export_url + '?subgraph=G9').status_code == 404
+    assert client.get(export_url + '?focus=C&depth=-1').status_code == 400
+    assert client.get(export_url + '?focus=C&format=json').status_code == 400
+
 def test_export_mermaid_not_found(client, db_session):
     """Teste l'exportation d'un SubProject inexistant."""
     non_existent_id = 9999
@@ -228,4 +973,265 @@ def test_export_mermaid_empty_subproject(client, db_session):
     generated_code = response.get_data(as_text=True)
 
     # Un SP vide devrait générer au minimum la déclaration graph TD
-    assert generated_code.strip() == "graph TD"
\ No newline at end of file
+    assert generated_code.strip() == "graph TD"
+
+# --- Tests unitaires de l'analyseur (sans base de données) ---
+
+def test_parser_chained_edges_and_fan_out():
+    """Teste les chaînes de liens (A --> B --> C) et les groupes '&'."""
+    mermaid_code = """
+    graph LR
+        A --> B --> C
+        D & E -.-> F & G
+    """
+    graph = _parse_mermaid_elements(mermaid_code)
+
+    assert graph.direction == "LR"
+    assert set(graph.node_ids) == {"A", "B", "C", "D", "E", "F", "G"}
+    pairs = [(edge.source, edge.target) for edge in graph.iter_edges()]
+    assert pairs == [("A", "B"), ("B", "C"), ("D", "F"), ("D", "G"), ("E", "F"), ("E", "G")]
+    assert all(edge.link_type == LinkType.VISIBLE for edge in graph.iter_edges())
+
+
+def test_parser_link_variants_and_labels():
+    """Teste les liens épais, pointillés, ouverts et les deux syntaxes d'étiquette."""
+    mermaid_code = """
+    graph TD
+        A ==>|épais| B
+        B -- texte intégré --> C
+        C -. pointillé .-> D
+        D --- E
+        E ~~~ F
+    """
+    edges = list(_parse_mermaid_elements(mermaid_code).iter_edges())
+
+    labels = [edge.label for edge in edges]
+    link_types = [edge.link_type for edge in edges]
+    assert labels == ["épais", "texte intégré", "pointillé", None, None]
+    assert link_types == [LinkType.VISIBLE, LinkType.VISIBLE, LinkType.VISIBLE, LinkType.INVISIBLE, LinkType.INVISIBLE]
+
+
+def test_parser_node_shapes_classes_and_subgraphs():
+    """Teste les formes de nœuds, le raccourci ':::' et le regroupement par subgraph."""
+    mermaid_code = """
+    graph TD
+        classDef hot fill:#f00
+        A(["Stade"]) --> B[(Base)]
+        C((Cercle)):::hot
+        subgraph cluster_1["Chapitre 1"]
+            D{{Hexagone}} --> E[/Trapèze\\]
+        end
+        class A hot
+        class cluster_1 hot
+    """
+    graph = _parse_mermaid_elements(mermaid_code)
+
+    assert graph.classdefs == {"hot": "fill:#f00"}
+    assert graph.node("A").title == "Stade" and graph.node("A").style_class_ref == "hot"
+    assert graph.node("B").title == "Base"
+    assert graph.node("C").title == "Cercle" and graph.node("C").style_class_ref == "hot"
+    assert graph.node("E").title == "Trapèze"
+    assert graph.node("cluster_1") is None  # 'class' appliqué à un subgraph ne crée pas de nœud
+    assert graph.subgraphs == {"cluster_1": ["D", "E"]}
+
+
+def test_parsed_graph_columnar_storage():
+    """Teste le stockage en colonnes du ParsedGraph (indices de nœuds, étiquettes creuses, pickling)."""
+    graph = parse_flowchart("graph TD\nA --> B\nB -->|oui| C\nA -.-> C".split('\n'))
+
+    assert graph.node_count == 3 and graph.edge_count == 3
+    assert list(graph.edge_sources) == [0, 1, 0] and list(graph.edge_targets) == [1, 2, 2]
+    assert graph.edge_labels == {1: "oui"}
+    assert graph.node("C").text_content == "C"
+    # Transmis tel quel par les processus de l'import en masse
+    copy = pickle.loads(pickle.dumps(graph))
+    assert list(copy.iter_edges()) == list(graph.iter_edges())
+    assert copy.node_index == graph.node_index
+
+
+def test_parser_reports_line_and_column():
+    """Teste que les erreurs de syntaxe indiquent la ligne et la colonne."""
+    with pytest.raises(MermaidParsingError) as exc_info:
+        _parse_mermaid_elements("graph TD\nA --> B\nC[non terminé")
+
+    assert exc_info.value.line == 3
+    assert exc_info.value.column == 2
+
+
+def test_parse_cache_hits_on_normalized_definition():
+    """Teste que le cache d'analyse réutilise le résultat d'une définition équivalente et reste borné."""
+    cache = MermaidParseCache(max_entries=2)
+    parse = lambda code: parse_flowchart(code.split('\n'))
+
+    first = cache.get_or_parse("graph TD\nA --> B", parse)
+    second = cache.get_or_parse("  graph TD  \r\nA --> B\n\n", parse)
+    assert second is first
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    cache.get_or_parse("graph TD\nB --> C", parse)
+    cache.get_or_parse("graph TD\nC --> D", parse)
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['evictions'] == 1
+
+
+def test_copy_rows_encoding():
+    """Teste l'encodage des lignes au format texte de COPY (NULL, tabulations, retours à la ligne, antislashs)."""
+    buffer = encode_copy_rows([
+        (0, "A", None, "Texte\tavec\ntab", "c:\\dossier"),
+        (1, "B", "Titre", "Simple", None),
+    ])
+    assert buffer.read() == (
+        "0\tA\t\\N\tTexte\\tavec\\ntab\tc:\\\\dossier\n"
+        "1\tB\tTitre\tSimple\t\\N\n"
+    )
+
+    # Lecture par morceaux : les lignes ne sont encodées qu'au fil des lectures
+    consumed = []
+    rows = ((consumed.append(i) or (i, "x" * 10)) for i in range(1000))
+    stream = encode_copy_rows(rows)
+    assert stream.read(20) == "0\txxxxxxxxxx\n1\txxxxx"
+    assert consumed == [0, 1]
+    remainder = stream.read(10_000) + stream.read(10_000)
+    assert remainder.startswith("xxxxx\n2\t") and remainder.endswith("999\txxxxxxxxxx\n")
+    assert stream.read(10) == ""
+
+
+def test_validate_collects_all_diagnostics():
+    """Teste que la validation à blanc rapporte toutes les erreurs avec leur position, sans s'arrêter à la première."""
+    result = validate_mermaid(
+        "graph TD\nclassDef a fill:#f00\nA[Début] --> B\nB -->\nclass B inconnue\nend\nsubgraph S\nC"
+    )
+
+    assert result['valid'] is False
+    assert result['direction'] == "TD"
+    assert [(d['severity'], d['line'], d['column']) for d in result['diagnostics']] == [
+        ('error', 4, 6), ('warning', 5, 1), ('error', 6, 1), ('error', 7, 1)
+    ]
+    assert result['counts'] == {'nodes': 3, 'relationships': 1, 'classdefs': 1, 'subgraphs': 1}
+    assert result['parse_ms'] >= 0
+
+def test_validate_endpoint(client):
+    """Teste l'endpoint /api/mermaid/validate (JSON et texte brut)."""
+    response = client.post('/api/mermaid/validate', json={"code": "graph LR\nA --> B"})
+    assert response.status_code == 200
+    data = json.loads(response.get_data(as_text=True))
+    assert data['valid'] is True
+    assert data['diagnostics'] == []
+    assert data['counts']['nodes'] == 2
+
+    response = client.post('/api/mermaid/validate', data="flowchart\nA --> B", content_type='text/plain')
+    data = json.loads(response.get_data(as_text=True))
+    assert data['valid'] is False
+    assert data['diagnostics'][0]['line'] == 1
+
+    assert client.post('/api/mermaid/validate', json={}).status_code == 400
+
+
+def test_parse_limits_reject_oversized_input():
+    """Teste les budgets d'analyse : longueur de ligne, nombre de lignes, nombre d'entités."""
+    code = "graph TD\nA --> B\nB --> C"
+    assert parse_flowchart(code.split('\n'), limits=ParseLimits(10, 3, 5)).direction == 'TD'
+
+    with pytest.raises(MermaidInputTooLarge) as excinfo:
+        parse_flowchart(["graph TD", "A[" + "x" * 50 + "]"], limits=ParseLimits(max_line_length=20))
+    assert excinfo.value.code == 413
+    assert excinfo.value.line == 2
+    with pytest.raises(MermaidInputTooLarge):
+        parse_flowchart(code.split('\n'), limits=ParseLimits(max_lines=2))
+    with pytest.raises(MermaidInputTooLarge):
+        parse_flowchart(code.split('\n'), limits=ParseLimits(max_entities=4))
+    # Le mode diagnostic ne transforme pas un dépassement en diagnostic
+    with pytest.raises(MermaidInputTooLarge):
+        validate_mermaid(code, ParseLimits(max_lines=2))
+
+
+
+def test_parse_deadline_checked_on_long_lines(monkeypatch):
+    """Teste que l'échéance d'analyse est aussi contrôlée au volume de caractères, pas seulement toutes les N lignes."""
+    import app.services.mermaid_grammar as grammar
+    clock = iter(range(1000))
+    monkeypatch.setattr(grammar.time, 'monotonic', lambda: next(clock))  # Une seconde par lecture de l'horloge
+    long_line = "A[" + "x" * (grammar.DEADLINE_CHECK_CHARS // 2) + "] --> B"
+    with pytest.raises(MermaidInputTooLarge) as excinfo:
+        parse_flowchart(["graph TD", long_line, long_line, long_line], limits=ParseLimits(timeout=0.5))
+    assert excinfo.value.line == 3
+
+def test_parser_helpers_without_app_context():
+    """Teste que l'analyse reste utilisable hors contexte d'application et que le cache distingue les budgets."""
+    import threading
+
+    code = "graph TD\nA --> B\nB --> C\nC --> D"
+    results = {}
+    # Un nouveau thread n'hérite pas du contexte d'application du test
+    thread = threading.Thread(target=lambda: results.update(
+        hash=compute_structure_hash(code), nodes=len(_parse_mermaid_elements(code).node_ids)
+    ))
+    thread.start()
+    thread.join()
+    assert results == {'hash': compute_structure_hash(code, ParseLimits()), 'nodes': 4}
+
+    # Le résultat obtenu sans budget n'est pas servi sous un budget plus strict
+    with pytest.raises(MermaidInputTooLarge):
+        _parse_mermaid_elements(code, ParseLimits(max_lines=2))
+
+
+def test_import_over_limits_returns_413(client, db_session, monkeypatch):
+    """Teste que /import et /validate répondent 413 au-delà des budgets configurés."""
+    monkeypatch.setitem(client.application.config, 'MERMAID_MAX_LINE_LENGTH', 50)
+    code = "graph TD\nA[" + "x" * 100 + "] --> B"
+
+    response = client.post('/api/mermaid/import', json={"code": code})
+    assert response.status_code == 413
+    assert 'error' in json.loads(response.get_data(as_text=True))
+
+    response = client.post('/api/mermaid/import', data=code, content_type='text/plain')
+    assert response.status_code == 413
+    assert client.post('/api/mermaid/validate', json={"code": code}).status_code == 413
+    assert db_session.query(Project).count() == 0
+
+
+def test_parser_source_map_line_spans():
+    """Teste la carte des sources produite par l'analyseur (lignes numérotées à partir de 1)."""
+    mermaid_code = """graph TD
+classDef red fill:#f00
+A --> B
+subgraph S1[Groupe]
+    B[Bee]
+    C
+end
+A --> B
+class C red"""
+    source_map = new_source_map()
+    parse_flowchart(mermaid_code.split('\n'), source_map=source_map)
+    assert source_map['nodes'] == {'A': [3, 3], 'B': [5, 5], 'C': [6, 6]}
+    assert source_map['edges'] == {'A B': [[3, 3], [8, 8]]}
+    assert source_map['classdefs'] == {'red': [2, 2]}
+    assert source_map['subgraphs'] == {'S1': [4, 7]}
+
+
+def test_source_map_follows_definition(client, db_session):
+    """Teste que la carte stockée suit la définition importée puis régénérée."""
+    mermaid_code = "graph TD\nclassDef hot fill:#f00\nA[Début] --> B\nsubgraph G[Groupe]\n  B\nend\nclass A hot"
+    project = parse_and_save_mermaid(mermaid_code, "Carte")
+    subproject = project.subprojects[0]
+    assert subproject.source_map['nodes']['A'] == [3, 3]
+
+    response = client.get(f'/api/mermaid/source-map/{subproject.id}')
+    assert response.status_code == 200
+    data = json.loads(response.get_data(as_text=True))
+    assert data['source_map']['subgraphs']['G'] == [4, 6]
+
+    # La carte du générateur décrit exactement le texte généré
+    generated, generated_map = generate_mermaid_document(subproject.id)
+    parsed_map = new_source_map()
+    parse_flowchart(generated.split('\n'), source_map=parsed_map)
+    assert generated_map == parsed_map
+
+    # Une définition réécrite sans synchronisation est recalculée à la lecture
+    subproject.mermaid_definition = "graph TD\n\nA --> B"
+    db_session.commit()
+    assert subproject.source_map is None
+    data = json.loads(client.get(f'/api/mermaid/source-map/{subproject.id}').get_data(as_text=True))
+    assert data['source_map']['edges'] == {'A B': [[3, 3]]}
+    assert client.get('/api/mermaid/source-map/999999').status_code == 404
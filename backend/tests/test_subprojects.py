@@ -3,7 +3,7 @@
 
 import pytest
 import json
-from app.models import Project, SubProject
+from app.models import Project, SubProject, Relationship
 
 # Base URL pour les endpoints de sous-projets
 SUBPROJECTS_URL = '/api/subprojects/'
@@ -247,6 +247,51 @@ def test_update_subproject_success(client, db_session):
     assert updated_subproject.mermaid_definition == update_data['mermaid_definition']
     assert updated_subproject.visual_layout == update_data['visual_layout']
 
+def test_update_subproject_cosmetic_change_skips_resync(client, db_session):
+    """Teste qu'un changement purement cosmétique du texte Mermaid ne resynchronise pas la structure."""
+    project = Project(title="Projet Empreinte")
+    db_session.add(project)
+    db_session.commit()
+
+    response = client.post(SUBPROJECTS_URL, json={
+        "project_id": project.id,
+        "title": "SP Empreinte",
+        "mermaid_definition": "graph TD\nA[Alpha] --> B\nB --> C"
+    })
+    assert response.status_code == 201
+    subproject_id = response.get_json()['id']
+    structure_hash = db_session.get(SubProject, subproject_id).structure_hash
+    assert structure_hash is not None
+
+    # Une couleur posée en base serait perdue par une resynchronisation complète
+    relationship = db_session.query(Relationship).filter_by(subproject_id=subproject_id).first()
+    relationship.color = "#ff0000"
+    db_session.commit()
+
+    cosmetic_definition = "graph TD\n%% commentaire\n  B --> C\nA[Alpha]   -->   B\n"
+    response = client.put(f"{SUBPROJECTS_URL}{subproject_id}", json={
+        "project_id": project.id,
+        "title": "SP Empreinte",
+        "mermaid_definition": cosmetic_definition
+    })
+    assert response.status_code == 200
+    assert response.get_json()['mermaid_definition'] == cosmetic_definition
+
+    db_session.expire_all()
+    assert db_session.get(SubProject, subproject_id).structure_hash == structure_hash
+    assert db_session.get(Relationship, relationship.id).color == "#ff0000"
+
+    # Un vrai changement de structure est resynchronisé et change l'empreinte
+    response = client.put(f"{SUBPROJECTS_URL}{subproject_id}", json={
+        "project_id": project.id,
+        "title": "SP Empreinte",
+        "mermaid_definition": "graph TD\nA[Alpha] --> B\nB --> D"
+    })
+    assert response.status_code == 200
+    assert sorted(node['mermaid_id'] for node in response.get_json()['nodes']) == ['A', 'B', 'D']
+    db_session.expire_all()
+    assert db_session.get(SubProject, subproject_id).structure_hash not in (None, structure_hash)
+
 def test_update_subproject_not_found(client, db_session):
     """Teste la mise à jour d'un sous-projet avec un ID inexistant."""
     non_existent_id = 9999